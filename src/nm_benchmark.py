@@ -0,0 +1,439 @@
+import asyncio
+import glob
+import heapq
+import json
+import math
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from matplotlib.pyplot import imread
+import numpy
+
+import nm_meshfile
+import nm_pathfinder
+from nm_meshcompiler import as_compiled
+from nm_landmarks import build_landmarks
+from nm_meshupdate import update_mesh
+from nm_parallel import ParallelSolver
+from nm_replanner import DStarLite
+from nm_service import PathService
+
+
+DEFAULT_MESHES = ['../input/homer.png.mesh.pickle', '../input/ucsc_banana_slug.png.mesh.pickle']
+SEARCHES = ['dijkstra', 'aStar', 'bidirectional']
+ALGORITHMS = ['breadth_first_search', 'dijkstra', 'aStar', 'bidirectional']
+
+
+def load_mesh(filename):
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def sample_queries(mesh, count, seed=0):
+    # reproducible (source, destination) pairs, each point inside a random box
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        points = []
+        for x1, x2, y1, y2 in (rng.choice(mesh['boxes']), rng.choice(mesh['boxes'])):
+            # integer points that stay inside boxes with fractional corners too
+            points.append((rng.randint(math.ceil(x1), max(math.ceil(x1), math.floor(x2))),
+                           rng.randint(math.ceil(y1), max(math.ceil(y1), math.floor(y2)))))
+        queries.append(tuple(points))
+    return queries
+
+
+def measure_allocations(search, queries, mesh):
+    # average peak traced memory of one query, and wall time per query with tracing off
+    peaks = []
+    for source_point, destination_point in queries:
+        tracemalloc.start()
+        search(source_point, destination_point, mesh, [], {})
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    start = time.perf_counter()
+    for source_point, destination_point in queries:
+        search(source_point, destination_point, mesh, [], {})
+    elapsed = time.perf_counter() - start
+
+    return sum(peaks) / len(peaks), max(peaks), elapsed / len(queries)
+
+
+# =============================================================================
+# BASELINE SEARCHES ===========================================================
+# =============================================================================
+# the searches as they were before the compiled mesh: legacy dict, linear box lookup
+# and a copied point list per relaxation. Kept only as the reference the allocation
+# benchmark measures the current searches against; console prints are left out
+
+def legacy_containing_box(point, boxes):
+    for box in boxes:
+        if nm_pathfinder.point_in_box(point, box):
+            return box
+    return None
+
+
+def legacy_dijkstra(source_point, destination_point, mesh, path, boxes):
+    source_box = legacy_containing_box(source_point, mesh['boxes'])
+    destination_box = legacy_containing_box(destination_point, mesh['boxes'])
+    if (source_box is None) or (destination_box is None):
+        return
+    path.append(source_point)
+
+    cellPaths = {source_box: [source_point]}
+    cellPathCosts = {source_box: 0}
+    queue = [(0, source_box)]
+    while queue:
+        priority, current_box = heapq.heappop(queue)
+        if (current_box not in boxes or boxes[current_box] > priority):
+            boxes[current_box] = priority
+        if current_box == destination_box:
+            path.extend(cellPaths[current_box])
+            path.append(destination_point)
+            return None
+        for neighbor in mesh['adj'][current_box]:
+            prev_point = cellPaths[current_box][-1] if cellPaths[current_box] else source_point
+            middle_point = nm_pathfinder.find_closest_point(prev_point, neighbor)
+            cost_to_neighbor = priority + nm_pathfinder.distance(prev_point, middle_point)
+            if neighbor not in cellPathCosts or cost_to_neighbor < cellPathCosts[neighbor]:
+                cellPathCosts[neighbor] = cost_to_neighbor
+                cellPaths[neighbor] = cellPaths[current_box] + [middle_point]
+                heapq.heappush(queue, (cost_to_neighbor, neighbor))
+    return False
+
+
+def legacy_aStar(source_point, destination_point, mesh, path, boxes):
+    source_box = legacy_containing_box(source_point, mesh['boxes'])
+    destination_box = legacy_containing_box(destination_point, mesh['boxes'])
+    if (source_box is None) or (destination_box is None):
+        return
+    path.append(source_point)
+
+    cellPaths = {source_box: [source_point]}
+    cellPathCosts = {source_box: 0}
+    queue = [(0, source_box)]
+    while queue:
+        priority, current_box = heapq.heappop(queue)
+        if (current_box not in boxes or boxes[current_box] > priority):
+            boxes[current_box] = priority
+        if current_box == destination_box:
+            path.extend(cellPaths[current_box])
+            path.append(destination_point)
+            return None
+        for neighbor in mesh['adj'][current_box]:
+            prev_point = cellPaths[current_box][-1] if cellPaths[current_box] else source_point
+            middle_point = nm_pathfinder.find_closest_point(prev_point, neighbor)
+            cost_to_neighbor = cellPathCosts[current_box] + nm_pathfinder.distance(prev_point, middle_point)
+            estimated_cost = cost_to_neighbor + nm_pathfinder.distance(middle_point, destination_point)
+            if neighbor not in cellPathCosts or cost_to_neighbor < cellPathCosts[neighbor]:
+                cellPathCosts[neighbor] = cost_to_neighbor
+                cellPaths[neighbor] = cellPaths[current_box] + [middle_point]
+                heapq.heappush(queue, (estimated_cost, neighbor))
+    return False
+
+
+def legacy_bidirectional(source_point, destination_point, mesh, path, boxes):
+    source_box = legacy_containing_box(source_point, mesh['boxes'])
+    destination_box = legacy_containing_box(destination_point, mesh['boxes'])
+    if (source_box is None) or (destination_box is None):
+        return
+
+    forwardPaths = {source_box: [source_point]}
+    forwardCosts = {source_box: 0}
+    backwardPaths = {destination_box: [destination_point]}
+    backwardCosts = {destination_box: 0}
+    queue = [(0, source_box, 'forward'), (0, destination_box, 'backward')]
+    heapq.heapify(queue)
+    while queue:
+        priority, current_box, direction = heapq.heappop(queue)
+        if direction == 'forward':
+            currentPaths, currentCosts, otherPaths = forwardPaths, forwardCosts, backwardPaths
+            currentSource, currentDestination = source_point, destination_point
+        else:
+            currentPaths, currentCosts, otherPaths = backwardPaths, backwardCosts, forwardPaths
+            currentSource, currentDestination = destination_point, source_point
+        if (current_box not in boxes or boxes[current_box] > priority):
+            boxes[current_box] = priority
+        if current_box in otherPaths:
+            path.extend(currentPaths[current_box])
+            path.extend(nm_pathfinder.reversePath(otherPaths[current_box]))
+            return None
+        for neighbor in mesh['adj'][current_box]:
+            prev_point = currentPaths[current_box][-1] if currentPaths[current_box] else currentSource
+            middle_point = nm_pathfinder.find_closest_point(prev_point, neighbor)
+            cost_to_neighbor = currentCosts[current_box] + nm_pathfinder.distance(prev_point, middle_point)
+            estimated_cost = cost_to_neighbor + nm_pathfinder.distance(middle_point, currentDestination)
+            if neighbor not in currentCosts or cost_to_neighbor < currentCosts[neighbor]:
+                currentCosts[neighbor] = cost_to_neighbor
+                currentPaths[neighbor] = currentPaths[current_box] + [middle_point]
+                heapq.heappush(queue, (estimated_cost, neighbor, direction))
+    return False
+
+
+LEGACY_SEARCHES = {'dijkstra': legacy_dijkstra, 'aStar': legacy_aStar, 'bidirectional': legacy_bidirectional}
+
+
+def measure_parallel(mesh, queries, worker_counts):
+    # queries per second of ParallelSolver at each pool size, pools are warmed up first
+    rates = []
+    for workers in worker_counts:
+        with ParallelSolver(mesh, workers=workers, chunk_size=max(1, len(queries) // (4 * workers))) as solver:
+            solver.find_paths(queries[:workers])
+            start = time.perf_counter()
+            solver.find_paths(queries)
+            rates.append(len(queries) / (time.perf_counter() - start))
+    return rates
+
+
+def path_length(path):
+    return sum(nm_pathfinder.distance(a, b) for a, b in zip(path, path[1:]))
+
+
+def measure_expansions(search, queries, mesh, **options):
+    # total boxes explored over the queries and the total length of the paths found
+    expanded, length = 0, 0.0
+    for source_point, destination_point in queries:
+        path, boxes = [], {}
+        search(source_point, destination_point, mesh, path, boxes, **options)
+        expanded += len(boxes)
+        length += path_length(path)
+    return expanded, length
+
+
+def benchmark_allocations(filenames):
+    for filename in filenames:
+        mesh = load_mesh(filename)
+        as_compiled(mesh)  # compile up front so it is not charged to the first query
+        queries = sample_queries(mesh, 200)
+
+        print("%s (%d boxes, %d queries)" % (filename, len(mesh['boxes']), len(queries)))
+        for name in SEARCHES:
+            # the baseline runs on the same legacy dict, which it never compiles
+            for label, search in (('baseline', LEGACY_SEARCHES[name]), ('current', getattr(nm_pathfinder, name))):
+                mean_peak, max_peak, per_query = measure_allocations(search, queries, mesh)
+                print("  %-14s %-8s mean peak %9.1f KiB   max peak %9.1f KiB   %8.3f ms/query"
+                      % (name, label, mean_peak / 1024, max_peak / 1024, per_query * 1000))
+
+
+def benchmark_parallel(filenames):
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1)))
+    for filename in filenames:
+        mesh = load_mesh(filename)
+        queries = sample_queries(mesh, 2000)
+        rates = measure_parallel(mesh, queries, worker_counts)
+
+        print("%s (%d boxes, %d queries, %d cores)" % (filename, len(mesh['boxes']), len(queries), cores))
+        for workers, rate in zip(worker_counts, rates):
+            print("  %2d workers %9.1f queries/s   speedup %5.2fx" % (workers, rate, rate / rates[0]))
+        if cores == 1:
+            print("  only one core here, scaling cannot be measured")
+
+
+def benchmark_landmarks(filenames):
+    for filename in filenames:
+        mesh = as_compiled(load_mesh(filename))
+        queries = sample_queries(mesh, 300)
+        heuristics = [('euclidean', None)]
+        for strategy in ['farthest', 'random']:
+            start = time.perf_counter()
+            landmarks = build_landmarks(mesh, 8, strategy)
+            heuristics.append(('alt %s' % strategy, landmarks))
+            print("%s: %d %s landmarks built in %.2f s" % (filename, len(landmarks['landmarks']),
+                                                          strategy, time.perf_counter() - start))
+
+        for name in ['aStar', 'bidirectional']:
+            baseline = None
+            for label, landmarks in heuristics:
+                expanded, length = measure_expansions(getattr(nm_pathfinder, name), queries, mesh,
+                                                      landmarks=landmarks)
+                baseline = baseline or (expanded, length)
+                print("  %-14s %-13s %8d expansions (%5.1f%%)   path length %6.3fx"
+                      % (name, label, expanded, 100.0 * expanded / baseline[0], length / baseline[1]))
+
+
+def measure_load(load, filename, repeat=20):
+    # best wall time of loading filename into a compiled mesh ready to search
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        load(filename)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark_load(filenames):
+    for filename in filenames:
+        # the binary copy goes to a scratch directory, not next to the pickle
+        with tempfile.TemporaryDirectory() as directory:
+            binary_filename = os.path.join(directory, os.path.basename(filename)[:-len('.pickle')] + '.bin')
+            nm_meshfile.save_mesh(load_mesh(filename), binary_filename)
+            loaders = [('pickle + compile', lambda name: as_compiled(load_mesh(name)), filename),
+                       ('binary (memmap)', nm_meshfile.load_mesh, binary_filename),
+                       ('binary (read)', lambda name: nm_meshfile.load_mesh(name, mmap=False), binary_filename)]
+
+            print("%s (%d bytes pickled, %d bytes binary)"
+                  % (filename, os.path.getsize(filename), os.path.getsize(binary_filename)))
+            baseline = None
+            for label, load, name in loaders:
+                elapsed = measure_load(load, name)
+                baseline = baseline or elapsed
+                print("  %-18s %8.3f ms   speedup %5.2fx" % (label, elapsed * 1000, baseline / elapsed))
+
+
+def load_image(mesh_filename):
+    # map.png.mesh.pickle was built from map.png
+    image = (imread(mesh_filename[:-len('.mesh.pickle')]) * 255).astype(numpy.uint8)
+    return image[:, :, 0] if len(image.shape) > 2 else image
+
+
+def benchmark_replanning(filenames, rounds=50, min_feature_size=16):
+    # blocks a small square on each agent's current path, then compares repairing
+    # the D* Lite state with planning again from scratch
+    for filename in filenames:
+        mesh = load_mesh(filename)
+        mesh.pop('compiled', None)
+        image = load_image(filename)
+        queries = sample_queries(mesh, rounds, seed=1)
+        repair, scratch, repair_expanded, scratch_expanded, replans = 0.0, 0.0, 0, 0, 0
+
+        for source_point, destination_point in queries:
+            planner = DStarLite(mesh, destination_point)
+            path, _ = planner.find_path(source_point)
+            if len(path) < 3:
+                continue
+            x, y = (int(v) for v in path[len(path) // 2])
+            rect = (x - 2, x + 2, y - 2, y + 2)
+            image[rect[0]:rect[1], rect[2]:rect[3]] = 0
+            planner.mesh_changed(*update_mesh(mesh, image, rect, min_feature_size))
+
+            expanded = planner.expansions
+            start = time.perf_counter()
+            planner.find_path(source_point)
+            repair += time.perf_counter() - start
+            repair_expanded += planner.expansions - expanded
+
+            start = time.perf_counter()
+            fresh = DStarLite(mesh, destination_point)
+            fresh.find_path(source_point)
+            scratch += time.perf_counter() - start
+            scratch_expanded += fresh.expansions
+            replans += 1
+
+        print("%s (%d boxes after %d edits)" % (filename, len(mesh['boxes']), replans))
+        print("  repaired      %8.3f ms/replan   %8d expansions" % (repair * 1000 / replans, repair_expanded))
+        print("  from scratch  %8.3f ms/replan   %8d expansions" % (scratch * 1000 / replans, scratch_expanded))
+
+
+def percentile(values, fraction):
+    # nearest-rank percentile of an already sorted list
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+
+def measure_search(search, queries, mesh, reference=None):
+    # one algorithm over the queries: latency, counters from SearchStats, peak traced
+    # memory, and path length against the reference (dijkstra) lengths when given
+    stats = nm_pathfinder.SearchStats()
+    latencies, lengths = [], []
+    for source_point, destination_point in queries:
+        path, found = [], stats.found
+        start = time.perf_counter()
+        search(source_point, destination_point, mesh, path, {}, stats=stats)
+        latencies.append(time.perf_counter() - start)
+        # failed searches may leave a partial path behind, so ask the stats
+        lengths.append(path_length(path) if stats.found > found else None)
+
+    mean_peak, max_peak, _ = measure_allocations(search, queries[:max(1, len(queries) // 4)], mesh)
+    latencies.sort()
+    summary = stats.summary()
+    result = {
+        'queries': len(queries),
+        'found': summary['found'],
+        'throughput_qps': len(queries) / sum(latencies),
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'latency_mean_ms': sum(latencies) / len(latencies) * 1000,
+        'expanded_mean': summary['mean_expanded'],
+        'pushes_mean': summary['mean_pushes'],
+        'stale_pops_mean': summary['mean_stale_pops'],
+        'max_frontier': summary['max_frontier'],
+        'peak_memory_mean_kib': mean_peak / 1024,
+        'peak_memory_max_kib': max_peak / 1024,
+    }
+
+    if reference is not None:
+        ratios = [length / best for length, best in zip(lengths, reference)
+                  if length is not None and best]
+        result['length_ratio_mean'] = sum(ratios) / len(ratios) if ratios else None
+        result['length_ratio_max'] = max(ratios) if ratios else None
+        result['found_mismatches'] = sum((length is None) != (best is None)
+                                         for length, best in zip(lengths, reference))
+    return result, lengths
+
+
+def benchmark_suite(filenames, count=200, seed=0):
+    # every algorithm on every mesh, printed as one JSON document for regression tracking
+    report = {'seed': seed, 'queries_per_mesh': count, 'meshes': {}}
+    for filename in filenames:
+        mesh = as_compiled(load_mesh(filename))
+        queries = sample_queries(mesh, count, seed)
+        searches = {}
+        _, reference = measure_search(nm_pathfinder.dijkstra, queries, mesh)
+        for name in ALGORITHMS:
+            searches[name], _ = measure_search(getattr(nm_pathfinder, name), queries, mesh, reference)
+        report['meshes'][os.path.basename(filename)] = {'boxes': len(mesh['rows']), 'searches': searches}
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+async def drive_service(mesh, queries, clients, timeout, **options):
+    # clients send their share of queries one after another; every fourth query
+    # repeats one of a few popular pairs, so some of them arrive while it is in flight
+    popular = queries[:8]
+    async with PathService(mesh, **options) as service:
+        async def client(first):
+            for i in range(first, len(queries), clients):
+                source_point, destination_point = popular[i % len(popular)] if i % 4 == 0 else queries[i]
+                await service.find_path(source_point, destination_point, timeout)
+        await asyncio.gather(*[client(first) for first in range(clients)])
+        return service.stats()
+
+
+def benchmark_service(filenames, count=400, clients=32, timeout=0.05):
+    # in-process load test of nm_service, printed as JSON; no socket is opened
+    report = {}
+    for filename in filenames:
+        mesh = as_compiled(load_mesh(filename))
+        queries = sample_queries(mesh, count, seed=2)
+        report[os.path.basename(filename)] = asyncio.run(drive_service(mesh, queries, clients, timeout, queue_size=16))
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+
+BENCHMARKS = {'allocations': benchmark_allocations, 'parallel': benchmark_parallel,
+              'landmarks': benchmark_landmarks, 'load': benchmark_load,
+              'replanning': benchmark_replanning, 'suite': benchmark_suite,
+              'service': benchmark_service}
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    benchmark = benchmark_allocations
+    if args and args[0] in BENCHMARKS:
+        benchmark = BENCHMARKS[args.pop(0)]
+    elif args and not args[0].endswith('.pickle'):
+        print("usage: %s [%s] [mesh.pickle ...]" % (sys.argv[0], '|'.join(BENCHMARKS)))
+        sys.exit(-1)
+
+    if args:
+        benchmark(args)
+    elif benchmark is benchmark_suite:
+        benchmark(sorted(glob.glob('../input/*.mesh.pickle')))
+    else:
+        benchmark(DEFAULT_MESHES)
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from heapq import heappop, heappush
+from math import inf
+from time import perf_counter
+
+import numpy
+
+import nm_pathfinder
+from nm_meshcompiler import as_compiled
+
+
+NO_BOX = -1
+
+
+def build_flow_field (mesh, destination_box, weights=None):
+    # reverse dijkstra from destination_box over center-to-center adjacency lengths.
+    # costs[b] is the cost-to-go from box b, next[b] the neighbor to step into
+    # (NO_BOX at the destination and wherever it cannot be reached)
+    mesh = as_compiled(mesh)
+    count = len(mesh['rows'])
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    if weights is None:
+        weights = mesh['edge_costs'].tolist()
+
+    costs = [inf] * count
+    next_box = [NO_BOX] * count
+    costs[destination_box] = 0
+    queue = [(0, destination_box)]
+    while queue:
+        cost, current_box = heappop(queue)
+        if cost > costs[current_box]:
+            continue
+        for edge in range(offsets[current_box], offsets[current_box + 1]):
+            neighbor = neighbors[edge]
+            cost_to_neighbor = cost + weights[edge]
+            if cost_to_neighbor < costs[neighbor]:
+                costs[neighbor] = cost_to_neighbor
+                next_box[neighbor] = current_box
+                heappush(queue, (cost_to_neighbor, neighbor))
+
+    return {'destination': destination_box,
+            'costs': numpy.array(costs, dtype=numpy.float64),
+            'next': numpy.array(next_box, dtype=numpy.int32)}
+
+
+def follow_field (field, box_id):
+    # box ids from box_id down the field to its destination, None if unreachable
+    if box_id != field['destination'] and field['next'][box_id] == NO_BOX:
+        return None
+    next_box = field['next']
+    corridor = [box_id]
+    while box_id != field['destination']:
+        box_id = int(next_box[box_id])
+        corridor.append(box_id)
+    return corridor
+
+
+class FlowFieldCache:
+
+    """
+    LRU cache of flow fields, one per destination box
+
+    The first agent heading to a destination pays for one reverse dijkstra over
+    the whole mesh; every agent after it reads its corridor off the field in
+    O(path length). Like PathCache, the cache empties itself when it is handed
+    a different mesh or the compiled mesh's 'version' moves on.
+    """
+
+    def __init__ (self, capacity=16):
+        self.capacity = capacity
+        self.fields = OrderedDict()  # destination box -> field
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.mesh = None
+        self.version = None
+        self.corridor = []
+        self.weights = None
+
+    def bind (self, mesh):
+        if mesh is not self.mesh or mesh['version'] != self.version:
+            self.fields.clear()
+            self.mesh = mesh
+            self.version = mesh['version']
+            self.weights = mesh['edge_costs'].tolist()
+
+    def field (self, destination_box, boxes=None):
+        # the field towards a box, built on a miss. boxes, if given, receives every
+        # box a miss reached with its cost-to-go, like a search's explored boxes
+        field = self.fields.get(destination_box)
+        if field is not None:
+            self.hits += 1
+            self.fields.move_to_end(destination_box)
+            return field
+
+        self.misses += 1
+        field = build_flow_field(self.mesh, destination_box, self.weights)
+        if boxes is not None:
+            rows, costs = self.mesh['rows'], field['costs']
+            for box_id in numpy.nonzero(costs < inf)[0].tolist():
+                boxes[rows[box_id]] = float(costs[box_id])
+        self.fields[destination_box] = field
+        if len(self.fields) > self.capacity:
+            self.fields.popitem(last=False)
+            self.evictions += 1
+        return field
+
+    def find_path (self, source_point, destination_point, mesh, stats=None):
+        # same contract as nm_pathfinder.find_path. The explored boxes are those this
+        # call searched: none on a hit, every box the new field reached on a miss
+        self.bind(as_compiled(mesh))
+        started = perf_counter() if stats is not None else 0
+        source_box = nm_pathfinder.locate_box(source_point, self.mesh)
+        destination_box = nm_pathfinder.locate_box(destination_point, self.mesh)
+        looked_up = perf_counter() if stats is not None else 0
+        self.corridor = []
+        boxes = {}
+        corridor = None
+        if (source_box is not None) and (destination_box is not None):
+            corridor = follow_field(self.field(destination_box, boxes), source_box)
+        if stats is not None:
+            stats.record('flow_field', corridor is not None, started, looked_up, len(boxes))
+        if corridor is None:
+            return [], boxes.keys()
+
+        self.corridor = corridor    # box ids, as PathSearch.corridor
+        path = nm_pathfinder.clamp_corridor(source_point, destination_point, corridor, self.mesh['rows'])
+        return path, boxes.keys()
+
+    def stats (self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.fields), 'capacity': self.capacity,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
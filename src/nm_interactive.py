@@ -4,17 +4,21 @@ import pickle
 import traceback
 import tkinter
 
+import nm_meshfile
 import nm_pathfinder
 
 if len(sys.argv) != 4:
-    print("usage: %s map.gif map.mesh.pickle subsample_factor" % sys.argv[0])
+    print("usage: %s map.gif map.mesh.pickle|map.mesh.bin subsample_factor" % sys.argv[0])
     sys.exit(-1)
 
 _, MAP_FILENAME, MESH_FILENAME, SUBSAMPLE = sys.argv
 SUBSAMPLE = int(SUBSAMPLE)
 
-with open(MESH_FILENAME, 'rb') as f:
-  mesh = pickle.load(f)
+if MESH_FILENAME.endswith('.bin'):
+  mesh = nm_meshfile.load_mesh(MESH_FILENAME)
+else:
+  with open(MESH_FILENAME, 'rb') as f:
+    mesh = pickle.load(f)
 
 master = tkinter.Tk()
 
@@ -75,7 +79,10 @@ def on_click(event):
     else:
         destination_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
         try:
-            path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh)
+            stats = nm_pathfinder.SearchStats()
+            path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh, stats=stats)
+            print("%s: %d boxes expanded in %.2f ms"
+                  % ("Destination reached" if path else "No path found", stats.expanded, stats.search_time * 1000))
 
         except:
             destination_point = None
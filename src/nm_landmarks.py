@@ -0,0 +1,135 @@
+import random
+from heapq import heappop, heappush
+from math import inf
+
+import numpy
+
+from nm_meshcompiler import as_compiled
+
+
+DEFAULT_LANDMARKS = 8
+STRATEGIES = ['farthest', 'random']
+
+
+# The searches charge a step by the straight distance from the entry point of a box
+# to the border it leaves by, so walking from border e to border f through box b costs
+# at least the gap between the two borders times b's cost. Distances over that graph
+# of borders never exceed a real search's cost, which keeps ALT bounds admissible;
+# center-to-center lengths overshoot whenever a path cuts a box corner.
+# The gaps are often zero (borders meeting at a corner), so the bounds are loose: on
+# the sample maps they barely prune beyond the euclidean heuristic (see
+# `nm_benchmark.py landmarks`) while computing them adds a K x m pass per query.
+
+def border_graph (mesh):
+    # one node per adjacency edge (its border, entered into box neighbors[e]); the
+    # successors of e are the edges of box neighbors[e], so they need no storage of
+    # their own. Returns the per-edge offsets into weights and the weights themselves
+    offsets, neighbors = mesh['offsets'], mesh['neighbors']
+    counts = numpy.diff(offsets)[neighbors]
+    graph_offsets = numpy.zeros(len(neighbors) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=graph_offsets[1:])
+
+    owner = numpy.repeat(numpy.arange(len(neighbors)), counts)
+    successor = offsets[neighbors[owner]] + numpy.arange(len(owner)) - graph_offsets[owner]
+    portals = mesh['portals'].astype(numpy.float64)
+    first, second = portals[owner], portals[successor]
+    gap_x = numpy.maximum(0, numpy.maximum(second[:, 0] - first[:, 1], first[:, 0] - second[:, 1]))
+    gap_y = numpy.maximum(0, numpy.maximum(second[:, 2] - first[:, 3], first[:, 2] - second[:, 3]))
+    weights = numpy.hypot(gap_x, gap_y) * mesh['box_costs'][neighbors[owner]]
+    return graph_offsets.tolist(), weights.tolist()
+
+def landmark_dijkstra (mesh, landmark, graph):
+    # cost from the borders of box landmark to every border, inf where unreachable
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    graph_offsets, weights = graph
+    costs = [inf] * len(neighbors)
+    queue = []
+    for edge in range(offsets[landmark], offsets[landmark + 1]):
+        costs[edge] = 0
+        queue.append((0, edge))
+
+    while queue:
+        cost, edge = heappop(queue)
+        if cost > costs[edge]:
+            continue
+        box = neighbors[edge]
+        shift = graph_offsets[edge] - offsets[box]
+        for successor in range(offsets[box], offsets[box + 1]):
+            cost_to_successor = cost + weights[successor + shift]
+            if cost_to_successor < costs[successor]:
+                costs[successor] = cost_to_successor
+                heappush(queue, (cost_to_successor, successor))
+    return costs
+
+def box_ranges (mesh, distances):
+    # the smallest and largest landmark distance over the borders of each box, inf for
+    # boxes no landmark reaches (or with no borders at all)
+    count = len(mesh['rows'])
+    sources = numpy.repeat(numpy.arange(count), numpy.diff(mesh['offsets']))
+    low = numpy.full((len(distances), count), inf)
+    high = numpy.full((len(distances), count), -inf)
+    for k, row in enumerate(distances):
+        numpy.minimum.at(low[k], sources, row)
+        numpy.maximum.at(high[k], sources, row)
+    high[high == -inf] = inf
+    return low, high
+
+def build_landmarks (mesh, count=DEFAULT_LANDMARKS, strategy='farthest', seed=0):
+    """
+    Picks landmark boxes and stores their distance to every border of the mesh
+
+    Args:
+        mesh: compiled or legacy mesh
+        count: number of landmarks K
+        strategy: 'farthest' (each new landmark is the box farthest from the ones
+            already picked), 'random', or an explicit list of box ids
+        seed: seeds the first farthest-point pick and the random strategy
+
+    Returns:
+
+        A dict with the landmark ids, their (K, m) 'distances' to the border of
+        every adjacency (aligned with mesh['neighbors']), and 'low' / 'high', the
+        (K, n) range of those distances over each box's borders
+    """
+
+    mesh = as_compiled(mesh)
+    box_count = len(mesh['rows'])
+    graph = border_graph(mesh)
+    rng = random.Random(seed)
+    count = min(count, box_count)
+
+    if strategy == 'random':
+        chosen = rng.sample(range(box_count), count)
+    elif strategy == 'farthest':
+        chosen = [rng.randrange(box_count)] if count else []
+    elif isinstance(strategy, str):
+        raise ValueError("unknown landmark strategy %r, expected one of %s or a list of box ids"
+                         % (strategy, STRATEGIES))
+    else:
+        chosen = list(strategy)
+
+    rows = [landmark_dijkstra(mesh, landmark, graph) for landmark in chosen]
+    if strategy == 'farthest':
+        # distance to the nearest landmark so far; unreachable boxes never win so the
+        # landmarks stay inside the first landmark's connected region
+        nearest = box_ranges(mesh, numpy.array(rows[:1]))[0].min(axis=0) if rows else []
+        while len(chosen) < count:
+            candidate = int(numpy.where(nearest < inf, nearest, -1).argmax())
+            if nearest[candidate] in (0, inf):
+                break
+            chosen.append(candidate)
+            rows.append(landmark_dijkstra(mesh, candidate, graph))
+            nearest = numpy.minimum(nearest, box_ranges(mesh, numpy.array(rows[-1:]))[0][0])
+
+    distances = numpy.array(rows, dtype=numpy.float64).reshape(len(chosen), len(mesh['neighbors']))
+    low, high = box_ranges(mesh, distances)
+    return {'landmarks': chosen, 'distances': distances, 'low': low, 'high': high}
+
+def get_landmarks (mesh):
+    # built once per compiled mesh with the default settings, or loaded with the mesh
+    mesh = as_compiled(mesh)
+    landmarks = mesh.get('landmarks')
+    if landmarks is None:
+        landmarks = build_landmarks(mesh)
+        mesh['landmarks'] = landmarks
+    return landmarks
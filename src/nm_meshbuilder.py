@@ -2,125 +2,648 @@ import collections
 import pickle
 import sys
 import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 from matplotlib.pyplot import imread, imsave
 import numpy
 from numpy import zeros_like
 
 
-def build_mesh(image, min_feature_size):
-    def scan(box):
-
-        x1, x2, y1, y2 = box
-        area = (x2 - x1) * (y2 - y1)
-
-        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
-
-            # this box is simple enough to handle in one node
-            if (image[x1:x2, y1:y2] == 255).all():
-                return [box], []
-            else:
-                return [], []
+def summed_area_table(mask, dtype=None):
+    # table[x, y] counts the set pixels in mask[:x, :y], so any box is four lookups.
+    # Also sums small integer values (terrain classes) given a wide enough dtype
+    if dtype is None:
+        dtype = numpy.int32 if mask.size < 2 ** 31 else numpy.int64
+    table = numpy.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=dtype)
+    body = table[1:, 1:]
+    body[...] = mask
+    numpy.cumsum(body, axis=1, out=body)
+    if body.shape[1] < 128:
+        numpy.cumsum(body, axis=0, out=body)
+    else:
+        # numpy's cumsum down the columns is several times slower than adding
+        # whole rows, once rows are long enough to cover the loop
+        for row in range(1, len(body)):
+            numpy.add(body[row], body[row - 1], out=body[row])
+    return table
+
+
+def stitch(first, second, split_x, merged_into, costs=None):
+    # joins two neighboring halves along their cut. first and second hold the
+    # boxes along each side of the halves (x1, x2, y1, y2 sides, each sorted
+    # along its side). Boxes that line up exactly across the cut are merged
+    # (recorded in merged_into), overlapping ones become edges. With terrain,
+    # costs maps boxes to their traversal cost and only equal costs merge.
+    # Returns the sides of the joined box and the new edges.
+
+    if split_x:
+        first_touches, second_touches = first[1], second[0]
+        lo, hi = 2, 3  # boxes along an x side are ranked by (y1, y2)
+    else:
+        first_touches, second_touches = first[3], second[2]
+        lo, hi = 0, 1
 
-        else:
+    my_edges = []
+    first_merges = {}
+    second_merges = {}
 
-            # recursively split this big box on the longest dimension
-            if x2 - x1 > y2 - y1:
+    # walk both sorted sides with cursors instead of pop(0)
+    i, j = 0, 0
+    while i < len(first_touches) and j < len(second_touches):
 
-                cut = int(x1 + (x2 - x1) / 2 + 1)
-                first_box = (x1, cut, y1, y2)
-                second_box = (cut, x2, y1, y2)
+        f, s = first_touches[i], second_touches[j]
+        rf, rs = (f[lo], f[hi]), (s[lo], s[hi])
 
-                def rank(b): return (b[2], b[3])
+        if rf == rs and (costs is None or costs[f] == costs[s]):
 
-                def first_touch(b): return b[1] == cut
+            i += 1
+            j += 1
+            merged = (f[0], s[1], f[2], s[3])
+            first_merges[f] = merged
+            second_merges[s] = merged
+            if costs is not None:
+                costs[merged] = costs[f]
 
-                def second_touch(b): return b[0] == cut
+        elif rf[1] < rs[1]:
 
-            else:
+            i += 1
+            if rf[1] >= rs[0]:
+                my_edges.append((f, s))
 
-                cut = int(y1 + (y2 - y1) / 2 + 1)
-                first_box = (x1, x2, y1, cut)
-                second_box = (x1, x2, cut, y2)
+        elif rf[1] > rs[1]:
 
-                def rank(b): return (b[0], b[1])
+            j += 1
+            if rf[0] <= rs[1]:
+                my_edges.append((f, s))
 
-                def first_touch(b): return b[3] == cut
+        else:
 
-                def second_touch(b): return b[2] == cut
+            i += 1
+            j += 1
+            my_edges.append((f, s))
 
-            first_boxes, first_edges = scan(first_box)
-            second_boxes, second_edges = scan(second_box)
+    merged_into.update(first_merges)
+    merged_into.update(second_merges)
 
-            my_boxes = []
-            my_edges = []
+    def first_side(side): return [first_merges.get(b, b) for b in side] if first_merges else side
 
-            my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
-            my_boxes.extend(
-                [sb for sb in second_boxes if not second_touch(sb)])
+    def second_side(side): return [second_merges.get(b, b) for b in side] if second_merges else side
 
-            first_touches = sorted(filter(first_touch, first_boxes), key=rank)
-            second_touches = sorted(
-                filter(second_touch, second_boxes), key=rank)
+    def join(a, b):
+        # a merged box ends the first half's side and starts the second's
+        a, b = first_side(a), second_side(b)
+        if a and b and a[-1] == b[0]:
+            return a + b[1:]
+        return a + b
 
-            first_merges = {}
-            second_merges = {}
+    if split_x:
+        sides = (first_side(first[0]), second_side(second[1]), join(first[2], second[2]), join(first[3], second[3]))
+    else:
+        sides = (join(first[0], second[0]), join(first[1], second[1]), first_side(first[2]), second_side(second[3]))
+
+    # edges made at this split keep naming a box even if it merges further along
+    # the same cut; the recursive builder never revisited them either
+    pinned = first_merges.keys() | second_merges.keys()
+
+    return sides, (my_edges, pinned)
+
+
+def split_box(box):
+    # cuts a box in half across its longest dimension. The cut rounds up, but a side
+    # of 2 is still cut in two rather than into itself and an empty box
+    x1, x2, y1, y2 = box
+    if x2 - x1 > y2 - y1:
+        cut = min(int(x1 + (x2 - x1) / 2 + 1), x2 - 1)
+        return (x1, cut, y1, y2), (cut, x2, y1, y2), True
+    cut = min(int(y1 + (y2 - y1) / 2 + 1), y2 - 1)
+    return (x1, x2, y1, cut), (x1, x2, cut, y2), False
+
+
+# a single pixel cannot be split, so boxes below this area are never split
+# whatever min_feature_size asks for
+MIN_SPLIT_AREA = 2
+
+
+def resolve_edges(chunks, merged_into):
+    # flattens the per-split edge lists and points every box at the box it ended up merged into
+    def resolve(box, pinned):
+        if box in pinned:
+            return box
+        while box in merged_into:
+            box = merged_into[box]
+        return box
+
+    return [(resolve(a, pinned), resolve(b, pinned)) for edges, pinned in chunks for a, b in edges]
+
+
+NO_SIDES = ([], [], [], [])
+
+
+# =============================================================================
+# TERRAIN =====================================================================
+# =============================================================================
+def quantize_costs(cost_map, class_costs):
+    # per-pixel traversal costs -> uint8 map of the nearest entry of class_costs
+    class_costs = numpy.asarray(class_costs, dtype=numpy.float64)
+    if len(class_costs) > 256:
+        raise ValueError("at most 256 cost classes fit a uint8 terrain map, got %d" % len(class_costs))
+    order = numpy.argsort(class_costs)
+    ranked = class_costs[order]
+    nearest = numpy.searchsorted((ranked[1:] + ranked[:-1]) / 2, cost_map)
+    return order[nearest].astype(numpy.uint8)
+
+
+def box_cost(terrain, class_costs):
+    # the cost of walking through a region of the terrain map: its class's cost
+    # when it is all one class, the mean pixel cost otherwise. Only boxes too
+    # small to split any further end up mixed
+    first = terrain.flat[0]
+    if (terrain == first).all():
+        return float(class_costs[first])
+    return float(numpy.asarray(class_costs, dtype=numpy.float64)[terrain].mean())
+
+
+def box_counters(image, origin=(0, 0), terrain=None):
+    # "all walkable?" and "all blocked?" are four lookups in summed-area tables
+    # instead of a re-read of the box's pixels at every level. Used where boxes
+    # are visited one at a time (scan_recursive, build_mesh_parallel's planning);
+    # large regions go through scan_levels, which sums whole levels at once.
+    # Returns functions of a box in map coordinates (image's top-left pixel sits
+    # at origin): its walkable and blocked pixel counts, and with terrain the sum
+    # and sum of squares of its classes (None without terrain)
+    ox, oy = origin
+
+    def counter(table):
+        lookup = table.item
+
+        def count(box):
+            x1, x2, y1, y2 = box[0] - ox, box[1] - ox, box[2] - oy, box[3] - oy
+            return lookup(x2, y2) - lookup(x1, y2) - lookup(x2, y1) + lookup(x1, y1)
+        return count
+
+    walkable_mask = image == 255
+    walkable = counter(summed_area_table(walkable_mask))
+    if numpy.count_nonzero(walkable_mask) + numpy.count_nonzero(image == 0) == image.size:
+        # pure black and white maps: whatever is not walkable is blocked
+        def blocked(box): return (box[1] - box[0]) * (box[3] - box[2]) - walkable(box)
+    else:
+        blocked = counter(summed_area_table(image == 0))
 
-            while first_touches and second_touches:
+    class_sums = None
+    if terrain is not None:
+        # a box holds one class exactly when its class values have no variance
+        class_count = counter(summed_area_table(terrain, numpy.int64))
+        square_count = counter(summed_area_table(terrain.astype(numpy.int64) ** 2, numpy.int64))
 
-                f, s = first_touches[0], second_touches[0]
-                rf, rs = rank(f), rank(s)
+        def class_sums(box): return class_count(box), square_count(box)
 
-                if rf == rs:
+    return walkable, blocked, class_sums
 
-                    first_touches.pop(0)
-                    second_touches.pop(0)
-                    merged = (f[0], s[1], f[2], s[3])
-                    first_merges[f] = merged
-                    second_merges[s] = merged
-                    my_boxes.append(merged)
 
-                elif rf[1] < rs[1]:
+def ragged_index(starts, lengths):
+    # positions of the segments [start, start + length) laid end to end
+    ends = numpy.cumsum(lengths)
+    return numpy.arange(ends[-1] if len(ends) else 0) - numpy.repeat(ends - lengths - starts, lengths)
 
-                    my_boxes.append(first_touches.pop(0))
-                    if rf[1] >= rs[0]:
-                        my_edges.append((f, s))
 
-                elif rf[1] > rs[1]:
+def box_sums(table, x1, x2, y1, y2):
+    # summed-area table lookups for arrays of boxes, in the table's coordinates
+    return table[x2, y2] - table[x1, y2] - table[x2, y1] + table[x1, y1]
 
-                    my_boxes.append(second_touches.pop(0))
-                    if rf[0] <= rs[1]:
-                        my_edges.append((f, s))
 
-                else:
+def scan_recursive(image, min_feature_size, origin=(0, 0), boxes=None, terrain=None, class_costs=None, costs=None):
+    # scan_region for small regions: the split-and-stitch recursion itself, one
+    # box at a time
 
-                    my_boxes.append(first_touches.pop(0))
-                    my_boxes.append(second_touches.pop(0))
-                    my_edges.append((f, s))
+    ox, oy = origin
+    min_feature_size = max(min_feature_size, MIN_SPLIT_AREA)
+    walkable, blocked, class_sums = box_counters(image, origin, terrain)
+    if terrain is not None and costs is None:
+        costs = {}
 
-            my_boxes.extend(first_touches)
-            my_boxes.extend(second_touches)
+    # (new edges, pinned boxes) of every split, in the order the recursive merges listed them
+    chunks = []
+    merged_into = {}
+    leaves = [] if boxes is not None else None
 
-            for a, b in first_edges:
-                my_edges.append(
-                    (first_merges.get(a, a), first_merges.get(b, b)))
+    def scan(box):
 
-            for a, b in second_edges:
-                my_edges.append(
-                    (second_merges.get(a, a), second_merges.get(b, b)))
+        x1, x2, y1, y2 = box
+        area = (x2 - x1) * (y2 - y1)
 
-            return my_boxes, my_edges
+        if walkable(box) == area:
+            if terrain is None:
+                if leaves is not None:
+                    leaves.append(box)
+                return [box], [box], [box], [box]
+            total, squares = class_sums(box)
+            uniform = total * total == squares * area
+            if uniform or area < min_feature_size:
+                costs[box] = float(class_costs[total // area]) if uniform \
+                    else box_cost(terrain[x1 - ox:x2 - ox, y1 - oy:y2 - oy], class_costs)
+                if leaves is not None:
+                    leaves.append(box)
+                return [box], [box], [box], [box]
+
+        elif area < min_feature_size or blocked(box) == area:
+            return NO_SIDES
+
+        # recursively split this big box on the longest dimension
+        first_box, second_box, split_x = split_box(box)
+        slot = len(chunks)
+        chunks.append(None)
+        first = scan(first_box)
+        second = scan(second_box)
+        sides, chunks[slot] = stitch(first, second, split_x, merged_into, costs)
+        return sides
+
+    sides = scan((ox, ox + image.shape[0], oy, oy + image.shape[1]))
+    edges = resolve_edges(chunks, merged_into)
+
+    if boxes is not None:
+        for box in leaves:
+            while box in merged_into:
+                box = merged_into[box]
+            boxes.add(box)
+        boxes.update(box for edge in edges for box in edge)
+
+    return sides, edges
+
+
+def scan_levels(image, min_feature_size, origin=(0, 0), boxes=None, terrain=None, class_costs=None, costs=None):
+    # scan_region for large regions: the same recursion worked one level of the
+    # split tree at a time with numpy. Going down, every box of a level is
+    # classified from summed-area tables and the mixed ones are split. Coming
+    # back up, every split of a level stitches its halves at once (stitch's
+    # cursor walk, done as sorted searches), and the edges are put back in the
+    # order the recursion listed them
+
+    ox, oy = origin
+    height, width = image.shape
+    min_feature_size = max(min_feature_size, MIN_SPLIT_AREA)
+    walkable_mask = image == 255
+    walkable_table = summed_area_table(walkable_mask)
+    blocked_table = None
+    if numpy.count_nonzero(walkable_mask) + numpy.count_nonzero(image == 0) != image.size:
+        blocked_table = summed_area_table(image == 0)
+    if terrain is not None:
+        class_table = summed_area_table(terrain, numpy.int64)
+        square_table = summed_area_table(terrain.astype(numpy.int64) ** 2, numpy.int64)
+        cost_of_class = numpy.asarray(class_costs, dtype=numpy.float64)
+        if costs is None:
+            costs = {}
+
+    # going down: which boxes of each level are leaves, and how the mixed ones split
+    levels = []
+    leaf_boxes, leaf_costs = [], []
+    x1, x2 = numpy.array([0]), numpy.array([height])
+    y1, y2 = numpy.array([0]), numpy.array([width])
+    path = numpy.zeros(1, dtype=numpy.int64)            # the halves taken to reach a box, as bits
+    while len(x1):
+        area = (x2 - x1) * (y2 - y1)
+        walkable = box_sums(walkable_table, x1, x2, y1, y2)
+        full = walkable == area
+        blocked = area - walkable if blocked_table is None else box_sums(blocked_table, x1, x2, y1, y2)
+        empty = ~full & ((area < min_feature_size) | (blocked == area))
+        if terrain is None:
+            leaf = full
+        else:
+            # a box holds the one class c exactly when its classes sum to c * area
+            # and their squares to c * c * area
+            first = terrain[numpy.minimum(x1, height - 1), numpy.minimum(y1, width - 1)].astype(numpy.int64)
+            uniform = ((box_sums(class_table, x1, x2, y1, y2) == first * area)
+                       & (box_sums(square_table, x1, x2, y1, y2) == first * first * area))
+            leaf = full & (uniform | (area < min_feature_size))
+            level_costs = cost_of_class[first[leaf]]
+            mixed = zip(numpy.flatnonzero(~uniform[leaf]).tolist(), numpy.flatnonzero(leaf & ~uniform).tolist())
+            for number, box in mixed:
+                level_costs[number] = box_cost(terrain[x1[box]:x2[box], y1[box]:y2[box]], class_costs)
+            leaf_costs.append(level_costs)
+        split = ~(leaf | empty)
+        leaf_boxes.append(numpy.column_stack((x1[leaf] + ox, x2[leaf] + ox, y1[leaf] + oy, y2[leaf] + oy)))
+
+        # split_box on every mixed box: across x when it is taller than wide
+        x1, x2, y1, y2, path = x1[split], x2[split], y1[split], y2[split], path[split]
+        across = x2 - x1 > y2 - y1
+        levels.append((leaf, split, across, path))
+        cut_x = numpy.minimum(x1 + (x2 - x1) // 2 + 1, x2 - 1)
+        cut_y = numpy.minimum(y1 + (y2 - y1) // 2 + 1, y2 - 1)
+        x1, x2 = (numpy.column_stack((x1, numpy.where(across, cut_x, x1))).ravel(),
+                  numpy.column_stack((numpy.where(across, cut_x, x2), x2)).ravel())
+        y1, y2 = (numpy.column_stack((y1, numpy.where(across, y1, cut_y))).ravel(),
+                  numpy.column_stack((numpy.where(across, y2, cut_y), y2)).ravel())
+        path = numpy.column_stack((path * 2, path * 2 + 1)).ravel()
+
+    # every box ever made, by id: the leaves level by level, then what merges make
+    leaf_count = sum(len(level_boxes) for level_boxes in leaf_boxes)
+    table = numpy.zeros((2 * leaf_count, 4), dtype=numpy.int64)
+    if leaf_count:
+        table[:leaf_count] = numpy.concatenate(leaf_boxes)
+    box_costs = numpy.zeros(len(table))
+    if terrain is not None and leaf_count:
+        box_costs[:leaf_count] = numpy.concatenate(leaf_costs)
+    box_count = leaf_count
+    merged_into = numpy.full(len(table), -1)
+    merged_at = numpy.full(len(table), -1)          # the split a box was merged at
+    current = numpy.arange(len(table))              # what a box has been merged into so far
+    span = max(ox + height, oy + width) + 2         # keeps the searches of different splits apart
+
+    # coming up: the sides of a level's boxes are values[starts[box, side]:][:lengths[box, side]]
+    values = numpy.zeros(0, dtype=numpy.int64)
+    starts = lengths = numpy.zeros((0, 4), dtype=numpy.int64)
+    edge_parts = []
+    leaf_end = leaf_count
+    split_base = sum(len(path) for _, _, _, path in levels)
+    for depth in range(len(levels) - 1, -1, -1):
+        leaf, split, across, path = levels[depth]
+        split_count = len(path)
+        split_base -= split_count
+        halves = numpy.arange(split_count)
+        first_child, second_child = 2 * halves, 2 * halves + 1
+
+        # the first half's boxes along the cut face the second half's
+        first_lengths = lengths[first_child, numpy.where(across, 1, 3)]
+        second_lengths = lengths[second_child, numpy.where(across, 0, 2)]
+        first = values[ragged_index(starts[first_child, numpy.where(across, 1, 3)], first_lengths)]
+        second = values[ragged_index(starts[second_child, numpy.where(across, 0, 2)], second_lengths)]
+        first_split = numpy.repeat(halves, first_lengths)
+        second_split = numpy.repeat(halves, second_lengths)
+        # their ranges along the cut: (y1, y2) across x, (x1, x2) otherwise
+        first_lo = numpy.where(across[first_split], table[first, 2], table[first, 0])
+        first_hi = numpy.where(across[first_split], table[first, 3], table[first, 1])
+        second_lo = numpy.where(across[second_split], table[second, 2], table[second, 0])
+        second_hi = numpy.where(across[second_split], table[second, 3], table[second, 1])
+
+        # stitch's cursors stand on first[i] and second[j] together exactly when
+        # (end of i - 1, end of i] overlaps (end of j - 1, end of j]
+        first_ends = first_split * span + first_hi
+        second_ends = second_split * span + second_hi
+        previous_ends = numpy.empty_like(first_ends)
+        previous_ends[1:] = first_ends[:-1]
+        opened = first_lengths > 0
+        previous_ends[(numpy.cumsum(first_lengths) - first_lengths)[opened]] = halves[opened] * span - 1
+        lo = numpy.searchsorted(second_ends, previous_ends, 'right')
+        hi = numpy.minimum(numpy.searchsorted(second_ends, first_ends, 'left') + 1,
+                           numpy.cumsum(second_lengths)[first_split])
+        visits = numpy.maximum(hi - lo, 0)
+        i = numpy.repeat(numpy.arange(len(first)), visits)
+        j = ragged_index(lo, visits)
+
+        # lined up (at the same cost) they merge, overlapping or touching they get an edge
+        same = (first_lo[i] == second_lo[j]) & (first_hi[i] == second_hi[j])
+        if terrain is not None:
+            same &= box_costs[first[i]] == box_costs[second[j]]
+        link = ~same & (first_lo[i] <= second_hi[j]) & (second_lo[j] <= first_hi[i])
+        link_split = first_split[i[link]]
+        edge_parts.append((path[link_split] << (len(levels) - 1 - depth), numpy.full(len(link_split), depth),
+                           first[i[link]], second[j[link]], split_base + link_split))
+
+        merged_first, merged_second = first[i[same]], second[j[same]]
+        merged = numpy.arange(box_count, box_count + len(merged_first))
+        box_count += len(merged)
+        table[merged] = numpy.column_stack((table[merged_first, 0], table[merged_second, 1],
+                                            table[merged_first, 2], table[merged_second, 3]))
+        box_costs[merged] = box_costs[merged_first]
+        for parts in (merged_first, merged_second):
+            merged_into[parts] = merged
+            merged_at[parts] = split_base + first_split[i[same]]
+            current[parts] = merged
+
+        # the sides of this level: a split joins its halves' sides like stitch does,
+        # a leaf is alone on all four, an empty box has none. Across x the result
+        # takes no x2 side from the first half and no x1 side from the second,
+        # across y no y2 side and no y1 side
+        mapped = current[values]
+        first_kept = numpy.ones((split_count, 4), dtype=bool)
+        first_kept[:, 1], first_kept[:, 3] = ~across, across
+        second_kept = numpy.ones((split_count, 4), dtype=bool)
+        second_kept[:, 0], second_kept[:, 2] = ~across, across
+        first_starts, second_starts = starts[first_child], starts[second_child]
+        first_kept_lengths = numpy.where(first_kept, lengths[first_child], 0)
+        second_kept_lengths = numpy.where(second_kept, lengths[second_child], 0)
+        # a box merged across the cut ends the first half's side and starts the second's
+        both = (first_kept_lengths > 0) & (second_kept_lengths > 0)
+        repeated = numpy.zeros((split_count, 4), dtype=numpy.int64)
+        repeated[both] = mapped[(first_starts + first_kept_lengths - 1)[both]] == mapped[second_starts[both]]
+        piece_starts = numpy.stack((first_starts, second_starts + repeated), axis=2).ravel()
+        piece_lengths = numpy.stack((first_kept_lengths, second_kept_lengths - repeated), axis=2).ravel()
+        pieces = piece_lengths > 0
+        split_values = mapped[ragged_index(piece_starts[pieces], piece_lengths[pieces])]
+
+        leaf_ids = numpy.arange(leaf_end - numpy.count_nonzero(leaf), leaf_end)
+        leaf_end -= len(leaf_ids)
+        values = numpy.concatenate((split_values, numpy.repeat(leaf_ids, 4)))
+        lengths = numpy.zeros((len(leaf), 4), dtype=numpy.int64)
+        starts = numpy.zeros((len(leaf), 4), dtype=numpy.int64)
+        split_lengths = first_kept_lengths + second_kept_lengths - repeated
+        lengths[split] = split_lengths
+        starts[split] = (numpy.cumsum(split_lengths.ravel()) - split_lengths.ravel()).reshape(-1, 4)
+        lengths[leaf] = 1
+        starts[leaf] = len(split_values) + numpy.arange(4 * len(leaf_ids)).reshape(-1, 4)
+
+    # edges in the order of the recursion: splits in preorder, each in cursor order
+    keys, depths, first, second, edge_split = (numpy.concatenate(part) for part in zip(*edge_parts)) \
+        if edge_parts else [numpy.zeros(0, dtype=numpy.int64)] * 5
+    order = numpy.lexsort((depths, keys))
+    first, second, edge_split = first[order], second[order], edge_split[order]
+
+    # boxes stand for what they were finally merged into, except in the edges
+    # made at the split that merged them, which the recursion never revisited
+    final = numpy.arange(box_count)
+    while True:
+        onward = merged_into[final]
+        moved = onward >= 0
+        if not moved.any():
+            break
+        final[moved] = onward[moved]
+    first = numpy.where(merged_at[first] == edge_split, first, final[first])
+    second = numpy.where(merged_at[second] == edge_split, second, final[second])
+
+    box_list = list(zip(*(column.tolist() for column in table[:box_count].T)))
+    if terrain is not None:
+        costs.update(zip(box_list, box_costs[:box_count].tolist()))
+    edges = list(zip(map(box_list.__getitem__, first.tolist()), map(box_list.__getitem__, second.tolist())))
+    if boxes is not None:
+        boxes.update(map(box_list.__getitem__, final[:leaf_count].tolist()))
+        boxes.update(box for edge in edges for box in edge)
+    sides = tuple([box_list[box] for box in values[starts[0, side]:starts[0, side] + lengths[0, side]].tolist()]
+                  for side in range(4)) if len(lengths) else NO_SIDES
+    return sides, edges
+
+
+# regions below this many pixels are scanned box by box: there numpy's per-call
+# overhead costs more than the recursion (the two meet near 190 x 190 on homer)
+LEVEL_SCAN_PIXELS = 200 * 200
+
+
+def scan_region(image, min_feature_size, origin=(0, 0), boxes=None, terrain=None, class_costs=None, costs=None):
+    # builds the boxes of one image region whose top-left pixel sits at origin in
+    # map coordinates. Returns the boxes along each side of the region (x1, x2, y1,
+    # y2 sides, sorted along the side) and the edges, both in map coordinates.
+    # If boxes is a set, every box the region ends up with is added to it,
+    # including boxes that have no edge inside the region.
+    # terrain is an optional uint8 class map the shape of image; walkable boxes
+    # are then also split until they hold a single class, and the cost of every
+    # box, from class_costs, is written to the costs dict.
+    # scan_recursive and scan_levels build the same boxes and edges, in the same order
+    scan = scan_levels if image.size >= LEVEL_SCAN_PIXELS else scan_recursive
+    return scan(image, min_feature_size, origin, boxes, terrain, class_costs, costs)
+
+
+def build_mesh(image, min_feature_size, terrain=None, class_costs=None):
+
+    # with a terrain class map (see quantize_costs) the mesh also gets 'costs',
+    # the traversal cost of every box
+    costs = {} if terrain is not None else None
+    _, edges = scan_region(image, min_feature_size, terrain=terrain, class_costs=class_costs, costs=costs)
+
+    return mesh_from_edges(edges, costs)
+
+
+# set in each pool worker by attach_image
+_worker_image = None
+_worker_min_feature_size = None
+_worker_terrain = None
+_worker_class_costs = None
+_worker_blocks = []
+
+
+def share_array(array):
+    # copies array into a new shared memory block; returns the block (owned by the
+    # caller, which unlinks it) and a picklable (name, shape, dtype) descriptor
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_array(descriptor):
+    name, shape, dtype = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    _worker_blocks.append(block)
+    return numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=block.buf)
+
+
+def attach_image(image, min_feature_size, terrain=None, class_costs=None):
+    # pool initializer: maps the image (and terrain) the parent shared instead of
+    # unpickling a copy of the whole map in every worker
+    global _worker_image, _worker_min_feature_size, _worker_terrain, _worker_class_costs
+    _worker_image = attach_array(image)
+    _worker_min_feature_size = min_feature_size
+    _worker_terrain = attach_array(terrain) if terrain is not None else None
+    _worker_class_costs = class_costs
+
+
+def scan_task(box):
+    x1, x2, y1, y2 = box
+    if _worker_terrain is None:
+        return scan_region(_worker_image[x1:x2, y1:y2], _worker_min_feature_size, (x1, y1)) + (None,)
+    costs = {}
+    sides, edges = scan_region(_worker_image[x1:x2, y1:y2], _worker_min_feature_size, (x1, y1),
+                               terrain=_worker_terrain[x1:x2, y1:y2], class_costs=_worker_class_costs, costs=costs)
+    return sides, edges, costs
+
+
+def build_mesh_parallel(image, min_feature_size, depth=4, workers=None, terrain=None, class_costs=None):
+
+    # the top `depth` levels of the recursion are planned here, every subtree
+    # below them is scanned by a pool worker, and the results are stitched back
+    # in the same order scan would have, so the mesh is identical to build_mesh.
+    # Planning and stitching stay serial in this process, and the speedup with
+    # more cores has not been measured (only on one core, where the pool is pure
+    # overhead)
+
+    tasks = []
+    min_feature_size = max(min_feature_size, MIN_SPLIT_AREA)
+    walkable, blocked, class_sums = box_counters(image, terrain=terrain)
 
-            # end of scan
+    def plan(box, level):
 
-    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
+        x1, x2, y1, y2 = box
+        area = (x2 - x1) * (y2 - y1)
 
+        if walkable(box) == area:
+            if terrain is None or area < min_feature_size:
+                return 'leaf', box
+            total, squares = class_sums(box)
+            if total * total == squares * area:
+                return 'leaf', box
+
+        elif area < min_feature_size or blocked(box) == area:
+            return 'empty',
+
+        if level == depth:
+            tasks.append(box)
+            return 'task', len(tasks) - 1
+
+        first_box, second_box, split_x = split_box(box)
+        return 'split', plan(first_box, level + 1), plan(second_box, level + 1), split_x
+
+    tree = plan((0, image.shape[0], 0, image.shape[1]), 0)
+
+    blocks = []
+    try:
+        block, shared_image = share_array(image)
+        blocks.append(block)
+        shared_terrain = None
+        if terrain is not None:
+            block, shared_terrain = share_array(terrain)
+            blocks.append(block)
+        with ProcessPoolExecutor(workers, initializer=attach_image,
+                                 initargs=(shared_image, min_feature_size, shared_terrain, class_costs)) as pool:
+            results = list(pool.map(scan_task, tasks))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    chunks = []
+    merged_into = {}
+    costs = None
+    if terrain is not None:
+        costs = {}
+        for _, _, task_costs in results:
+            costs.update(task_costs)
+
+    def join(node):
+
+        if node[0] == 'leaf':
+            if costs is not None:
+                x1, x2, y1, y2 = node[1]
+                costs[node[1]] = box_cost(terrain[x1:x2, y1:y2], class_costs)
+            return [node[1]], [node[1]], [node[1]], [node[1]]
+
+        if node[0] == 'empty':
+            return NO_SIDES
+
+        if node[0] == 'task':
+            # a worker's edges are already resolved inside its subtree
+            sides, edges, _ = results[node[1]]
+            chunks.append((edges, frozenset()))
+            return sides
+
+        _, first, second, split_x = node
+        slot = len(chunks)
+        chunks.append(None)
+        first = join(first)
+        second = join(second)
+        sides, chunks[slot] = stitch(first, second, split_x, merged_into, costs)
+        return sides
+
+    join(tree)
+
+    return mesh_from_edges(resolve_edges(chunks, merged_into), costs)
+
+
+def mesh_from_edges(edges, costs=None):
     adj = collections.defaultdict(list)
     for a, b in edges:
         adj[a].append(b)
         adj[b].append(a)
 
     mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+    if costs is not None:
+        mesh['costs'] = {box: costs[box] for box in mesh['boxes']}
 
     return mesh
 
@@ -128,6 +651,7 @@ def build_mesh(image, min_feature_size):
 if __name__ == '__main__':
 
     min_feature_size = 16
+    workers = 1
     filename = None
 
     if len(sys.argv) == 2:
@@ -135,15 +659,22 @@ if __name__ == '__main__':
     elif len(sys.argv) == 3:
         filename = sys.argv[1]
         min_feature_size = int(sys.argv[2])
+    elif len(sys.argv) == 4:
+        filename = sys.argv[1]
+        min_feature_size = int(sys.argv[2])
+        workers = int(sys.argv[3])
     else:
-        print("usage: %s map_filename min_feature_size" % sys.argv[0])
+        print("usage: %s map_filename min_feature_size [workers]" % sys.argv[0])
         sys.exit(-1)
 
     img = (imread(filename) * 255).astype(dtype=numpy.uint8)
     if len(img.shape) > 2:
         img = img[:, :, 0]
 
-    mesh = build_mesh(img, min_feature_size)
+    if workers > 1:
+        mesh = build_mesh_parallel(img, min_feature_size, workers=workers)
+    else:
+        mesh = build_mesh(img, min_feature_size)
 
     print(type(mesh))
     print(mesh.keys())
@@ -0,0 +1,367 @@
+from math import inf
+
+import numpy
+
+
+PRECOMPUTED = ['next_hop', 'hierarchy', 'landmarks']
+
+# meshes up to this many boxes also keep their boxes, portals and costs as python
+# tuples and lists, which searches read faster than the arrays (dijkstra on homer
+# takes about 5.4 instead of 6.7 ms) for roughly 1 KB per box. Larger meshes read
+# them out of the arrays
+ROW_LIST_BOXES = 20000
+
+# =============================================================================
+# SPATIAL INDEX (UNIFORM GRID) ================================================
+# =============================================================================
+def grid_cells (boxes, cell_size, grid_shape):
+    # one (row in boxes, cell) pair per cell each box covers, expanded without a python
+    # loop. Cell ranges are inclusive of the far border, like point_in_box
+    cx1 = (boxes[:, 0] // cell_size).astype(numpy.int64)
+    cx2 = (boxes[:, 1] // cell_size).astype(numpy.int64)
+    cy1 = (boxes[:, 2] // cell_size).astype(numpy.int64)
+    cy2 = (boxes[:, 3] // cell_size).astype(numpy.int64)
+    widths = cy2 - cy1 + 1
+    counts = (cx2 - cx1 + 1) * widths
+    owner = numpy.repeat(numpy.arange(len(boxes)), counts)
+    local = numpy.arange(int(counts.sum())) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    cells = (cx1[owner] + local // widths[owner]) * grid_shape[1] + cy1[owner] + local % widths[owner]
+    return owner, cells
+
+def build_grid (boxes, order=None, cell_size=None):
+    # boxes is an (n, 4) array of x1, x2, y1, y2 rows
+    if cell_size is None:
+        areas = (boxes[:, 1] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 2])
+        cell_size = max(1, int(float(areas.mean()) ** 0.5)) if len(boxes) else 1
+    if order is None:
+        order = numpy.arange(len(boxes), dtype=numpy.int32)
+
+    ordered = boxes[order]
+    grid_shape = (int(ordered[:, 1].max() // cell_size) + 1 if len(boxes) else 0,
+                  int(ordered[:, 3].max() // cell_size) + 1 if len(boxes) else 0)
+    owner, cells = grid_cells(ordered, cell_size, grid_shape)
+
+    # a stable sort keeps each cell's boxes in the given order, so the first hit
+    # is the same box a linear scan over that order would return
+    sort = numpy.argsort(cells, kind='stable')
+    cell_boxes = order[owner[sort]].astype(numpy.int32)
+    cell_offsets = numpy.zeros(grid_shape[0] * grid_shape[1] + 1, dtype=numpy.int32)
+    numpy.cumsum(numpy.bincount(cells, minlength=grid_shape[0] * grid_shape[1]), out=cell_offsets[1:])
+
+    return {'cell_size': cell_size, 'grid_shape': grid_shape,
+            'cell_offsets': cell_offsets, 'cell_boxes': cell_boxes}
+
+# =============================================================================
+# COMPILED MESH ===============================================================
+# =============================================================================
+def box_dtype (boxes):
+    # meshes built from pixel images are integral; some older pickles hold floats
+    if all(float(v).is_integer() for box in boxes for v in box):
+        return numpy.int32
+    return numpy.float64
+
+class BoxRows:
+
+    # the rows of an (n, 4) array of boxes or portals as tuples, read out on demand so
+    # the mesh never holds n python tuples. rows[i] == tuple(boxes[i]), only much cheaper
+
+    def __init__ (self, boxes):
+        self.flat = flat_view(boxes)
+        self.count = len(boxes)
+
+    def __len__ (self):
+        return self.count
+
+    def __getitem__ (self, box_id):
+        flat, i = self.flat, 4 * box_id
+        return (flat[i], flat[i + 1], flat[i + 2], flat[i + 3])
+
+def flat_view (rows):
+    # a 1-d memoryview over a 2-d array: indexing it yields plain python numbers
+    return memoryview(numpy.ascontiguousarray(rows).reshape(-1))
+
+def row_views (boxes, portals, box_costs):
+    # 'rows', 'portal_rows' and 'cost_view': box i, adjacency edge's border and box i's
+    # cost as python values, materialized up to ROW_LIST_BOXES boxes
+    if len(boxes) <= ROW_LIST_BOXES:
+        return ([tuple(row) for row in boxes.tolist()], [tuple(row) for row in portals.tolist()],
+                box_costs.tolist())
+    return BoxRows(boxes), BoxRows(portals), memoryview(box_costs)
+
+def from_arrays (boxes, offsets, neighbors, grid=None, box_costs=None, portals=None, edge_costs=None):
+    # wraps the arrays of a compiled mesh without copying them. Anything not passed in
+    # (grid, per-adjacency portals and edge costs) is derived from the boxes
+    compiled = {
+        'boxes': boxes,                         # (n, 4) rows of x1, x2, y1, y2
+        'offsets': offsets,                     # neighbors of box i are neighbors[offsets[i]:offsets[i + 1]]
+        'neighbors': neighbors,
+        'adj_offsets': memoryview(offsets),     # zero-copy views, cheap to index from python
+        'adj_neighbors': memoryview(neighbors),
+        'version': 0,                           # bumped whenever the mesh is edited in place
+    }
+    compiled.update(grid if grid is not None else build_grid(boxes))
+
+    # terrain: the cost of moving one unit through each box, 1 without terrain.
+    # cost_floor scales the euclidean heuristics so they stay admissible
+    if box_costs is None:
+        box_costs = numpy.ones(len(boxes), dtype=numpy.float64)
+    compiled['box_costs'] = box_costs
+    compiled['cost_floor'] = float(box_costs.min()) if len(box_costs) else 1.0
+
+    # per-adjacency geometry, aligned with neighbors like the CSR arrays
+    compiled['portals'] = portals if portals is not None else portal_borders(boxes, offsets, neighbors)
+    compiled['edge_costs'] = edge_costs if edge_costs is not None else center_distances(compiled)
+
+    # rows[i] is box i as a tuple, portal_rows[edge] the border of adjacency edge
+    compiled['rows'], compiled['portal_rows'], compiled['cost_view'] = row_views(boxes, compiled['portals'], box_costs)
+    return compiled
+
+def compile_mesh (mesh):
+    """
+    Converts a legacy mesh dict into the compiled integer-indexed format
+
+    Args:
+        mesh: dict with 'boxes' (list of 4-tuples) and 'adj' (box -> list of boxes),
+            and 'costs' (box -> traversal cost) when it was built with terrain
+
+    Returns:
+
+        A dict with the boxes as an (n, 4) array, CSR adjacency ('offsets',
+        'neighbors'), a uniform grid for point lookup, the box tuples by id, the
+        per-box traversal costs ('box_costs') and, aligned with 'neighbors', each
+        adjacency's shared border ('portals') and center-to-center cost ('edge_costs')
+    """
+
+    # ids follow the sorted box tuples, so comparing ids on heap ties
+    # behaves exactly like comparing the boxes themselves did
+    rows = sorted(mesh['boxes'])
+    ids = {box: i for i, box in enumerate(rows)}
+
+    offsets = numpy.zeros(len(rows) + 1, dtype=numpy.int32)
+    neighbors = []
+    for i, box in enumerate(rows):
+        neighbors.extend(ids[neighbor] for neighbor in mesh['adj'].get(box, ()))
+        offsets[i + 1] = len(neighbors)
+
+    boxes = numpy.array(rows, dtype=box_dtype(rows)).reshape(-1, 4)
+    neighbors = numpy.array(neighbors, dtype=numpy.int32)
+    box_costs = None
+    if 'costs' in mesh:
+        # boxes added without terrain (nm_meshupdate) cost the default 1
+        box_costs = numpy.array([mesh['costs'].get(box, 1.0) for box in rows], dtype=numpy.float64)
+
+    # the grid keeps the legacy list order, so a lookup returns the first box in mesh['boxes'] holding the point
+    order = numpy.array([ids[box] for box in mesh['boxes']], dtype=numpy.int32)
+    compiled = from_arrays(boxes, offsets, neighbors, build_grid(boxes, order), box_costs)
+
+    # a mesh patched in place by nm_meshupdate carries its edit count over
+    compiled['version'] = mesh.get('version', 0)
+
+    # precomputed tables saved with the mesh are already indexed by compiled ids
+    for key in PRECOMPUTED:
+        if key in mesh:
+            compiled[key] = mesh[key]
+    return compiled
+
+def as_compiled (mesh):
+    # compiled meshes pass straight through, legacy dicts are converted once and cached
+    if 'offsets' in mesh:
+        return mesh
+    compiled = mesh.get('compiled')
+    if compiled is None:
+        compiled = compile_mesh(mesh)
+        mesh['compiled'] = compiled
+    return compiled
+
+# =============================================================================
+# STATIC EDGE WEIGHTS =========================================================
+# =============================================================================
+def box_centers (mesh, ids=None):
+    boxes = (mesh['boxes'] if ids is None else mesh['boxes'][ids]).astype(numpy.float64)
+    return numpy.column_stack(((boxes[:, 0] + boxes[:, 1]) / 2, (boxes[:, 2] + boxes[:, 3]) / 2))
+
+def center_distances (mesh, sources=None, targets=None):
+    # center-to-center length of every adjacency, aligned with mesh['neighbors'], or of
+    # the given source and target ids. With terrain each half of the walk is charged
+    # at its own box's cost
+    if sources is None:
+        sources = numpy.repeat(numpy.arange(len(mesh['boxes'])), numpy.diff(mesh['offsets']))
+        targets = mesh['neighbors']
+    lengths = numpy.hypot(*(box_centers(mesh, targets) - box_centers(mesh, sources)).T)
+    box_costs = mesh.get('box_costs')
+    if box_costs is None:
+        return lengths
+    return lengths * ((box_costs[sources] + box_costs[targets]) / 2)
+
+# =============================================================================
+# PORTALS =====================================================================
+# =============================================================================
+def portal_borders (boxes, offsets, neighbors):
+    # the border each adjacency crosses, as an (m, 4) array of x1, x2, y1, y2 rows
+    # aligned with neighbors. Adjacent boxes share an edge, a corner or (for boxes
+    # patched in by nm_meshupdate) an overlap; a pair that does not touch at all
+    # keeps the whole neighbor box, so clamping into the border always agrees with
+    # clamping into the neighbor from inside the current box
+    boxes = numpy.asarray(boxes)
+    sources = numpy.repeat(numpy.arange(len(boxes)), numpy.diff(offsets))
+    return pair_borders(boxes[sources], boxes[neighbors])
+
+def pair_borders (first, second):
+    # portal_borders for explicit (k, 4) arrays of boxes and the neighbors they cross into
+    borders = numpy.column_stack((numpy.maximum(first[:, 0], second[:, 0]), numpy.minimum(first[:, 1], second[:, 1]),
+                                  numpy.maximum(first[:, 2], second[:, 2]), numpy.minimum(first[:, 3], second[:, 3])))
+    apart = (borders[:, 0] > borders[:, 1]) | (borders[:, 2] > borders[:, 3])
+    borders[apart] = second[apart]
+    return borders.reshape(-1, 4)
+
+# =============================================================================
+# IN-PLACE EDITS ==============================================================
+# =============================================================================
+def find_box_id (compiled, box):
+    # id of a live box tuple, through the grid cell holding its first corner
+    cell_size = compiled['cell_size']
+    grid_width, grid_height = compiled['grid_shape']
+    cx, cy = int(box[0] // cell_size), int(box[2] // cell_size)
+    if not (0 <= cx < grid_width and 0 <= cy < grid_height):
+        return None
+    cell = cx * grid_height + cy
+    cell_offsets, rows = compiled['cell_offsets'], compiled['rows']
+    for box_id in compiled['cell_boxes'][cell_offsets[cell]:cell_offsets[cell + 1]].tolist():
+        if rows[box_id] == box:
+            return box_id
+    return None
+
+def patch_compiled (compiled, mesh, removed, added):
+    """
+    Applies an nm_meshupdate edit of the legacy mesh to its compiled form in place
+
+    Ids stay stable: removed boxes keep their row but lose their neighbors and
+    their grid entries, added boxes get new ids after the last one. Only the
+    rows of boxes whose neighbor list changed are computed in python; every
+    other adjacency, with its portal and edge cost, is copied over as is. Ids
+    are never reused, so a compiled mesh edited many times carries one dead row
+    per removed box until it is compiled afresh from the legacy dict.
+
+    Args:
+        compiled: the compiled mesh of mesh, patched in place
+        mesh: legacy mesh dict, already edited
+        removed, added: the box lists nm_meshupdate.update_mesh returns
+
+    Returns:
+
+        The ids of the removed boxes and the ids given to the added boxes
+    """
+
+    old_offsets, old_neighbors = compiled['offsets'], compiled['neighbors']
+    count = len(compiled['rows'])
+    removed_ids = [find_box_id(compiled, box) for box in removed]
+    added_ids = list(range(count, count + len(added)))
+    ids = dict(zip(added, added_ids))
+
+    # boxes whose neighbor list changed: the edited ones and everything they touched
+    changed = dict.fromkeys(removed_ids)
+    for box_id in removed_ids:
+        changed.update(dict.fromkeys(old_neighbors[old_offsets[box_id]:old_offsets[box_id + 1]].tolist()))
+    for box in added:
+        for neighbor in mesh['adj'][box]:
+            if neighbor not in ids:
+                ids[neighbor] = find_box_id(compiled, neighbor)
+            changed[ids[neighbor]] = None
+    changed.update(dict.fromkeys(added_ids))
+    dead = set(removed_ids)
+    rows = {box_id: [] for box_id in dead}
+    for box_id in changed:
+        if box_id in dead:
+            continue
+        box = added[box_id - count] if box_id >= count else compiled['rows'][box_id]
+        for neighbor in mesh['adj'][box]:
+            if neighbor not in ids:
+                ids[neighbor] = find_box_id(compiled, neighbor)
+        rows[box_id] = [ids[neighbor] for neighbor in mesh['adj'][box]]
+
+    # boxes and costs grow by the added rows; dead rows stay where they are
+    boxes = numpy.concatenate((compiled['boxes'], numpy.array(added, dtype=compiled['boxes'].dtype).reshape(-1, 4)))
+    costs = mesh.get('costs')
+    box_costs = numpy.concatenate((compiled['box_costs'], numpy.array(
+        [costs.get(box, 1.0) if costs is not None else 1.0 for box in added], dtype=numpy.float64)))
+
+    # new CSR: untouched rows are copied in one gather, changed rows written after
+    degrees = numpy.zeros(len(boxes), dtype=numpy.int64)
+    degrees[:count] = numpy.diff(old_offsets)
+    changed_ids = numpy.array(sorted(rows), dtype=numpy.int64)
+    degrees[changed_ids] = [len(rows[box_id]) for box_id in changed_ids.tolist()]
+    offsets = numpy.zeros(len(boxes) + 1, dtype=numpy.int32)
+    numpy.cumsum(degrees, out=offsets[1:])
+
+    kept = numpy.ones(count, dtype=bool)
+    kept[changed_ids[changed_ids < count]] = False
+    owners = numpy.repeat(numpy.arange(count), numpy.diff(old_offsets))
+    positions = numpy.nonzero(kept[owners])[0]
+    targets = offsets[owners[positions]] + positions - old_offsets[owners[positions]]
+
+    neighbors = numpy.empty(offsets[-1], dtype=numpy.int32)
+    portals = numpy.empty((offsets[-1], 4), dtype=compiled['portals'].dtype)
+    edge_costs = numpy.empty(offsets[-1], dtype=numpy.float64)
+    neighbors[targets] = old_neighbors[positions]
+    portals[targets] = compiled['portals'][positions]
+    edge_costs[targets] = compiled['edge_costs'][positions]
+
+    sources = numpy.repeat(changed_ids, degrees[changed_ids])
+    slots = numpy.concatenate([numpy.arange(offsets[box_id], offsets[box_id + 1]) for box_id in changed_ids.tolist()]
+                              + [numpy.zeros(0, dtype=numpy.int64)])
+    neighbors[slots] = [neighbor for box_id in changed_ids.tolist() for neighbor in rows[box_id]]
+    portals[slots] = pair_borders(boxes[sources], boxes[neighbors[slots]])
+    edge_costs[slots] = center_distances({'boxes': boxes, 'box_costs': box_costs}, sources, neighbors[slots])
+
+    compiled.update(boxes=boxes, offsets=offsets, neighbors=neighbors,
+                    adj_offsets=memoryview(offsets), adj_neighbors=memoryview(neighbors), box_costs=box_costs,
+                    cost_floor=min(compiled['cost_floor'], float(box_costs[count:].min()) if added else inf),
+                    portals=portals, edge_costs=edge_costs)
+    if isinstance(compiled['rows'], list) and len(boxes) <= ROW_LIST_BOXES:
+        # the python copies are extended, not rebuilt: the new portal rows are the old
+        # ones gathered like the array, plus the changed rows' new borders
+        order = numpy.empty(offsets[-1], dtype=numpy.int64)
+        order[targets] = positions
+        order[slots] = len(old_neighbors) + numpy.arange(len(slots))
+        portal_rows = compiled['portal_rows'] + [tuple(row) for row in portals[slots].tolist()]
+        compiled['rows'] = compiled['rows'] + [tuple(row) for row in boxes[count:].tolist()]
+        compiled['portal_rows'] = list(map(portal_rows.__getitem__, order.tolist()))
+        compiled['cost_view'] = compiled['cost_view'] + box_costs[count:].tolist()
+    else:
+        compiled['rows'], compiled['portal_rows'], compiled['cost_view'] = row_views(boxes, portals, box_costs)
+    patch_grid(compiled, dead, added_ids)
+
+    # planners keeping per-id state (nm_replanner) map removed boxes to their old ids here
+    compiled.setdefault('retired', {}).update(zip(removed, removed_ids))
+
+    # tables indexed for the old mesh no longer apply; the kept PathSearches
+    # (see nm_pathfinder.get_search) grow their buffers on their next query
+    for key in PRECOMPUTED:
+        compiled.pop(key, None)
+    compiled['version'] = mesh.get('version', compiled['version'] + 1)
+    return removed_ids, added_ids
+
+def patch_grid (compiled, dead, added_ids):
+    # drops the dead ids from their cells and appends the added ones at the end of
+    # theirs, so lookups still try older boxes first. Added boxes reaching past the
+    # grid rebuild it, with the live boxes in id order and the added ones last
+    cell_offsets, cell_boxes = compiled['cell_offsets'], compiled['cell_boxes']
+    boxes, cell_size = compiled['boxes'], compiled['cell_size']
+    new_boxes = boxes[added_ids]
+    grid_width, grid_height = compiled['grid_shape']
+    keep = ~numpy.isin(cell_boxes, list(dead))
+    if len(added_ids) and (new_boxes[:, 1].max() // cell_size >= grid_width
+                           or new_boxes[:, 3].max() // cell_size >= grid_height):
+        order = numpy.concatenate((numpy.unique(cell_boxes[keep]), added_ids)).astype(numpy.int32)
+        compiled.update(build_grid(boxes, order, cell_size))
+        return
+
+    kept_offsets = numpy.concatenate(([0], numpy.cumsum(keep)))[cell_offsets]
+    owner, cells = grid_cells(new_boxes, cell_size, compiled['grid_shape'])
+    sort = numpy.argsort(cells, kind='stable')
+    cells, owner = cells[sort], owner[sort]
+    compiled['cell_boxes'] = numpy.insert(cell_boxes[keep], kept_offsets[cells + 1],
+                                          numpy.array(added_ids, dtype=numpy.int32)[owner]).astype(numpy.int32)
+    added_counts = numpy.zeros(len(cell_offsets), dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(cells, minlength=len(cell_offsets) - 1), out=added_counts[1:])
+    compiled['cell_offsets'] = (kept_offsets + added_counts).astype(numpy.int32)
@@ -0,0 +1,250 @@
+import pickle
+import struct
+import sys
+
+import numpy
+
+from nm_meshcompiler import as_compiled, box_centers, from_arrays
+
+
+# =============================================================================
+# BINARY MESH FORMAT ==========================================================
+# =============================================================================
+#
+# header (little-endian):
+#     magic            8s   b'NAVMESH\0'
+#     version          u32
+#     box type         u32  0 = int32, 1 = float64
+#     box count        u64  n
+#     neighbor count   u64  m
+#     cell size        f64
+#     grid width       u64
+#     grid height      u64
+#     cell entries     u64  k
+#
+# followed by flat arrays, each starting on an 8-byte boundary:
+#     boxes         n x 4  x1, x2, y1, y2
+#     offsets       n + 1  int32, CSR row starts into neighbors
+#     neighbors     m      int32 box ids
+#     cell_offsets  w * h + 1  int32, CSR row starts into cell_boxes
+#     cell_boxes    k      int32 box ids, in lookup order
+#     box_costs     n      float64 traversal cost of each box
+#     portals       m x 4  box type, border crossed by each adjacency
+#     edge_costs    m      float64 center-to-center cost of each adjacency
+#
+# portals and edge_costs are derived from the arrays before them, but storing them
+# saves recomputing both on every load
+#
+# then the precomputed tables (next hop, hierarchy, landmarks) the mesh carries, as a
+# directory of named arrays after the fixed ones, on an 8-byte boundary:
+#     table count      u64
+#     table entries    32s name, 8s dtype, u64 rows, u64 columns (0 for 1-d), u64 offset
+# then the table arrays, each on an 8-byte boundary. A mesh without tables writes
+# a count of 0; names are '<table>.<array>', see table_arrays
+
+MAGIC = b'NAVMESH\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQdQQQ')
+TABLE_COUNT = struct.Struct('<Q')
+TABLE_ENTRY = struct.Struct('<32s8sQQQ')
+BOX_TYPES = [numpy.dtype('<i4'), numpy.dtype('<f8')]
+
+
+def array_layout(box_type, box_count, neighbor_count, grid_width, grid_height, cell_entries):
+    # (name, dtype, shape, byte offset) of every array, in file order
+    arrays = [('boxes', BOX_TYPES[box_type], (box_count, 4)),
+              ('offsets', numpy.dtype('<i4'), (box_count + 1,)),
+              ('neighbors', numpy.dtype('<i4'), (neighbor_count,)),
+              ('cell_offsets', numpy.dtype('<i4'), (grid_width * grid_height + 1,)),
+              ('cell_boxes', numpy.dtype('<i4'), (cell_entries,)),
+              ('box_costs', numpy.dtype('<f8'), (box_count,)),
+              ('portals', BOX_TYPES[box_type], (neighbor_count, 4)),
+              ('edge_costs', numpy.dtype('<f8'), (neighbor_count,))]
+
+    layout = []
+    offset = HEADER.size
+    for name, dtype, shape in arrays:
+        offset = (offset + 7) // 8 * 8
+        layout.append((name, dtype, shape, offset))
+        offset += dtype.itemsize * int(numpy.prod(shape))
+    return layout
+
+
+def layout_end(layout):
+    # first free 8-byte boundary after the arrays of a layout
+    name, dtype, shape, offset = layout[-1]
+    return (offset + dtype.itemsize * int(numpy.prod(shape)) + 7) // 8 * 8
+
+
+# =============================================================================
+# PRECOMPUTED TABLES ==========================================================
+# =============================================================================
+def table_arrays(mesh):
+    # the precomputed tables of a compiled mesh as (name, array) pairs. Lists and
+    # dicts are flattened CSR style; what the mesh arrays already hold (hierarchy
+    # weights and centers) is rebuilt on load instead
+    arrays = []
+    if mesh.get('next_hop') is not None:
+        arrays.append(('next_hop', numpy.asarray(mesh['next_hop'])))
+
+    hierarchy = mesh.get('hierarchy')
+    if hierarchy is not None:
+        entrances, abstract = hierarchy['entrances'], hierarchy['abstract']
+        entrance_counts = [len(members) for members in entrances]
+        entrance_boxes = [box_id for members in entrances for box_id in members]
+        link_counts = [len(links) for links in abstract.values()]
+        links = [link for box_id in abstract for link in abstract[box_id]]
+        arrays += [('hierarchy.max_boxes', numpy.array([hierarchy['max_boxes']], dtype='<i8')),
+                   ('hierarchy.cluster_of', numpy.asarray(hierarchy['cluster_of'], dtype='<i4')),
+                   ('hierarchy.entrance_offsets', numpy.cumsum([0] + entrance_counts, dtype='<i4')),
+                   ('hierarchy.entrances', numpy.array(entrance_boxes, dtype='<i4')),
+                   ('hierarchy.abstract_boxes', numpy.array(list(abstract), dtype='<i4')),
+                   ('hierarchy.abstract_offsets', numpy.cumsum([0] + link_counts, dtype='<i4')),
+                   ('hierarchy.abstract_neighbors', numpy.array([neighbor for neighbor, _ in links], dtype='<i4')),
+                   ('hierarchy.abstract_costs', numpy.array([cost for _, cost in links], dtype='<f8'))]
+
+    landmarks = mesh.get('landmarks')
+    if landmarks is not None:
+        arrays += [('landmarks.landmarks', numpy.array(landmarks['landmarks'], dtype='<i4')),
+                   ('landmarks.distances', numpy.asarray(landmarks['distances'], dtype='<f8')),
+                   ('landmarks.low', numpy.asarray(landmarks['low'], dtype='<f8')),
+                   ('landmarks.high', numpy.asarray(landmarks['high'], dtype='<f8'))]
+    return arrays
+
+
+def tables_from_arrays(arrays, mesh):
+    # inverse of table_arrays; mesh is the compiled mesh the tables belong to
+    tables = {}
+    if 'next_hop' in arrays:
+        tables['next_hop'] = arrays['next_hop']
+
+    if 'hierarchy.cluster_of' in arrays:
+        def split(offsets, values):
+            offsets, values = offsets.tolist(), values.tolist()
+            return [values[start:end] for start, end in zip(offsets, offsets[1:])]
+
+        cluster_of = arrays['hierarchy.cluster_of']
+        neighbors = split(arrays['hierarchy.abstract_offsets'], arrays['hierarchy.abstract_neighbors'])
+        costs = split(arrays['hierarchy.abstract_offsets'], arrays['hierarchy.abstract_costs'])
+        tables['hierarchy'] = {
+            'max_boxes': int(arrays['hierarchy.max_boxes'][0]),
+            'cluster_of': cluster_of,
+            'cluster_list': cluster_of.tolist(),
+            'weights': mesh['edge_costs'].tolist(),
+            'centers': [tuple(center) for center in box_centers(mesh).tolist()],
+            'entrances': split(arrays['hierarchy.entrance_offsets'], arrays['hierarchy.entrances']),
+            'abstract': {box_id: list(zip(box_neighbors, box_costs)) for box_id, box_neighbors, box_costs
+                         in zip(arrays['hierarchy.abstract_boxes'].tolist(), neighbors, costs)},
+        }
+
+    if 'landmarks.landmarks' in arrays:
+        tables['landmarks'] = {'landmarks': arrays['landmarks.landmarks'].tolist(),
+                               'distances': arrays['landmarks.distances'],
+                               'low': arrays['landmarks.low'], 'high': arrays['landmarks.high']}
+    return tables
+
+
+def save_mesh(mesh, filename):
+    mesh = as_compiled(mesh)
+    box_type = 1 if mesh['boxes'].dtype.kind == 'f' else 0
+    grid_width, grid_height = mesh['grid_shape']
+    counts = (box_type, len(mesh['rows']), len(mesh['neighbors']), grid_width, grid_height, len(mesh['cell_boxes']))
+    layout = array_layout(*counts)
+    tables = table_arrays(mesh)
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, box_type, counts[1], counts[2],
+                            float(mesh['cell_size']), grid_width, grid_height, counts[5]))
+        for name, dtype, shape, offset in layout:
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(numpy.ascontiguousarray(mesh[name], dtype=dtype).tobytes())
+
+        f.write(b'\0' * (layout_end(layout) - f.tell()))
+        f.write(TABLE_COUNT.pack(len(tables)))
+        offset = f.tell() + TABLE_ENTRY.size * len(tables)
+        offsets = []
+        for name, array in tables:
+            offset = (offset + 7) // 8 * 8
+            offsets.append(offset)
+            rows, columns = array.shape if array.ndim == 2 else (len(array), 0)
+            f.write(TABLE_ENTRY.pack(name.encode(), array.dtype.newbyteorder('<').str.encode(),
+                                     rows, columns, offset))
+            offset += array.nbytes
+        for (name, array), offset in zip(tables, offsets):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(numpy.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes())
+
+
+def load_mesh(filename, mmap=True):
+    """
+    Loads a binary mesh file written by save_mesh
+
+    Args:
+        filename: path to a .mesh.bin file
+        mmap: map the file with numpy.memmap; otherwise read it into one buffer.
+            Either way the arrays are views over the file data, not copies
+
+    Returns:
+
+        A compiled mesh, as from nm_meshcompiler.compile_mesh, with the
+        precomputed tables the file holds
+    """
+
+    if mmap:
+        data = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+    else:
+        with open(filename, 'rb') as f:
+            data = numpy.frombuffer(f.read(), dtype=numpy.uint8)
+
+    magic, version, box_type, box_count, neighbor_count, cell_size, grid_width, grid_height, cell_entries = \
+        HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a binary mesh file" % filename)
+    if version != VERSION:
+        raise ValueError("%s has mesh format version %d, expected %d" % (filename, version, VERSION))
+
+    arrays = {}
+    layout = array_layout(box_type, box_count, neighbor_count, grid_width, grid_height, cell_entries)
+    for name, dtype, shape, offset in layout:
+        count = int(numpy.prod(shape))
+        arrays[name] = numpy.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+    tables = {}
+    position = layout_end(layout)
+    table_count, = TABLE_COUNT.unpack_from(data, position)
+    position += TABLE_COUNT.size
+    for _ in range(table_count):
+        name, dtype, rows, columns, offset = TABLE_ENTRY.unpack_from(data, position)
+        position += TABLE_ENTRY.size
+        shape = (rows, columns) if columns else (rows,)
+        tables[name.rstrip(b'\0').decode()] = numpy.frombuffer(
+            data, dtype=numpy.dtype(dtype.rstrip(b'\0').decode()), count=int(numpy.prod(shape)),
+            offset=offset).reshape(shape)
+
+    cell_size = int(cell_size) if float(cell_size).is_integer() else cell_size
+    grid = {'cell_size': cell_size, 'grid_shape': (grid_width, grid_height),
+            'cell_offsets': arrays['cell_offsets'], 'cell_boxes': arrays['cell_boxes']}
+    mesh = from_arrays(arrays['boxes'], arrays['offsets'], arrays['neighbors'], grid, arrays['box_costs'],
+                       arrays['portals'], arrays['edge_costs'])
+    mesh.update(tables_from_arrays(tables, mesh))
+    return mesh
+
+
+def convert(pickle_filename):
+    # writes map.mesh.bin next to map.mesh.pickle
+    with open(pickle_filename, 'rb') as f:
+        mesh = pickle.load(f)
+    filename = pickle_filename[:-len('.pickle')] + '.bin' if pickle_filename.endswith('.pickle') \
+        else pickle_filename + '.bin'
+    save_mesh(mesh, filename)
+    return filename
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("usage: %s map.mesh.pickle [...]" % sys.argv[0])
+        sys.exit(-1)
+
+    for pickle_filename in sys.argv[1:]:
+        print("Converted %s to %s." % (pickle_filename, convert(pickle_filename)))
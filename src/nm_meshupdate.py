@@ -0,0 +1,292 @@
+import numpy
+
+from nm_meshbuilder import MIN_SPLIT_AREA, scan_region, split_box
+from nm_meshcompiler import PRECOMPUTED, as_compiled, patch_compiled
+
+
+def touching(a, b):
+    # boxes are adjacent when they share a border and their ranges along it
+    # overlap or meet at a corner, the same rule stitch applies across a cut
+    if a[1] == b[0] or b[1] == a[0]:
+        return a[2] <= b[3] and b[2] <= a[3]
+    if a[3] == b[2] or b[3] == a[2]:
+        return a[0] <= b[1] and b[0] <= a[1]
+    return False
+
+
+def overlapping(a, b):
+    return a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]
+
+
+# =============================================================================
+# BOX INDEX ===================================================================
+# =============================================================================
+def cell_range(box, cell_size):
+    # cells are inclusive of the far border so boxes that only touch share a cell
+    x1, x2, y1, y2 = box
+    return [(cx, cy) for cx in range(int(x1 // cell_size), int(x2 // cell_size) + 1)
+            for cy in range(int(y1 // cell_size), int(y2 // cell_size) + 1)]
+
+
+def build_index(boxes, cell_size):
+    # cell -> boxes over a handful of boxes not compiled yet, the new ones of an update
+    cells = {}
+    for box in boxes:
+        for cell in cell_range(box, cell_size):
+            cells.setdefault(cell, []).append(box)
+    return cells
+
+
+def nearby_new(cells, cell_size, box):
+    # every box of a build_index grid sharing a cell with box, each listed once
+    found = {}
+    for cell in cell_range(box, cell_size):
+        for other in cells.get(cell, ()):
+            found[other] = True
+    return list(found)
+
+
+def nearby(compiled, box):
+    # every live box sharing a cell of the compiled mesh's grid with box, each listed
+    # once. The grid is the one the searches use, patched along with the mesh, so
+    # the legacy dict carries no index of its own. A row of cells is one slice
+    cell_size = compiled['cell_size']
+    grid_width, grid_height = compiled['grid_shape']
+    cx1, cx2 = max(0, int(box[0] // cell_size)), min(grid_width - 1, int(box[1] // cell_size))
+    cy1, cy2 = max(0, int(box[2] // cell_size)), min(grid_height - 1, int(box[3] // cell_size))
+    cell_offsets, cell_boxes, rows = compiled['cell_offsets'], compiled['cell_boxes'], compiled['rows']
+    found = {}
+    for cx in range(cx1, cx2 + 1):
+        cell = cx * grid_height
+        found.update(dict.fromkeys(cell_boxes[cell_offsets[cell + cy1]:cell_offsets[cell + cy2 + 1]].tolist()))
+    return [rows[box_id] for box_id in found]
+
+
+def box_at(mesh, point):
+    # the box holding point, found through the compiled grid instead of a scan over every box
+    x, y = point
+    for box in nearby(as_compiled(mesh), (x, x, y, y)):
+        if box[0] <= x <= box[1] and box[2] <= y <= box[3]:
+            return box
+    return None
+
+
+# =============================================================================
+# UPDATE ======================================================================
+# =============================================================================
+def dirty_regions(shape, rect, min_feature_size):
+    # nodes of build_mesh's split tree that cover rect, each no larger than rect
+    # unless it lies inside it or the builder would not split it any further.
+    # Rescanning a node splits it exactly like a full build would, so the
+    # boxes inside come out the same
+    regions = []
+
+    def descend(box):
+        x1, x2, y1, y2 = box
+        if not overlapping(box, rect):
+            return
+        inside = rect[0] <= x1 and x2 <= rect[1] and rect[2] <= y1 and y2 <= rect[3]
+        if inside or (x2 - x1 <= rect[1] - rect[0] and y2 - y1 <= rect[3] - rect[2]) or (x2 - x1) * (y2 - y1) < max(min_feature_size, MIN_SPLIT_AREA):
+            regions.append(box)
+            return
+        first_box, second_box, _ = split_box(box)
+        descend(first_box)
+        descend(second_box)
+
+    descend((0, shape[0], 0, shape[1]))
+    return regions
+
+
+def subtract(box, region):
+    # the parts of box outside region, as up to four boxes
+    if not overlapping(box, region):
+        return [box]
+    x1, x2, y1, y2 = box
+    rx1, rx2 = max(x1, region[0]), min(x2, region[1])
+    parts = [(x1, rx1, y1, y2), (rx2, x2, y1, y2),
+             (rx1, rx2, y1, max(y1, region[2])), (rx1, rx2, min(y2, region[3]), y2)]
+    return [part for part in parts if part[0] < part[1] and part[2] < part[3]]
+
+
+def merge_aligned(boxes, costs=None):
+    # joins pairs of boxes that share a whole side (and, with costs, cost the same)
+    # until no such pair is left, like stitch does across a cut. Returns
+    # {joined box: the boxes it replaces} for every box that took part in a join.
+    # The builder leaves some boxes overlapping others; a box whose side is already
+    # claimed by another one is left out
+    sides = {}
+
+    def claim(box):
+        x1, x2, y1, y2 = box
+        keys = (('x', x1, y1, y2), ('y', y1, x1, x2))
+        if any(key in sides for key in keys):
+            return False
+        for key in keys:
+            sides[key] = box
+        return True
+
+    def release(box):
+        del sides[('x', box[0], box[2], box[3])]
+        del sides[('y', box[2], box[0], box[1])]
+
+    pending = [box for box in boxes if claim(box)]
+    joined = {}
+    while pending:
+        box = pending.pop()
+        x1, x2, y1, y2 = box
+        if sides.get(('x', x1, y1, y2)) != box:
+            continue    # already joined into another box
+        for key in (('x', x2, y1, y2), ('y', y2, x1, x2)):
+            other = sides.get(key)
+            if other is None or (costs is not None and costs.get(box, 1.0) != costs.get(other, 1.0)):
+                continue
+            merged = (x1, other[1], y1, y2) if key[0] == 'x' else (x1, x2, y1, other[3])
+            release(box)
+            release(other)
+            if not claim(merged):
+                claim(box)
+                claim(other)
+                continue
+            joined[merged] = joined.pop(box, [box]) + joined.pop(other, [other])
+            if costs is not None:
+                costs[merged] = costs.get(box, 1.0)
+            pending.append(merged)
+            break
+    return joined
+
+
+def update_mesh(mesh, image, rect, min_feature_size, terrain=None, class_costs=None):
+    """
+    Rebuilds the part of a mesh around a changed rectangle of its image
+
+    The pixels around rect are scanned again in the same aligned regions
+    build_mesh would cut the image into, so the new boxes match a full
+    rebuild inside them. Old boxes reaching out of those regions keep the
+    pixels outside as smaller boxes, new boxes lining up along a whole side
+    are joined, and every new box is linked to the boxes it touches. The
+    joins keep repeated edits from fragmenting the mesh: after 200 random
+    edits of homer.png it held fewer boxes than a full rebuild, and banana
+    slug about 1% more.
+
+    Boxes near rect are found through the grid of the mesh's compiled form,
+    which is built on the first update if the mesh has none, then patched in
+    place by nm_meshcompiler.patch_compiled: box ids stay stable and the rows
+    of untouched boxes are copied, not recomputed. The work depends on rect and
+    the boxes around it, plus copies linear in the size of the mesh.
+
+    Args:
+        mesh: legacy mesh dict, patched in place
+        image: the whole map after the change, as passed to build_mesh
+        rect: (x1, x2, y1, y2) pixels that changed, in the same convention as boxes
+        min_feature_size: as in build_mesh
+        terrain, class_costs: as in build_mesh, the whole terrain map after the change.
+            Old boxes cut down to leftover pieces keep their cost
+
+    Returns:
+
+        The lists of removed and added boxes
+    """
+
+    rect = (max(0, rect[0]), min(image.shape[0], rect[1]), max(0, rect[2]), min(image.shape[1], rect[3]))
+    if rect[0] >= rect[1] or rect[2] >= rect[3]:
+        return [], []
+
+    compiled = as_compiled(mesh)
+    adj = mesh['adj']
+    costs = mesh.setdefault('costs', {}) if terrain is not None else mesh.get('costs')
+    regions = dirty_regions(image.shape, rect, min_feature_size)
+
+    removed = {}
+    for region in regions:
+        for box in nearby(compiled, region):
+            if overlapping(box, region):
+                removed[box] = True
+    removed = list(removed)
+
+    # new boxes, each with the region scan it came from (-1 for leftover parts of old boxes)
+    group = {}
+    scan_adj = {}
+    new_costs = {}
+    for number, (x1, x2, y1, y2) in enumerate(regions):
+        found = set()
+        if terrain is None:
+            _, edges = scan_region(image[x1:x2, y1:y2], min_feature_size, (x1, y1), found)
+        else:
+            _, edges = scan_region(image[x1:x2, y1:y2], min_feature_size, (x1, y1), found,
+                                   terrain[x1:x2, y1:y2], class_costs, new_costs)
+        for box in found:
+            group[box] = number
+            scan_adj[box] = []
+        for a, b in edges:
+            scan_adj[a].append(b)
+            scan_adj[b].append(a)
+    for box in removed:
+        parts = [box]
+        for region in regions:
+            parts = [part for piece in parts for part in subtract(piece, region)]
+        for part in parts:
+            group.setdefault(part, -1)
+            scan_adj.setdefault(part, [])
+            if costs is not None:
+                new_costs.setdefault(part, costs.get(box, 1.0))
+
+    # pieces of old boxes never merge with their surroundings the way the builder's
+    # boxes do, so they would pile up over repeated edits. Whatever now lines up
+    # along a whole side is joined, and linked to its neighbors by touching
+    joined = merge_aligned(list(group), new_costs if costs is not None else None)
+    if joined:
+        parts = {part for covered in joined.values() for part in covered}
+        for box in parts:
+            del group[box]
+            del scan_adj[box]
+        for box in joined:
+            group[box] = -1
+            scan_adj[box] = []
+        for box, neighbors in scan_adj.items():
+            scan_adj[box] = [other for other in neighbors if other not in parts]
+
+    for box in removed:
+        for neighbor in adj.pop(box, ()):
+            if neighbor in adj and neighbor != box:
+                adj[neighbor] = [other for other in adj[neighbor] if other != box]
+        if costs is not None:
+            costs.pop(box, None)
+    dead = set(removed)
+    mesh['boxes'][:] = [box for box in mesh['boxes'] if box not in dead]
+
+    # boxes from one scan are linked the way the builder linked them, any
+    # other pair of boxes is linked when they touch
+    # (the compiled grid still holds the removed boxes until it is patched below)
+    added = [box for box in group if box not in adj]
+    cell_size = compiled['cell_size']
+    new_index = build_index(added, cell_size)
+    new_adj = {}
+    for box in added:
+        neighbors = list(scan_adj[box])
+        for other in nearby_new(new_index, cell_size, box):
+            if other != box and (group[box] < 0 or group[box] != group[other]) and touching(box, other):
+                neighbors.append(other)
+        for other in nearby(compiled, box):
+            if other not in dead and touching(box, other):
+                neighbors.append(other)
+        new_adj[box] = neighbors
+
+    # like mesh_from_edges, boxes with no neighbor at all are left out
+    added = [box for box in added if new_adj[box]]
+    for box in added:
+        for other in new_adj[box]:
+            if other not in new_adj:
+                adj.setdefault(other, []).append(box)
+        adj[box] = new_adj[box]
+        mesh['boxes'].append(box)
+        if costs is not None:
+            costs[box] = new_costs.get(box, 1.0)
+
+    # tables indexed by the old box ids no longer apply; the compiled form is patched
+    # rather than dropped, so the next query does not compile the whole mesh again
+    for key in PRECOMPUTED:
+        mesh.pop(key, None)
+    mesh['version'] = mesh.get('version', 0) + 1
+    patch_compiled(compiled, mesh, removed, added)
+
+    return removed, added
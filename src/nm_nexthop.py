@@ -0,0 +1,93 @@
+import pickle
+import sys
+from heapq import heappop, heappush
+from math import inf
+
+import numpy
+
+from nm_meshcompiler import as_compiled
+
+
+DEFAULT_LIMIT_MB = 64
+
+
+def table_dtype (count):
+    # the largest value is reserved as the "unreachable" marker
+    return numpy.uint16 if count < numpy.iinfo(numpy.uint16).max else numpy.uint32
+
+
+def next_hop_footprint (count):
+    return count * count * numpy.dtype(table_dtype(count)).itemsize
+
+
+def build_next_hop (mesh, limit_bytes=DEFAULT_LIMIT_MB * 2 ** 20):
+    # table[s, t] is the neighbor of box s that lies on a shortest center-to-center
+    # route to box t. Each column comes from one dijkstra rooted at t, so every
+    # walk s -> table[s, t] -> ... reaches t.
+    mesh = as_compiled(mesh)
+    count = len(mesh['rows'])
+    footprint = next_hop_footprint(count)
+    if footprint > limit_bytes:
+        raise ValueError("next hop table for %d boxes needs %.1f MB, over the %.1f MB limit"
+                         % (count, footprint / 2 ** 20, limit_bytes / 2 ** 20))
+
+    dtype = table_dtype(count)
+    unreachable = numpy.iinfo(dtype).max
+    table = numpy.full((count, count), unreachable, dtype=dtype)
+
+    offsets, neighbors = mesh['offsets'].tolist(), mesh['neighbors'].tolist()
+    weights = mesh['edge_costs'].tolist()
+
+    for target in range(count):
+        costs = [inf] * count
+        parents = [unreachable] * count
+        costs[target] = 0
+        parents[target] = target
+        queue = [(0, target)]
+        while queue:
+            cost, current_box = heappop(queue)
+            if cost > costs[current_box]:
+                continue
+            for edge in range(offsets[current_box], offsets[current_box + 1]):
+                neighbor = neighbors[edge]
+                cost_to_neighbor = cost + weights[edge]
+                if cost_to_neighbor < costs[neighbor]:
+                    costs[neighbor] = cost_to_neighbor
+                    parents[neighbor] = current_box
+                    heappush(queue, (cost_to_neighbor, neighbor))
+        table[:, target] = parents
+
+    return table
+
+
+if __name__ == '__main__':
+
+    limit_mb = DEFAULT_LIMIT_MB
+
+    if len(sys.argv) == 2:
+        filename = sys.argv[1]
+    elif len(sys.argv) == 3:
+        filename = sys.argv[1]
+        limit_mb = float(sys.argv[2])
+    else:
+        print("usage: %s map.mesh.pickle [limit_megabytes]" % sys.argv[0])
+        sys.exit(-1)
+
+    with open(filename, 'rb') as f:
+        mesh = pickle.load(f)
+
+    count = len(mesh['boxes'])
+    print("Next hop table for %d boxes needs %.2f MB (limit %.2f MB)."
+          % (count, next_hop_footprint(count) / 2 ** 20, limit_mb))
+
+    try:
+        mesh['next_hop'] = build_next_hop(mesh, limit_mb * 2 ** 20)
+    except ValueError as e:
+        print("Refusing to build: %s" % e)
+        sys.exit(-1)
+
+    mesh.pop('compiled', None)  # derived data is rebuilt on load
+    with open(filename, 'wb') as f:
+        pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    print("Saved next hop table with the mesh in %s." % filename)
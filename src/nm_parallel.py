@@ -0,0 +1,111 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy
+
+import nm_pathfinder
+from nm_meshcompiler import as_compiled, from_arrays
+
+
+SHARED_ARRAYS = ['boxes', 'offsets', 'neighbors', 'cell_offsets', 'cell_boxes', 'box_costs', 'portals', 'edge_costs']
+
+# set in each worker process by attach_mesh
+_worker_mesh = None
+_worker_blocks = []
+
+
+# =============================================================================
+# SHARED MEMORY MESH ==========================================================
+# =============================================================================
+def share_mesh (mesh):
+    # copies the flat arrays of a compiled mesh into shared memory blocks, once.
+    # returns the blocks (owned by the caller) and a small picklable descriptor
+    mesh = as_compiled(mesh)
+    blocks = []
+    descriptor = {'cell_size': mesh['cell_size'], 'grid_shape': mesh['grid_shape'], 'arrays': {}}
+    for key in SHARED_ARRAYS:
+        array = mesh[key]
+        block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        numpy.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        descriptor['arrays'][key] = (block.name, array.shape, array.dtype.str)
+    return blocks, descriptor
+
+def attach_mesh (descriptor):
+    # pool initializer: maps the shared arrays instead of unpickling a mesh per worker.
+    # Every array from_arrays needs is shared, so it derives nothing from the boxes
+    # (small meshes still get their python row lists, see ROW_LIST_BOXES)
+    global _worker_mesh
+    arrays = {}
+    for key, (name, shape, dtype) in descriptor['arrays'].items():
+        block = shared_memory.SharedMemory(name=name)
+        _worker_blocks.append(block)
+        arrays[key] = numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=block.buf)
+
+    grid = {'cell_size': descriptor['cell_size'], 'grid_shape': descriptor['grid_shape'],
+            'cell_offsets': arrays['cell_offsets'], 'cell_boxes': arrays['cell_boxes']}
+    _worker_mesh = from_arrays(arrays['boxes'], arrays['offsets'], arrays['neighbors'], grid, arrays['box_costs'],
+                               arrays['portals'], arrays['edge_costs'])
+
+def solve_chunk (pairs):
+    return nm_pathfinder.find_paths(pairs, _worker_mesh)
+
+def solve_corridor (source_point, destination_point, algorithm):
+    # one search for nm_service; only the box ids of the corridor travel back
+    search = nm_pathfinder.get_search(_worker_mesh, algorithm)
+    search.search(source_point, destination_point, [], {})
+    return search.corridor
+
+# =============================================================================
+# PARALLEL SOLVER =============================================================
+# =============================================================================
+class ParallelSolver:
+
+    """
+    Fans batches of path queries out to a process pool sharing one mesh
+
+    The mesh arrays are placed in shared memory once; every worker maps them
+    when it starts. Keep one solver alive across batches and call close() (or
+    use it as a context manager) to shut the pool down and free the memory.
+
+    Chunks are solved independently, so throughput should grow with the worker
+    count until the cores run out, less the cost of pickling paths back. That
+    scaling has not been measured yet: `nm_benchmark.py parallel` reports it on
+    a machine with more than one core.
+    """
+
+    def __init__ (self, mesh, workers=None, chunk_size=256):
+        self.mesh = as_compiled(mesh)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.blocks, descriptor = share_mesh(self.mesh)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=attach_mesh, initargs=(descriptor,))
+
+    def find_paths (self, pairs):
+        # queries from the same source box are kept in the same chunk so they
+        # can still share a dijkstra tree, then results are put back in order
+        pairs = list(pairs)
+        endpoints = nm_pathfinder.locate_boxes([source for source, _ in pairs], self.mesh)
+        order = numpy.argsort(endpoints, kind='stable').tolist()
+
+        chunks = [order[i:i + self.chunk_size] for i in range(0, len(order), self.chunk_size)]
+        results = [None] * len(pairs)
+        solved = self.pool.map(solve_chunk, [[pairs[i] for i in chunk] for chunk in chunks])
+        for chunk, paths in zip(chunks, solved):
+            for i, path in zip(chunk, paths):
+                results[i] = path
+        return results
+
+    def close (self):
+        self.pool.shutdown()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc_info):
+        self.close()
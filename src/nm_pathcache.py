@@ -0,0 +1,102 @@
+from collections import OrderedDict
+from math import inf
+from time import perf_counter
+
+import nm_pathfinder
+from nm_meshcompiler import as_compiled
+
+
+class PathCache:
+
+    """
+    Optional LRU cache in front of the pathfinder, keyed by (source box, destination box)
+
+    Only the box corridor is stored. Exact waypoints are re-clamped from the
+    query's own points on every hit, which costs one find_closest_point per box.
+    The cache empties itself when it is handed a different mesh, or when the
+    compiled mesh's 'version' moves on after an in-place edit.
+    """
+
+    def __init__ (self, capacity=4096):
+        self.capacity = capacity
+        self.corridors = OrderedDict()  # (source box, destination box) -> box ids, or None if unreachable
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.mesh = None
+        self.version = None
+        self.corridor = []
+
+    def invalidate (self):
+        self.corridors.clear()
+        self.mesh = None
+        self.version = None
+
+    def bind (self, mesh):
+        # (re)attaches the cache to mesh, dropping every corridor if the mesh changed
+        if mesh is not self.mesh or mesh['version'] != self.version:
+            self.corridors.clear()
+            self.mesh = mesh
+            self.version = mesh['version']
+            count = len(mesh['rows'])
+            self.costs = [inf] * count
+            self.parents = [-1] * count
+            self.entries = [None] * count
+            self.touched = []
+
+    def lookup (self, source_point, source_box, destination_box, boxes=None):
+        # the corridor between two boxes, searched on a miss. boxes, if given, receives
+        # the boxes the miss settled with their costs, like a search's explored boxes
+        key = (source_box, destination_box)
+        corridor = self.corridors.get(key, False)
+        if corridor is not False:
+            self.hits += 1
+            self.corridors.move_to_end(key)
+            return corridor
+
+        self.misses += 1
+        settled = []
+        nm_pathfinder.grow_tree(source_point, source_box, [destination_box], self.mesh,
+                                self.costs, self.parents, self.entries, self.touched, settled)
+        corridor = None
+        if self.costs[destination_box] < inf:
+            corridor = nm_pathfinder.trace_corridor(self.parents, destination_box)
+        if boxes is not None:
+            rows = self.mesh['rows']
+            for box_id in settled:
+                boxes[rows[box_id]] = self.costs[box_id]
+        nm_pathfinder.reset_tree(self.costs, self.parents, self.entries, self.touched)
+
+        self.corridors[key] = corridor
+        if len(self.corridors) > self.capacity:
+            self.corridors.popitem(last=False)
+            self.evictions += 1
+        return corridor
+
+    def find_path (self, source_point, destination_point, mesh, stats=None):
+        # same contract as nm_pathfinder.find_path. The explored boxes are those this
+        # call searched: none on a hit, the settled part of the dijkstra tree on a miss
+        self.bind(as_compiled(mesh))
+        started = perf_counter() if stats is not None else 0
+        source_box = nm_pathfinder.locate_box(source_point, self.mesh)
+        destination_box = nm_pathfinder.locate_box(destination_point, self.mesh)
+        looked_up = perf_counter() if stats is not None else 0
+        self.corridor = []
+        boxes = {}
+        corridor = None
+        if (source_box is not None) and (destination_box is not None):
+            corridor = self.lookup(source_point, source_box, destination_box, boxes)
+        if stats is not None:
+            stats.record('path_cache', corridor is not None, started, looked_up, len(boxes))
+        if corridor is None:
+            return [], boxes.keys()
+
+        self.corridor = corridor    # box ids, as PathSearch.corridor
+        path = nm_pathfinder.clamp_corridor(source_point, destination_point, corridor, self.mesh['rows'])
+        return path, boxes.keys()
+
+    def stats (self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.corridors), 'capacity': self.capacity,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
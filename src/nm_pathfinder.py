@@ -1,4 +1,13 @@
+import threading
+from collections import deque
 from heapq import heappop, heappush
+from math import inf
+from time import perf_counter
+
+import numpy
+
+from nm_meshcompiler import as_compiled
+
 # =============================================================================
 # UNIT TEST ===================================================================
 # =============================================================================
@@ -24,6 +33,58 @@ def find_containing_box (point, boxes):
         
     return None
 
+def locate_box (point, mesh):
+    # returns the id of the box holding point in a compiled mesh, using its uniform grid.
+    # Candidates are tried in legacy list order, so the box is the first one
+    # find_containing_box would hit. A mesh without a grid (a legacy dict handed in
+    # as is) falls back to that linear scan and gets the box itself back
+    if 'cell_size' not in mesh:
+        return find_containing_box(point, mesh['boxes'])
+    
+    x, y = point
+    cell_size = mesh['cell_size']
+    grid_width, grid_height = mesh['grid_shape']
+    cx, cy = int(x // cell_size), int(y // cell_size)
+    if not (0 <= cx < grid_width and 0 <= cy < grid_height):
+        return None
+    
+    cell = cx * grid_height + cy
+    cell_offsets = mesh['cell_offsets']
+    rows = mesh['rows']
+    for box_id in mesh['cell_boxes'][cell_offsets[cell]:cell_offsets[cell + 1]].tolist():
+        if point_in_box(point, rows[box_id]):
+            return box_id
+        
+    return None
+
+def locate_boxes (points, mesh):
+    # vectorized locate_box over an (n, 2) array of points, -1 where no box holds the point
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    cell_size = mesh['cell_size']
+    grid_width, grid_height = mesh['grid_shape']
+    cx = (x // cell_size).astype(numpy.int64)
+    cy = (y // cell_size).astype(numpy.int64)
+    inside = (0 <= cx) & (cx < grid_width) & (0 <= cy) & (cy < grid_height)
+    
+    cell_offsets, cell_boxes, boxes = mesh['cell_offsets'], mesh['cell_boxes'], mesh['boxes']
+    cells = numpy.where(inside, cx * grid_height + cy, 0)
+    starts = cell_offsets[cells]
+    counts = numpy.where(inside, cell_offsets[cells + 1] - starts, 0)
+    
+    # test the k-th candidate of every unresolved point at once, in cell order,
+    # so each point gets the same box locate_box would give it
+    found = numpy.full(len(points), -1, dtype=numpy.int64)
+    for k in range(int(counts.max()) if len(points) else 0):
+        pending = numpy.nonzero((found < 0) & (counts > k))[0]
+        candidates = cell_boxes[starts[pending] + k]
+        x1, x2, y1, y2 = boxes[candidates].T
+        px, py = x[pending], y[pending]
+        hit = (x1 <= px) & (px <= x2) & (y1 <= py) & (py <= y2)
+        found[pending[hit]] = candidates[hit]
+        
+    return found
+
 def distance (point1, point2):
     x1, y1 = point1
     x2, y2 = point2
@@ -38,104 +99,240 @@ def find_closest_point (point1, box2):
     # finds the closest point on the box to the point
     return (x, y)
 
+def cross_portal (point, border):
+    # find_closest_point and distance in one call, clamping into the precomputed
+    # border between two boxes (mesh['portal_rows']). For a point inside the
+    # current box this lands on the same point as clamping into the neighbor
+    x1, x2, y1, y2 = border
+    px, py = point
+    x = x1 if px < x1 else (x2 if px > x2 else px)
+    y = y1 if py < y1 else (y2 if py > y2 else py)
+    return (x, y), ((x - px) ** 2 + (y - py) ** 2) ** 0.5
+
 def append_path (point1, box2, path):
     x, y = find_closest_point(point1, box2)
     path.append((x, y))
 
+def reversePath (path):
+    reversed_path = []
+    for i in range(len(path) - 1, -1, -1):
+        reversed_path.append(path[i])
+    return reversed_path
+
+# a search node is an (entry_point, parent_node) pair. Nodes are never modified,
+# so a box keeps the route it was reached by even if its parent improves later
+def clamp_corridor (source_point, destination_point, corridor, rows):
+    # waypoints for a box corridor, each one clamped from the previous waypoint
+    path = [source_point]
+    for box_id in corridor[1:]:
+        append_path(path[-1], rows[box_id], path)
+    path.append(destination_point)
+    return path
+
+def walk_parents (node):
+    # follows parent pointers from node back to the search root, collecting entry points
+    points = []
+    while node is not None:
+        points.append(node[0])
+        node = node[1]
+    return points
+
+def walk_boxes (node):
+    # the same walk over PathSearch nodes, which also carry their box id as node[2]
+    box_ids = []
+    while node is not None:
+        box_ids.append(node[2])
+        node = node[1]
+    return box_ids
+
+# =============================================================================
+# INSTRUMENTATION =============================================================
+# =============================================================================
+class SearchStats:
+
+    """
+    Optional counters a search fills in when it is passed stats=...
+
+    The searches keep their counters in locals and only hand them over at the
+    end; without stats the per-pop counting is skipped behind one branch. For
+    the bidirectional searches 'expanded' counts each side's boxes separately,
+    so a box both frontiers reach is not counted as a stale pop. After every
+    call the fields hold that call's numbers, the totals keep accumulating, and
+    hook (if given) is called with the stats object so it can sample or forward
+    them.
+    """
+
+    FIELDS = ['expanded', 'pushes', 'pops', 'stale_pops', 'max_frontier', 'lookup_time', 'search_time']
+
+    def __init__ (self, hook=None):
+        self.hook = hook
+        self.calls = 0
+        self.found = 0
+        self.algorithm = None
+        self.totals = dict.fromkeys(self.FIELDS, 0)
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def record (self, algorithm, found, started, looked_up, expanded=0, pops=0, pushes=0, max_frontier=0):
+        # started and looked_up are perf_counter() readings from before and after the box lookup
+        finished = perf_counter()
+        self.algorithm = algorithm
+        self.expanded = expanded
+        self.pushes = pushes
+        self.pops = pops
+        self.stale_pops = pops - expanded if pops > expanded else 0
+        self.max_frontier = max_frontier
+        self.lookup_time = looked_up - started
+        self.search_time = finished - looked_up
+
+        self.calls += 1
+        self.found += bool(found)
+        for field in self.FIELDS:
+            if field == 'max_frontier':
+                self.totals[field] = max(self.totals[field], max_frontier)
+            else:
+                self.totals[field] += getattr(self, field)
+        if self.hook is not None:
+            self.hook(self)
+
+    def summary (self):
+        # totals over every recorded call, plus per-call means
+        summary = {'calls': self.calls, 'found': self.found}
+        summary.update(self.totals)
+        for field in self.FIELDS:
+            if field != 'max_frontier':
+                summary['mean_' + field] = self.totals[field] / self.calls if self.calls else 0.0
+        return summary
+
 # =============================================================================
 # SEARCH ALGORITHMS (BSF) =====================================================
 # =============================================================================
 
-def breadth_first_search (source_point, destination_point, mesh, path, boxes):
-    source_box = find_containing_box(source_point, mesh['boxes'])
-    destination_box = find_containing_box(destination_point, mesh['boxes'])
+def breadth_first_search (source_point, destination_point, mesh, path, boxes, stats=None):
+    mesh = as_compiled(mesh)
+    started = perf_counter() if stats is not None else 0
+    source_box = locate_box(source_point, mesh)
+    destination_box = locate_box(destination_point, mesh)
+    looked_up = perf_counter() if stats is not None else 0
     if (source_box is None) or (destination_box is None):
-        print ("Source or destination point not in any box")
-        print ("No path found")
+        if stats is not None:
+            stats.record('breadth_first_search', False, started, looked_up)
         return
     
-    root_queue = []
-    root_queue.append(source_box)
+    rows = mesh['rows']
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    
+    root_queue = deque([source_box])
+    levels = [-1] * len(rows)       # maps box ids to their bfs depth, -1 if unvisited
+    levels[source_box] = 0
     
-    distance = 0
-    boxes = {}
-    boxes[source_box] = distance
+    pops, frontier = 0, 0
+    track = stats is not None
     
     # breadth first search
     while root_queue:
-        current_box = root_queue.pop(0)
+        if track:
+            pops += 1
+            if len(root_queue) > frontier:
+                frontier = len(root_queue)
+        current_box = root_queue.popleft()
+        boxes[rows[current_box]] = levels[current_box]
         
         if current_box == destination_box:
             break
         
-        for neighbor in mesh['adj'][current_box]:
-            if neighbor not in boxes:
-                boxes[neighbor] = boxes[current_box] + 1
+        for neighbor in neighbors[offsets[current_box]:offsets[current_box + 1]]:
+            if levels[neighbor] < 0:
+                levels[neighbor] = levels[current_box] + 1
                 root_queue.append(neighbor)
     
+    if stats is not None:
+        stats.record('breadth_first_search', levels[destination_box] >= 0, started, looked_up,
+                     pops, pops, pops + len(root_queue), frontier)
+    if levels[destination_box] < 0:
+        return
+    
     # find path from source to destination
     current_box = destination_box 
     path.append(destination_point)
     while current_box != source_box:
-        min_neighbor = boxes[current_box]
-        x1, x2, y1, y2 = current_box
-        for neighbor in mesh['adj'][current_box]:   # find neighbor with min distance.
-            if neighbor in boxes and boxes[neighbor] < min_neighbor:
-                min_neighbor = boxes[neighbor]
-                x1, x2, y1, y2 = neighbor
-        if (x1, x2, y1, y2) == current_box:
-            print ("No path found")
+        min_neighbor = levels[current_box]
+        next_box = current_box
+        for neighbor in neighbors[offsets[current_box]:offsets[current_box + 1]]:   # find neighbor with min distance.
+            if 0 <= levels[neighbor] < min_neighbor:
+                min_neighbor = levels[neighbor]
+                next_box = neighbor
+        if next_box == current_box:
             return
-        current_box = (x1, x2, y1, y2) # update current box to neighbor box.
+        current_box = next_box # update current box to neighbor box.
         # append path using last point added to path
-        append_path(path[-1], current_box, path)
-        # path.append(((x1 + x2) // 2, (y1 + y2) // 2))
+        append_path(path[-1], rows[current_box], path)
     path.append(source_point)
     
 # =============================================================================
 # SEARCH ALGORITHMS (DIJKSTRA) ================================================
 # =============================================================================
 
-def dijkstra (source_point, destination_point, mesh, path, boxes):
-    source_box = find_containing_box(source_point, mesh['boxes'])
-    destination_box = find_containing_box(destination_point, mesh['boxes'])
+def dijkstra (source_point, destination_point, mesh, path, boxes, stats=None):
+    mesh = as_compiled(mesh)
+    started = perf_counter() if stats is not None else 0
+    source_box = locate_box(source_point, mesh)
+    destination_box = locate_box(destination_point, mesh)
+    looked_up = perf_counter() if stats is not None else 0
     if (source_box is None) or (destination_box is None):
-        print ("Source or destination point not in any box")
-        print ("No path found")
+        if stats is not None:
+            stats.record('dijkstra', False, started, looked_up)
         return
     path.append (source_point)
     
-    cellPaths = {source_box: [source_point]}          # maps cells to previous points on path
-    cellPathCosts = {source_box: 0}       # maps cells to their pathcosts (found so far)
+    rows = mesh['rows']
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    portals = mesh['portal_rows']
+    box_costs = mesh['cost_view']
+    
+    cellNodes = [None] * len(rows)      # maps cell ids to (entry point, parent node)
+    cellPathCosts = [inf] * len(rows)   # maps cell ids to their pathcosts (found so far)
+    cellNodes[source_box] = (source_point, None)
+    cellPathCosts[source_box] = 0
     queue = []
     heappush(queue, (0, source_box))  # maintain a priority queue of cells
+    known, pops, frontier = len(boxes), 0, 0
+    track = stats is not None
     
     while queue:
+        if track:
+            pops += 1
+            if len(queue) > frontier:
+                frontier = len(queue)
         priority, current_box = heappop(queue)
-        if (current_box not in boxes or boxes[current_box] > priority):
-            boxes[current_box] = priority
+        box = rows[current_box]
+        if (box not in boxes or boxes[box] > priority):
+            boxes[box] = priority
         if current_box == destination_box:
-            path.extend(cellPaths[current_box])
-            print ("Destination reached")
+            path.extend(reversePath(walk_parents(cellNodes[current_box])))
             path.append(destination_point)
+            if stats is not None:
+                stats.record('dijkstra', True, started, looked_up, len(boxes) - known, pops, pops + len(queue), frontier)
             return None
         
         # investigate children
-        for neighbor in mesh['adj'][current_box]:
+        for edge in range(offsets[current_box], offsets[current_box + 1]):
+            neighbor = neighbors[edge]
             # calculate cost along this path to child
-            prev_point = cellPaths[current_box][-1] if cellPaths[current_box] else source_point
-            middle_point = find_closest_point(prev_point, neighbor)
-            cost_to_neighbor = priority + distance(prev_point, middle_point)
+            prev_point = cellNodes[current_box][0]
+            middle_point, length = cross_portal(prev_point, portals[edge])
+            cost_to_neighbor = priority + length * box_costs[current_box]
             
             # if unvisited, or if more optimal path for neighbor found (lower cost)
-            if neighbor not in cellPathCosts or cost_to_neighbor < cellPathCosts[neighbor]:
+            if cost_to_neighbor < cellPathCosts[neighbor]:
                 cellPathCosts[neighbor] = cost_to_neighbor            # update the cost
-                # add point to cellPaths
-                cellPaths[neighbor] = cellPaths[current_box] + [middle_point]
+                # link the neighbor's entry point to this cell's node
+                cellNodes[neighbor] = (middle_point, cellNodes[current_box])
                 # push neighbor to priority queue
                 heappush(queue, (cost_to_neighbor, neighbor))
                 
-    print ("No path found")
+    if stats is not None:
+        stats.record('dijkstra', False, started, looked_up, len(boxes) - known, pops, pops, frontier)
     return False
 
 # =============================================================================
@@ -146,48 +343,86 @@ def dijkstra (source_point, destination_point, mesh, path, boxes):
 def heuristic (point1, point2):
     return distance (point1, point2)
 
-def aStar (source_point, destination_point, mesh, path, boxes):
-    source_box = find_containing_box(source_point, mesh['boxes'])
-    destination_box = find_containing_box(destination_point, mesh['boxes'])
+# ALT: nm_landmarks stores each landmark L's distance d(L, e) to the border of every
+# adjacency e, and the range [low, high] of d(L, .) over the borders of each box. The
+# goal box is entered across one of its borders, so by the triangle inequality a point
+# on border e is at least max(low - d(L, e), d(L, e) - high) away from it. The bounds
+# only depend on the goal, so each search computes them for all edges up front
+def landmark_bounds (landmarks, goal_box):
+    distances = landmarks['distances']
+    if not len(distances):
+        return [0.0] * distances.shape[1]
+    with numpy.errstate(invalid='ignore'):
+        bounds = numpy.maximum(landmarks['low'][:, goal_box, None] - distances,
+                               distances - landmarks['high'][:, goal_box, None])
+    bounds[~numpy.isfinite(bounds)] = 0     # landmark cannot reach the edge or the goal
+    return numpy.maximum(bounds.max(axis=0), 0).tolist()
+
+def aStar (source_point, destination_point, mesh, path, boxes, landmarks=None, stats=None):
+    mesh = as_compiled(mesh)
+    started = perf_counter() if stats is not None else 0
+    source_box = locate_box(source_point, mesh)
+    destination_box = locate_box(destination_point, mesh)
+    looked_up = perf_counter() if stats is not None else 0
     if (source_box is None) or (destination_box is None):
-        print ("Source or destination point not in any box")
-        print ("No path found")
+        if stats is not None:
+            stats.record('aStar', False, started, looked_up)
         return
     path.append (source_point)
     
-    cellPaths = {source_box: [source_point]}          # maps cells to previous points on path
-    cellPathCosts = {source_box: 0}       # maps cells to their pathcosts (found so far)
+    rows = mesh['rows']
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    portals = mesh['portal_rows']
+    box_costs, cost_floor = mesh['cost_view'], mesh['cost_floor']
+    bounds = landmark_bounds(landmarks, destination_box) if landmarks is not None else None
+    
+    cellNodes = [None] * len(rows)      # maps cell ids to (entry point, parent node)
+    cellPathCosts = [inf] * len(rows)   # maps cell ids to their pathcosts (found so far)
+    cellNodes[source_box] = (source_point, None)
+    cellPathCosts[source_box] = 0
     queue = []
     heappush(queue, (0, source_box))  # maintain a priority queue of cells
+    known, pops, frontier = len(boxes), 0, 0
+    track = stats is not None
     
     while queue:
+        if track:
+            pops += 1
+            if len(queue) > frontier:
+                frontier = len(queue)
         priority, current_box = heappop(queue)
-        if (current_box not in boxes or boxes[current_box] > priority):
-            boxes[current_box] = priority
+        box = rows[current_box]
+        if (box not in boxes or boxes[box] > priority):
+            boxes[box] = priority
         if current_box == destination_box:
-            path.extend(cellPaths[current_box])
-            print ("Destination reached")
+            path.extend(reversePath(walk_parents(cellNodes[current_box])))
             path.append(destination_point)
+            if stats is not None:
+                stats.record('aStar', True, started, looked_up, len(boxes) - known, pops, pops + len(queue), frontier)
             return None
         
         # investigate children
-        for neighbor in mesh['adj'][current_box]:
+        for edge in range(offsets[current_box], offsets[current_box + 1]):
+            neighbor = neighbors[edge]
             # calculate cost along this path to child
-            prev_point = cellPaths[current_box][-1] if cellPaths[current_box] else source_point
-            middle_point = find_closest_point(prev_point, neighbor)
-            cost_to_neighbor = cellPathCosts[current_box] + distance(prev_point, middle_point)
+            prev_point = cellNodes[current_box][0]
+            middle_point, length = cross_portal(prev_point, portals[edge])
+            cost_to_neighbor = cellPathCosts[current_box] + length * box_costs[current_box]
             
-            estimated_cost = cost_to_neighbor + heuristic(middle_point, destination_point)
+            estimated_cost = cost_to_neighbor + cost_floor * heuristic(middle_point, destination_point)
+            if landmarks is not None:
+                estimated_cost = max(estimated_cost, cost_to_neighbor + bounds[edge])
             
             # if unvisited, or if more optimal path for neighbor found (lower cost)
-            if neighbor not in cellPathCosts or cost_to_neighbor < cellPathCosts[neighbor]:
+            if cost_to_neighbor < cellPathCosts[neighbor]:
                 cellPathCosts[neighbor] = cost_to_neighbor          # update the cost
-                # add point to cellPaths
-                cellPaths[neighbor] = cellPaths[current_box] + [middle_point]
+                # link the neighbor's entry point to this cell's node
+                cellNodes[neighbor] = (middle_point, cellNodes[current_box])
                 # push neighbor to priority queue
                 heappush(queue, (estimated_cost, neighbor))
                 
-    print ("No path found")
+    if stats is not None:
+        stats.record('aStar', False, started, looked_up, len(boxes) - known, pops, pops, frontier)
     return False
 
 
@@ -195,83 +430,833 @@ def aStar (source_point, destination_point, mesh, path, boxes):
 # SEARCH ALGORITHMS (BIDIRECTIONAL) ===========================================
 # =============================================================================
 
-def reversePath (path):
-    reversed_path = []
-    for i in range(len(path) - 1, -1, -1):
-        reversed_path.append(path[i])
-    return reversed_path
-
-def bidirectional (source_point, destination_point, mesh, path, boxes):
-    source_box = find_containing_box(source_point, mesh['boxes'])
-    destination_box = find_containing_box(destination_point, mesh['boxes'])
+def bidirectional (source_point, destination_point, mesh, path, boxes, landmarks=None, stats=None):
+    mesh = as_compiled(mesh)
+    started = perf_counter() if stats is not None else 0
+    source_box = locate_box(source_point, mesh)
+    destination_box = locate_box(destination_point, mesh)
+    looked_up = perf_counter() if stats is not None else 0
     if (source_box is None) or (destination_box is None):
-        print ("Source or destination point not in any box")
-        print ("No path found")
+        if stats is not None:
+            stats.record('bidirectional', False, started, looked_up)
         return
     # path.append (source_point)
     
-    forwardPaths = {source_box: [source_point]}          # maps cells to previous points on path
-    forwardCosts = {source_box: 0}        # maps cells to their pathcosts (found so far)
-    backwardPaths = {destination_box: [destination_point]}          # maps cells to previous points on path
-    backwardCosts = {destination_box: 0}        # maps cells to their pathcosts (found so far)
+    rows = mesh['rows']
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    portals = mesh['portal_rows']
+    box_costs, cost_floor = mesh['cost_view'], mesh['cost_floor']
+    if landmarks is not None:
+        forwardBounds = landmark_bounds(landmarks, destination_box)
+        backwardBounds = landmark_bounds(landmarks, source_box)
+    
+    forwardNodes = [None] * len(rows)       # maps cell ids to (entry point, parent node)
+    forwardCosts = [inf] * len(rows)        # maps cell ids to their pathcosts (found so far)
+    backwardNodes = [None] * len(rows)      # maps cell ids to (entry point, parent node)
+    backwardCosts = [inf] * len(rows)       # maps cell ids to their pathcosts (found so far)
+    forwardNodes[source_box] = (source_point, None)
+    forwardCosts[source_box] = 0
+    backwardNodes[destination_box] = (destination_point, None)
+    backwardCosts[destination_box] = 0
     queue = []
     heappush(queue, (0, source_box, 'forward'))  # maintain a priority queue of cells
     heappush(queue, (0, destination_box, 'backward'))  # maintain a priority queue of cells
+    pops, frontier = 0, 0
+    track = stats is not None
+    expanded = set()                    # (box, side) pairs, so a box both searches expand is not a stale pop
     
     while queue:
+        if track:
+            pops += 1
+            if len(queue) > frontier:
+                frontier = len(queue)
         priority, current_box, direction = heappop(queue)
+        if track:
+            expanded.add((current_box, direction))
 
-        currentPaths = {}
-        currentCosts = {}
-        otherPaths = {}
-        
         if direction == 'forward':
-            currentPaths = forwardPaths
+            currentNodes = forwardNodes
             currentCosts = forwardCosts
-            otherPaths = backwardPaths
-            currentSource = source_point
+            otherNodes = backwardNodes
             currentDestination = destination_point
+            currentBounds = forwardBounds if landmarks is not None else None
         else: 
-            currentPaths = backwardPaths
+            currentNodes = backwardNodes
             currentCosts = backwardCosts
-            otherPaths = forwardPaths
-            currentSource = destination_point
+            otherNodes = forwardNodes
             currentDestination = source_point
+            currentBounds = backwardBounds if landmarks is not None else None
 
         # if unvisited, add it to the visited boxes for the parent function to draw visited boxes
-        if (current_box not in boxes or boxes[current_box] > priority):
-            boxes[current_box] = priority
+        box = rows[current_box]
+        if (box not in boxes or boxes[box] > priority):
+            boxes[box] = priority
             
         # check if both paths have visited curr box
-        if current_box in otherPaths: 
+        if otherNodes[current_box] is not None: 
             # found a path
-            path.extend(currentPaths[current_box])
-            path.extend(reversePath(otherPaths[current_box]))
-            print ("Destination reached")
+            path.extend(reversePath(walk_parents(currentNodes[current_box])))
+            path.extend(walk_parents(otherNodes[current_box]))
+            if stats is not None:
+                stats.record('bidirectional', True, started, looked_up, len(expanded), pops, pops + len(queue), frontier)
             return None
 
         # investigate children
-        for neighbor in mesh['adj'][current_box]:
+        for edge in range(offsets[current_box], offsets[current_box + 1]):
+            neighbor = neighbors[edge]
             # calculate cost along this path to child
-            prev_point = currentPaths[current_box][-1] if currentPaths[current_box] else currentSource
-            middle_point = find_closest_point(prev_point, neighbor)
+            prev_point = currentNodes[current_box][0]
+            middle_point, length = cross_portal(prev_point, portals[edge])
             
-            cost_to_neighbor = currentCosts[current_box] + distance(prev_point, middle_point)
+            cost_to_neighbor = currentCosts[current_box] + length * box_costs[current_box]
             
-            estimated_cost = cost_to_neighbor + heuristic(middle_point, currentDestination)
+            estimated_cost = cost_to_neighbor + cost_floor * heuristic(middle_point, currentDestination)
+            if landmarks is not None:
+                estimated_cost = max(estimated_cost, cost_to_neighbor + currentBounds[edge])
             
             # if unvisited, or if more optimal path for neighbor found (lower cost)
-            if neighbor not in currentCosts or cost_to_neighbor < currentCosts[neighbor]:
+            if cost_to_neighbor < currentCosts[neighbor]:
                 currentCosts[neighbor] = cost_to_neighbor          # update the cost
-                # add point to cellPaths
-                currentPaths[neighbor] = currentPaths[current_box] + [middle_point]
+                # link the neighbor's entry point to this cell's node
+                currentNodes[neighbor] = (middle_point, currentNodes[current_box])
                 # push neighbor to priority queue
                 heappush(queue, (estimated_cost, neighbor, direction))
-    print ("No path found")
+    if stats is not None:
+        stats.record('bidirectional', False, started, looked_up, len(expanded), pops, pops, frontier)
     return False
                 
+# =============================================================================
+# SEARCH ALGORITHMS (WEIGHTED / ANYTIME) ======================================
+# =============================================================================
+
+def weighted_aStar (source_point, destination_point, mesh, path, boxes, epsilon=0.5, stats=None):
+    # A* with the heuristic inflated by 1 + epsilon: far fewer expansions, and the
+    # path costs at most (1 + epsilon) times the aStar one
+    return get_search(mesh, 'aStar', 1 + epsilon).search(source_point, destination_point, path, boxes, stats)
+
+def anytime_aStar (source_point, destination_point, mesh, path, boxes, epsilon=2.0, step=0.5,
+                   max_expansions=None, max_time=None, on_path=None, stats=None):
+
+    """
+    ARA*: a quick weighted A* path, then better ones until the budget runs out
+
+    Each round searches with weight w (starting at 1 + epsilon) and the next one
+    lowers w by step, reusing the costs found so far: only the boxes whose cost
+    improved after they were expanded (the INCONS list) and the open list are
+    carried over, so later rounds are much cheaper than starting again.
+
+    Args:
+        epsilon: initial suboptimality, the first path costs at most (1 + epsilon) x optimal
+        step: how much the weight drops after each round, until it reaches 1
+        max_expansions: stop after this many expansions over all rounds
+        max_time: stop after this many seconds
+        on_path: optional callable(path, weight) given every improved path
+
+    Returns:
+
+        None once a path was found (path holds the best one and boxes every
+        expanded box), False if none was found within the budget
+    """
+
+    mesh = as_compiled(mesh)
+    started = perf_counter()
+    source_box = locate_box(source_point, mesh)
+    destination_box = locate_box(destination_point, mesh)
+    looked_up = perf_counter()
+    if (source_box is None) or (destination_box is None):
+        if stats is not None:
+            stats.record('anytime_aStar', False, started, looked_up)
+        return
+    deadline = looked_up + max_time if max_time is not None else inf
+    max_expansions = max_expansions if max_expansions is not None else inf
+
+    rows = mesh['rows']
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    portals = mesh['portal_rows']
+    box_costs, cost_floor = mesh['cost_view'], mesh['cost_floor']
+    costs = {source_box: 0}
+    nodes = {source_box: (source_point, None)}
+    estimates = {source_box: cost_floor * heuristic(source_point, destination_point)}
+    keys = {}                               # box -> its key in the open list
+    queue = []
+    weight = 1 + epsilon
+    best = None
+    known, pops, pushes, frontier = len(boxes), 0, 0, 0
+    track = stats is not None
+
+    def push (box_id):
+        nonlocal pushes
+        key = costs[box_id] + weight * estimates[box_id]
+        keys[box_id] = key
+        heappush(queue, (key, box_id))
+        pushes += 1
+
+    def goal_key ():
+        return costs[destination_box] + weight * estimates[destination_box] if destination_box in costs else inf
+
+    push(source_box)
+    while True:
+        closed = set()
+        inconsistent = set()
+        # improve the path with the current weight
+        while queue and queue[0][0] < goal_key() and pops < max_expansions:
+            if track and len(queue) > frontier:
+                frontier = len(queue)
+            priority, current_box = heappop(queue)
+            if keys.get(current_box) != priority:
+                continue # stale entry
+            del keys[current_box]
+            closed.add(current_box)
+            pops += 1
+            if (pops & 63) == 0 and perf_counter() > deadline:
+                break
+
+            box = rows[current_box]
+            if (box not in boxes or boxes[box] > priority):
+                boxes[box] = priority
+
+            current_node = nodes[current_box]
+            prev_point = current_node[0]
+            for edge in range(offsets[current_box], offsets[current_box + 1]):
+                neighbor = neighbors[edge]
+                middle_point, length = cross_portal(prev_point, portals[edge])
+                cost_to_neighbor = costs[current_box] + length * box_costs[current_box]
+                if cost_to_neighbor < costs.get(neighbor, inf):
+                    costs[neighbor] = cost_to_neighbor
+                    nodes[neighbor] = (middle_point, current_node)
+                    estimates[neighbor] = cost_floor * heuristic(middle_point, destination_point)
+                    if neighbor in closed:
+                        inconsistent.add(neighbor)
+                    else:
+                        push(neighbor)
+
+        if destination_box in costs:
+            # the last leg to destination_point is part of the path's length too
+            length = costs[destination_box] + distance(nodes[destination_box][0], destination_point) * box_costs[destination_box]
+            if best is None or length < best[0]:
+                best = (length, nodes[destination_box])
+                if on_path is not None:
+                    on_path([source_point] + reversePath(walk_parents(best[1])) + [destination_point], weight)
+
+        if weight <= 1 or pops >= max_expansions or perf_counter() > deadline:
+            break
+
+        # next round: lower the weight and re-key the open list plus INCONS
+        weight = max(1, weight - step)
+        carried = [box_id for box_id in keys] + [box_id for box_id in inconsistent if box_id not in keys]
+        keys.clear()
+        queue.clear()
+        for box_id in carried:
+            push(box_id)
+
+    if best is None:
+        if stats is not None:
+            stats.record('anytime_aStar', False, started, looked_up, len(boxes) - known, pops, pushes, frontier)
+        return False
+
+    path.append(source_point)
+    path.extend(reversePath(walk_parents(best[1])))
+    path.append(destination_point)
+    if stats is not None:
+        stats.record('anytime_aStar', True, started, looked_up, len(boxes) - known, pops, pushes, frontier)
+    return None
+
+# =============================================================================
+# RESUMABLE SEARCHES ==========================================================
+# =============================================================================
+
+RUNNING, FOUND, FAILED = 'running', 'found', 'failed'
+
+class ResumableSearch:
+
+    """
+    aStar split into slices: step() expands a bounded number of boxes and returns
+
+    The open list and costs live on the object between calls, so a game loop
+    can spend a fixed budget per frame on a long query. Run to completion it
+    finds the same path and explored boxes as aStar.
+
+    Args:
+        source_point, destination_point, mesh: as for aStar
+        weight: heuristic multiplier, as in PathSearch
+        landmarks: optional nm_landmarks table
+    """
+
+    def __init__ (self, source_point, destination_point, mesh, weight=1.0, landmarks=None):
+        self.mesh = as_compiled(mesh)
+        self.source_point = source_point
+        self.destination_point = destination_point
+        self.weight = weight
+        self.landmarks = landmarks
+        self.bounds = None
+        self.path = []
+        self.boxes = {}
+        self.expansions = 0
+        self.costs = {}
+        self.nodes = {}
+        self.queue = []
+
+        self.source_box = locate_box(source_point, self.mesh)
+        self.destination_box = locate_box(destination_point, self.mesh)
+        if (self.source_box is None) or (self.destination_box is None):
+            self.status = FAILED
+            return
+        self.status = RUNNING
+        if landmarks is not None:
+            self.bounds = landmark_bounds(landmarks, self.destination_box)
+        self.costs[self.source_box] = 0
+        self.nodes[self.source_box] = (source_point, None)
+        heappush(self.queue, (0, self.source_box))
+
+    def step (self, max_expansions=None, max_microseconds=None):
+        # expands until found, failed, or either budget is spent; returns the status
+        if self.status != RUNNING:
+            return self.status
+        deadline = perf_counter() + max_microseconds / 1e6 if max_microseconds is not None else inf
+        limit = self.expansions + max_expansions if max_expansions is not None else inf
+
+        rows = self.mesh['rows']
+        offsets, neighbors = self.mesh['adj_offsets'], self.mesh['adj_neighbors']
+        portals = self.mesh['portal_rows']
+        box_costs, cost_floor = self.mesh['cost_view'], self.mesh['cost_floor']
+        costs, nodes, queue, boxes = self.costs, self.nodes, self.queue, self.boxes
+        destination_point, destination_box = self.destination_point, self.destination_box
+        bounds, weight = self.bounds, self.weight
+
+        while queue:
+            if self.expansions >= limit or ((self.expansions & 7) == 0 and perf_counter() > deadline):
+                return RUNNING
+            priority, current_box = heappop(queue)
+            self.expansions += 1
+            box = rows[current_box]
+            if (box not in boxes or boxes[box] > priority):
+                boxes[box] = priority
+            if current_box == destination_box:
+                self.path.append(self.source_point)
+                self.path.extend(reversePath(walk_parents(nodes[current_box])))
+                self.path.append(destination_point)
+                self.status = FOUND
+                return FOUND
+
+            current_node = nodes[current_box]
+            prev_point = current_node[0]
+            for edge in range(offsets[current_box], offsets[current_box + 1]):
+                neighbor = neighbors[edge]
+                middle_point, length = cross_portal(prev_point, portals[edge])
+                cost_to_neighbor = costs[current_box] + length * box_costs[current_box]
+                if cost_to_neighbor < costs.get(neighbor, inf):
+                    costs[neighbor] = cost_to_neighbor
+                    nodes[neighbor] = (middle_point, current_node)
+                    estimate = cost_floor * heuristic(middle_point, destination_point)
+                    if bounds is not None:
+                        estimate = max(estimate, bounds[edge])
+                    heappush(queue, (cost_to_neighbor + weight * estimate, neighbor))
+
+        self.status = FAILED
+        return FAILED
+
+class SearchScheduler:
+
+    """
+    Round-robin over many ResumableSearches under a per-frame budget
+
+    Each call to run() hands out slices of slice_expansions to the pending
+    searches in turn until the frame's expansion or time budget is used, so
+    no single long query starves the others. Submitting again for the same
+    key replaces that key's pending search.
+    """
+
+    def __init__ (self, mesh, slice_expansions=32):
+        self.mesh = as_compiled(mesh)
+        self.slice_expansions = slice_expansions
+        self.pending = deque()      # (key, search), in serving order
+        self.current = {}           # key -> its latest search
+
+    def __len__ (self):
+        return len(self.current)
+
+    def submit (self, key, source_point, destination_point, **options):
+        search = ResumableSearch(source_point, destination_point, self.mesh, **options)
+        self.current[key] = search
+        self.pending.append((key, search))
+        return search
+
+    def cancel (self, key):
+        # the deque entry is skipped once it comes around
+        self.current.pop(key, None)
+
+    def run (self, max_expansions=None, max_microseconds=None):
+        # serves searches until the budget is spent; returns the (key, search) pairs that finished
+        deadline = perf_counter() + max_microseconds / 1e6 if max_microseconds is not None else inf
+        budget = max_expansions if max_expansions is not None else inf
+        finished = []
+        while self.pending and budget > 0:
+            key, search = self.pending.popleft()
+            if self.current.get(key) is not search:
+                continue # replaced or cancelled
+            remaining = deadline - perf_counter()
+            if remaining <= 0:
+                self.pending.appendleft((key, search))
+                break
+
+            before = search.expansions
+            status = search.step(min(self.slice_expansions, budget),
+                                 remaining * 1e6 if deadline != inf else None)
+            budget -= search.expansions - before
+            if status == RUNNING:
+                self.pending.append((key, search))
+            else:
+                del self.current[key]
+                finished.append((key, search))
+        return finished
+
+# =============================================================================
+# TABLE LOOKUP (NEXT HOP) =====================================================
+# =============================================================================
+
+def next_hop (source_point, destination_point, mesh, path, boxes, stats=None):
+    # walks the all-pairs table built by nm_nexthop instead of searching
+    mesh = as_compiled(mesh)
+    started = perf_counter() if stats is not None else 0
+    source_box = locate_box(source_point, mesh)
+    destination_box = locate_box(destination_point, mesh)
+    looked_up = perf_counter() if stats is not None else 0
+    if (source_box is None) or (destination_box is None):
+        if stats is not None:
+            stats.record('next_hop', False, started, looked_up)
+        return
+    
+    table = mesh['next_hop']
+    rows = mesh['rows']
+    corridor = [source_box]
+    current_box = source_box
+    while current_box != destination_box:
+        current_box = int(table[current_box, destination_box])
+        if current_box >= len(rows): # unreachable marker
+            if stats is not None:
+                stats.record('next_hop', False, started, looked_up, len(corridor))
+            return False
+        corridor.append(current_box)
+        
+    for box_id in corridor:
+        boxes[rows[box_id]] = 0
+    path.extend(clamp_corridor(source_point, destination_point, corridor, rows))
+    if stats is not None:
+        stats.record('next_hop', True, started, looked_up, len(corridor))
+    return None
+    
+# =============================================================================
+# PATH SMOOTHING (FUNNEL) =====================================================
+# =============================================================================
+
+def portal (border, box1):
+    # a border from mesh['portals'] as (left, right) seen walking out of box1
+    # across it. Boxes meeting at a corner share a single point
+    ix1, ix2, iy1, iy2 = border
+    if ix1 == ix2:
+        p, q = (ix1, iy1), (ix1, iy2)
+        forward = box1[1] == ix1  # box1 ends at the border: moving towards +x
+        return (q, p) if forward else (p, q)
+    if iy1 == iy2:
+        p, q = (ix1, iy1), (ix2, iy1)
+        forward = box1[3] == iy1  # moving towards +y
+        return (p, q) if forward else (q, p)
+    # overlapping boxes (left over by the mesh builder): the overlap's center
+    center = ((ix1 + ix2) / 2, (iy1 + iy2) / 2)
+    return center, center
+
+def triarea2 (a, b, c):
+    return (c[0] - a[0]) * (b[1] - a[1]) - (b[0] - a[0]) * (c[1] - a[1])
+
+def on_segment (point, a, b):
+    return (min(a[0], b[0]) <= point[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= point[1] <= max(a[1], b[1])
+            and triarea2(a, b, point) == 0)
+
+def corridor_portals (corridor, mesh):
+    # the stored border between each pair of consecutive boxes in a corridor of box ids
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    portals, rows = mesh['portal_rows'], mesh['rows']
+    for a, b in zip(corridor, corridor[1:]):
+        for edge in range(offsets[a], offsets[a + 1]):
+            if neighbors[edge] == b:
+                break
+        else:
+            raise ValueError("corridor boxes %d and %d are not adjacent" % (a, b))
+        yield portal(portals[edge], rows[a])
+
+def string_pull (source_point, destination_point, corridor, mesh):
+
+    """
+    Shortest path through a corridor of boxes, by the funnel algorithm
+
+    Args:
+        source_point: inside corridor[0]
+        destination_point: inside corridor[-1]
+        corridor: box ids, each adjacent to the next
+        mesh: the compiled mesh the ids belong to, whose precomputed portals are reused
+
+    Returns:
+
+        The taut path: source_point, the portal corners it bends around, and
+        destination_point. Each portal is visited a constant number of times
+        except when the funnel restarts from a new corner
+    """
+
+    portals = [(source_point, source_point)]
+    portals.extend(corridor_portals(corridor, mesh))
+    portals.append((destination_point, destination_point))
+
+    path = [source_point]
+    apex, left, right = source_point, source_point, source_point
+    apex_index = left_index = right_index = 0
+    i = 1
+    while i < len(portals):
+        new_left, new_right = portals[i]
+
+        # a portal through the apex (e.g. a source point on a box border) constrains nothing
+        if on_segment(apex, new_left, new_right):
+            i += 1
+            continue
+
+        # try to narrow the funnel from the right
+        if triarea2(apex, right, new_right) <= 0:
+            if apex == right or triarea2(apex, left, new_right) > 0:
+                right, right_index = new_right, i
+            else:
+                # the right side crossed the left one: left becomes a corner
+                path.append(left)
+                apex, apex_index = left, left_index
+                right, right_index = apex, apex_index
+                i = apex_index + 1
+                continue
+
+        # and from the left
+        if triarea2(apex, left, new_left) >= 0:
+            if apex == left or triarea2(apex, right, new_left) < 0:
+                left, left_index = new_left, i
+            else:
+                path.append(right)
+                apex, apex_index = right, right_index
+                left, left_index = apex, apex_index
+                i = apex_index + 1
+                continue
+        i += 1
+
+    if path[-1] != destination_point:
+        path.append(destination_point)
+    return path
+
+# =============================================================================
+# REUSABLE SEARCHES ===========================================================
+# =============================================================================
+
+ALGORITHMS = ['breadth_first_search', 'dijkstra', 'aStar', 'bidirectional']
+TIE_BREAKS = ['id', 'deep', 'shallow']
+
+class PathSearch:
+
+    """
+    One algorithm bound to one compiled mesh, reusable across queries
+
+    The per-box cost, node and level lists and the heap are allocated once;
+    each query only resets the boxes the previous one touched, instead of
+    building fresh lists of len(mesh) like the search functions above. With
+    the default options the paths and explored boxes match those functions.
+
+    Args:
+        mesh: compiled or legacy mesh
+        algorithm: one of ALGORITHMS
+        weight: multiplies the heuristic of aStar and bidirectional, 1 keeps it admissible
+        tie_break: order of heap entries with equal priority: 'id' (lower box id first,
+            like the functions above), 'deep' (higher cost so far first) or 'shallow'
+        landmarks: optional nm_landmarks table for aStar and bidirectional
+    """
+
+    def __init__ (self, mesh, algorithm='bidirectional', weight=1.0, tie_break='id', landmarks=None):
+        self.mesh = as_compiled(mesh)
+        self.configure(algorithm, weight, tie_break, landmarks)
+
+        self.costs = []                     # forward search (and dijkstra / aStar)
+        self.nodes = []
+        self.back_costs = []                # backward half of bidirectional
+        self.back_nodes = []
+        self.levels = []                    # breadth first search depths
+        self.resize()
+        self.touched = []
+        self.queue = []
+        self.fifo = deque()
+        self.corridor = []                  # box ids of the last path found, source to destination
+
+    def configure (self, algorithm='bidirectional', weight=1.0, tie_break='id', landmarks=None):
+        # sets the options of the following searches, the buffers stay as they are
+        if algorithm not in ALGORITHMS:
+            raise ValueError("unknown algorithm %r, expected one of %s" % (algorithm, ALGORITHMS))
+        if tie_break not in TIE_BREAKS:
+            raise ValueError("unknown tie break %r, expected one of %s" % (tie_break, TIE_BREAKS))
+        self.algorithm = algorithm
+        self.weight = weight
+        self.tie_break = tie_break
+        self.landmarks = landmarks
+        self.run = getattr(self, 'run_' + algorithm)
+
+    def resize (self):
+        # nm_meshcompiler.patch_compiled appends the ids of added boxes, so the
+        # buffers grow to match; ids already in them keep their meaning
+        extra = len(self.mesh['rows']) - len(self.costs)
+        if extra > 0:
+            self.costs.extend([inf] * extra)
+            self.nodes.extend([None] * extra)
+            self.back_costs.extend([inf] * extra)
+            self.back_nodes.extend([None] * extra)
+            self.levels.extend([-1] * extra)
+
+    def reset (self):
+        costs, nodes, back_costs, back_nodes, levels = self.costs, self.nodes, self.back_costs, self.back_nodes, self.levels
+        for box_id in self.touched:
+            costs[box_id] = inf
+            nodes[box_id] = None
+            back_costs[box_id] = inf
+            back_nodes[box_id] = None
+            levels[box_id] = -1
+        self.touched.clear()
+        self.queue.clear()
+        self.fifo.clear()
+
+    def tie (self, cost):
+        if self.tie_break == 'deep':
+            return -cost
+        if self.tie_break == 'shallow':
+            return cost
+        return 0
+
+    def search (self, source_point, destination_point, path, boxes, stats=None):
+        # same contract as the search functions: fills path and boxes, None when found
+        started = perf_counter() if stats is not None else 0
+        source_box = locate_box(source_point, self.mesh)
+        destination_box = locate_box(destination_point, self.mesh)
+        looked_up = perf_counter() if stats is not None else 0
+        self.corridor = []
+        if (source_box is None) or (destination_box is None):
+            if stats is not None:
+                stats.record(self.algorithm, False, started, looked_up)
+            return
+        self.reset()
+        self.resize()
+        return self.run(source_point, destination_point, source_box, destination_box, path, boxes,
+                        stats, started, looked_up)
+
+    def run_breadth_first_search (self, source_point, destination_point, source_box, destination_box,
+                                  path, boxes, stats, started, looked_up):
+        rows = self.mesh['rows']
+        offsets, neighbors = self.mesh['adj_offsets'], self.mesh['adj_neighbors']
+        levels, touched, fifo = self.levels, self.touched, self.fifo
+
+        fifo.append(source_box)
+        levels[source_box] = 0
+        touched.append(source_box)
+        pops, frontier = 0, 0
+        track = stats is not None
+        while fifo:
+            if track:
+                pops += 1
+                if len(fifo) > frontier:
+                    frontier = len(fifo)
+            current_box = fifo.popleft()
+            boxes[rows[current_box]] = levels[current_box]
+            if current_box == destination_box:
+                break
+            for neighbor in neighbors[offsets[current_box]:offsets[current_box + 1]]:
+                if levels[neighbor] < 0:
+                    levels[neighbor] = levels[current_box] + 1
+                    touched.append(neighbor)
+                    fifo.append(neighbor)
+
+        if stats is not None:
+            stats.record(self.algorithm, levels[destination_box] >= 0, started, looked_up,
+                         pops, pops, pops + len(fifo), frontier)
+        if levels[destination_box] < 0:
+            return
+
+        # walk back down the levels from the destination
+        current_box = destination_box
+        corridor = [current_box]
+        path.append(destination_point)
+        while current_box != source_box:
+            next_box = current_box
+            for neighbor in neighbors[offsets[current_box]:offsets[current_box + 1]]:
+                if 0 <= levels[neighbor] < levels[next_box]:
+                    next_box = neighbor
+            if next_box == current_box:
+                return
+            current_box = next_box
+            corridor.append(current_box)
+            append_path(path[-1], rows[current_box], path)
+        path.append(source_point)
+        corridor.reverse()
+        self.corridor = corridor
+
+    def run_dijkstra (self, *args):
+        return self.best_first(*args, heuristic_weight=0)
+
+    def run_aStar (self, *args):
+        return self.best_first(*args, heuristic_weight=self.weight)
+
+    def best_first (self, source_point, destination_point, source_box, destination_box,
+                    path, boxes, stats, started, looked_up, heuristic_weight):
+        # dijkstra when heuristic_weight is 0, (weighted) A* otherwise
+        rows = self.mesh['rows']
+        offsets, neighbors = self.mesh['adj_offsets'], self.mesh['adj_neighbors']
+        portals = self.mesh['portal_rows']
+        box_costs, cost_floor = self.mesh['cost_view'], self.mesh['cost_floor']
+        costs, nodes, touched, queue = self.costs, self.nodes, self.touched, self.queue
+        bounds = None
+        if self.landmarks is not None and heuristic_weight:
+            bounds = landmark_bounds(self.landmarks, destination_box)
+        tie_break = self.tie_break != 'id'
+        path.append(source_point)
+
+        costs[source_box] = 0
+        nodes[source_box] = (source_point, None, source_box)
+        touched.append(source_box)
+        heappush(queue, (0, 0, source_box))
+        known, pops, frontier = len(boxes), 0, 0
+        track = stats is not None
+
+        while queue:
+            if track:
+                pops += 1
+                if len(queue) > frontier:
+                    frontier = len(queue)
+            priority, _, current_box = heappop(queue)
+            box = rows[current_box]
+            if (box not in boxes or boxes[box] > priority):
+                boxes[box] = priority
+            if current_box == destination_box:
+                path.extend(reversePath(walk_parents(nodes[current_box])))
+                path.append(destination_point)
+                self.corridor = walk_boxes(nodes[current_box])
+                self.corridor.reverse()
+                if stats is not None:
+                    stats.record(self.algorithm, True, started, looked_up, len(boxes) - known, pops, pops + len(queue), frontier)
+                return None
+
+            # dijkstra grows from the popped priority, like the dijkstra function
+            current_node = nodes[current_box]
+            prev_point = current_node[0]
+            current_cost = costs[current_box] if heuristic_weight else priority
+            for edge in range(offsets[current_box], offsets[current_box + 1]):
+                neighbor = neighbors[edge]
+                middle_point, length = cross_portal(prev_point, portals[edge])
+                cost_to_neighbor = current_cost + length * box_costs[current_box]
+                if cost_to_neighbor < costs[neighbor]:
+                    if costs[neighbor] == inf:
+                        touched.append(neighbor)
+                    costs[neighbor] = cost_to_neighbor
+                    nodes[neighbor] = (middle_point, current_node, neighbor)
+                    estimated_cost = cost_to_neighbor
+                    if heuristic_weight:
+                        estimate = cost_floor * heuristic(middle_point, destination_point)
+                        if bounds is not None:
+                            estimate = max(estimate, bounds[edge])
+                        estimated_cost = cost_to_neighbor + heuristic_weight * estimate
+                    heappush(queue, (estimated_cost, self.tie(cost_to_neighbor) if tie_break else 0, neighbor))
+
+        if stats is not None:
+            stats.record(self.algorithm, False, started, looked_up, len(boxes) - known, pops, pops, frontier)
+        return False
+
+    def run_bidirectional (self, source_point, destination_point, source_box, destination_box,
+                           path, boxes, stats, started, looked_up):
+        rows = self.mesh['rows']
+        offsets, neighbors = self.mesh['adj_offsets'], self.mesh['adj_neighbors']
+        portals = self.mesh['portal_rows']
+        box_costs, cost_floor = self.mesh['cost_view'], self.mesh['cost_floor']
+        touched, queue = self.touched, self.queue
+        forward_bounds = backward_bounds = None
+        if self.landmarks is not None:
+            forward_bounds = landmark_bounds(self.landmarks, destination_box)
+            backward_bounds = landmark_bounds(self.landmarks, source_box)
+        weight, tie_break = self.weight, self.tie_break != 'id'
+        sides = {'forward': (self.costs, self.nodes, self.back_nodes, destination_point, forward_bounds),
+                 'backward': (self.back_costs, self.back_nodes, self.nodes, source_point, backward_bounds)}
+
+        self.costs[source_box] = 0
+        self.nodes[source_box] = (source_point, None, source_box)
+        self.back_costs[destination_box] = 0
+        self.back_nodes[destination_box] = (destination_point, None, destination_box)
+        touched.append(source_box)
+        touched.append(destination_box)
+        heappush(queue, (0, 0, source_box, 'forward'))
+        heappush(queue, (0, 0, destination_box, 'backward'))
+        pops, frontier = 0, 0
+        track = stats is not None
+        expanded = set()                # (box, side) pairs, so a box both searches expand is not a stale pop
+
+        while queue:
+            if track:
+                pops += 1
+                if len(queue) > frontier:
+                    frontier = len(queue)
+            priority, _, current_box, direction = heappop(queue)
+            if track:
+                expanded.add((current_box, direction))
+            costs, nodes, other_nodes, goal_point, bounds = sides[direction]
+
+            box = rows[current_box]
+            if (box not in boxes or boxes[box] > priority):
+                boxes[box] = priority
+
+            # both searches have reached this box
+            if other_nodes[current_box] is not None:
+                path.extend(reversePath(walk_parents(nodes[current_box])))
+                path.extend(walk_parents(other_nodes[current_box]))
+                corridor = walk_boxes(self.nodes[current_box])
+                corridor.reverse()
+                corridor.extend(walk_boxes(self.back_nodes[current_box])[1:])
+                self.corridor = corridor
+                if stats is not None:
+                    stats.record(self.algorithm, True, started, looked_up, len(expanded), pops, pops + len(queue), frontier)
+                return None
+
+            current_node = nodes[current_box]
+            prev_point = current_node[0]
+            current_cost = costs[current_box]
+            for edge in range(offsets[current_box], offsets[current_box + 1]):
+                neighbor = neighbors[edge]
+                middle_point, length = cross_portal(prev_point, portals[edge])
+                cost_to_neighbor = current_cost + length * box_costs[current_box]
+                if cost_to_neighbor < costs[neighbor]:
+                    if costs[neighbor] == inf:
+                        touched.append(neighbor)
+                    costs[neighbor] = cost_to_neighbor
+                    nodes[neighbor] = (middle_point, current_node, neighbor)
+                    estimate = cost_floor * heuristic(middle_point, goal_point)
+                    if bounds is not None:
+                        estimate = max(estimate, bounds[edge])
+                    heappush(queue, (cost_to_neighbor + weight * estimate,
+                                     self.tie(cost_to_neighbor) if tie_break else 0, neighbor, direction))
+
+        if stats is not None:
+            stats.record(self.algorithm, False, started, looked_up, len(expanded), pops, pops, frontier)
+        return False
+
+def get_search (mesh, algorithm='bidirectional', weight=1.0, tie_break='id', landmarks=None):
+    # one PathSearch per compiled mesh and thread, set to this call's options, so
+    # repeated queries reuse its buffers and threads never share them (like nm_service)
+    mesh = as_compiled(mesh)
+    local = mesh.get('search')
+    if local is None:
+        local = mesh.setdefault('search', threading.local())
+    search = getattr(local, 'search', None)
+    if search is None:
+        search = local.search = PathSearch(mesh, algorithm, weight, tie_break, landmarks)
+    else:
+        search.configure(algorithm, weight, tie_break, landmarks)
+    return search
+
 # MAIN FUNCTION ==============================================================
-def find_path (source_point, destination_point, mesh):
+def find_path (source_point, destination_point, mesh, cache=None, stats=None,
+               algorithm=None, weight=1.0, tie_break='id', landmarks=None, smooth=False):
 
     """
     Searches for a path from source_point to destination_point through the mesh
@@ -280,22 +1265,186 @@ def find_path (source_point, destination_point, mesh):
         source_point: starting point of the pathfinder
         destination_point: the ultimate goal the pathfinder must reach
         mesh: pathway constraints the path adheres to
+        cache: optional nm_pathcache.PathCache that answers repeated box pairs, or an
+            nm_flowfield.FlowFieldCache for many agents sharing destinations. A cache
+            finds its corridors with its own dijkstra (from the source point, or over
+            the flow field's center-to-center costs), so its paths can differ from the
+            default bidirectional search's, and it takes none of the options below
+        stats: optional SearchStats the search (or the cache) fills in
+        algorithm: one of ALGORITHMS, run through a PathSearch reused across calls;
+            bidirectional when left out
+        weight, tie_break, landmarks: PathSearch options
+        smooth: pull the path taut through its box corridor with string_pull, so it
+            only bends at box corners instead of zig-zagging between borders. The
+            corridor already accounts for terrain costs; smoothing only shortens it
 
     Returns:
 
         A path (list of points) from source_point to destination_point if exists
-        A list of boxes explored by the algorithm
+        A list of boxes explored by the algorithm; with a cache, the boxes this call
+        searched, which is none at all on a cache hit
     """
 
+    if cache is not None:
+        if algorithm is not None or weight != 1.0 or tie_break != 'id' or landmarks is not None:
+            raise ValueError("a cache searches with its own dijkstra, "
+                             "algorithm, weight, tie_break and landmarks do not apply to it")
+        path, boxes = cache.find_path(source_point, destination_point, mesh, stats)
+        if smooth and path:
+            path = string_pull(source_point, destination_point, cache.corridor, cache.mesh)
+        return path, boxes
+
     path = [] # list of points
     boxes = {} # dictionary of explored boxes -> distance value
     
     # test_mesh (mesh)
     
-    # breadth_first_search (source_point, destination_point, mesh, path, boxes)
-    # dijkstra (source_point, destination_point, mesh, path, boxes)
-    # aStar (source_point, destination_point, mesh, path, boxes)
-    bidirectional (source_point, destination_point, mesh, path, boxes)
+    search = get_search(mesh, algorithm or 'bidirectional', weight, tie_break, landmarks)
+    search.search(source_point, destination_point, path, boxes, stats)
+    if smooth and search.corridor:
+        path[:] = string_pull(source_point, destination_point, search.corridor, search.mesh)
     
     return path, boxes.keys()
 
+
+# =============================================================================
+# BATCH QUERIES ===============================================================
+# =============================================================================
+
+def grow_tree (source_point, source_box, targets, mesh, costs, parents, entries, touched, settled=None):
+    # dijkstra from source_box until every target box is settled, filling the shared
+    # buffers and recording each id it writes in touched so they can be reset later.
+    # settled, if given, collects the boxes in the order they were settled
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    portals = mesh['portal_rows']
+    box_costs = mesh['cost_view']
+    remaining = set(targets)
+    
+    costs[source_box] = 0
+    entries[source_box] = source_point
+    touched.append(source_box)
+    queue = [(0, source_box)]
+    
+    while queue and remaining:
+        priority, current_box = heappop(queue)
+        if priority > costs[current_box]:
+            continue # stale entry, this box was settled with a lower cost
+        remaining.discard(current_box)
+        if settled is not None:
+            settled.append(current_box)
+        
+        prev_point = entries[current_box]
+        for edge in range(offsets[current_box], offsets[current_box + 1]):
+            neighbor = neighbors[edge]
+            middle_point, length = cross_portal(prev_point, portals[edge])
+            cost_to_neighbor = priority + length * box_costs[current_box]
+            if cost_to_neighbor < costs[neighbor]:
+                if costs[neighbor] == inf:
+                    touched.append(neighbor)
+                costs[neighbor] = cost_to_neighbor
+                parents[neighbor] = current_box
+                entries[neighbor] = middle_point
+                heappush(queue, (cost_to_neighbor, neighbor))
+
+def grow_box_tree (source_box, targets, mesh, weights, costs, parents, touched):
+    # grow_tree over center-to-center costs (weights is mesh['edge_costs'] as a list),
+    # like the precomputed tables: the tree belongs to the box, not to a point in it
+    offsets, neighbors = mesh['adj_offsets'], mesh['adj_neighbors']
+    remaining = set(targets)
+    
+    costs[source_box] = 0
+    touched.append(source_box)
+    queue = [(0, source_box)]
+    
+    while queue and remaining:
+        priority, current_box = heappop(queue)
+        if priority > costs[current_box]:
+            continue # stale entry, this box was settled with a lower cost
+        remaining.discard(current_box)
+        
+        for edge in range(offsets[current_box], offsets[current_box + 1]):
+            neighbor = neighbors[edge]
+            cost_to_neighbor = priority + weights[edge]
+            if cost_to_neighbor < costs[neighbor]:
+                if costs[neighbor] == inf:
+                    touched.append(neighbor)
+                costs[neighbor] = cost_to_neighbor
+                parents[neighbor] = current_box
+                heappush(queue, (cost_to_neighbor, neighbor))
+
+def trace_corridor (parents, box_id):
+    # box ids from the tree root to box_id
+    corridor = []
+    while box_id >= 0:
+        corridor.append(box_id)
+        box_id = parents[box_id]
+    corridor.reverse()
+    return corridor
+
+def reset_tree (costs, parents, entries, touched):
+    # entries is None for grow_box_tree's trees, which keep no entry points
+    for box_id in touched:
+        costs[box_id] = inf
+        parents[box_id] = -1
+    if entries is not None:
+        for box_id in touched:
+            entries[box_id] = None
+    touched.clear()
+
+def find_paths (pairs, mesh):
+
+    """
+    Answers many (source_point, destination_point) queries against one mesh
+
+    Every endpoint is resolved to a box in a single vectorized pass, and queries
+    leaving from the same box share one dijkstra tree. The tree is rooted at the
+    box and priced over center-to-center costs like the precomputed tables, so
+    every query from a box gets the same corridor whichever source point it has,
+    and that corridor can differ from the one find_path's point-based dijkstra
+    picks. Each query then clamps its waypoints along the corridor from its own
+    source point, so they all stay inside the mesh.
+
+    Args:
+        pairs: sequence of (source_point, destination_point)
+        mesh: compiled or legacy mesh
+
+    Returns:
+
+        A list of paths (lists of points) in the order of pairs, an empty list
+        where no path exists. A path has the shape find_path's dijkstra gives it:
+        the source point twice, the waypoints, then the destination point
+    """
+
+    mesh = as_compiled(mesh)
+    pairs = list(pairs)
+    results = [[] for _ in pairs]
+    if not pairs:
+        return results
+    
+    endpoints = locate_boxes([point for pair in pairs for point in pair], mesh).tolist()
+    groups = {}
+    for i, (source_box, destination_box) in enumerate(zip(endpoints[0::2], endpoints[1::2])):
+        if source_box >= 0 and destination_box >= 0:
+            groups.setdefault(source_box, []).append(i)
+    
+    # one set of search buffers for the whole batch, reset between trees
+    count = len(mesh['rows'])
+    costs = [inf] * count
+    parents = [-1] * count
+    touched = []
+    weights = mesh['edge_costs'].tolist()
+    
+    for source_box, members in groups.items():
+        targets = [endpoints[2 * i + 1] for i in members]
+        grow_box_tree(source_box, targets, mesh, weights, costs, parents, touched)
+        
+        for i in members:
+            box_id = endpoints[2 * i + 1]
+            if costs[box_id] == inf:
+                continue # unreachable from this source box
+            corridor = trace_corridor(parents, box_id)
+            results[i] = [pairs[i][0]] + clamp_corridor(pairs[i][0], pairs[i][1], corridor, mesh['rows'])
+        
+        reset_tree(costs, parents, None, touched)
+    
+    return results
@@ -0,0 +1,177 @@
+from heapq import heappop, heappush
+from math import inf
+
+import nm_pathfinder
+from nm_meshcompiler import as_compiled, find_box_id
+
+
+class DStarLite:
+
+    """
+    Incremental planner for one agent heading to a fixed destination (D* Lite)
+
+    The search runs backwards from the destination box over the compiled mesh,
+    with its symmetric center-to-center 'edge_costs' (terrain included) and a
+    center distance heuristic scaled by 'cost_floor', and keeps its g/rhs
+    values by box id between calls. After the agent moves only the key
+    modifier changes; after nm_meshupdate edits the mesh (patching its compiled
+    form, so ids stay stable), mesh_changed repairs the values around the
+    edited boxes, and the next find_path only re-expands what the edit made
+    inconsistent.
+    """
+
+    def __init__ (self, mesh, destination_point):
+        self.mesh = as_compiled(mesh)
+        self.destination_point = destination_point
+        self.expansions = 0         # boxes popped from the queue, over the planner's lifetime
+        self.restart()
+
+    def restart (self):
+        # drops all state, needed when the destination box itself goes away
+        # or an edit lowers the cost floor the keys were computed with
+        self.g = {}
+        self.rhs = {}
+        self.parents = {}           # box -> neighbor its rhs came through
+        self.children = {}          # box -> boxes whose rhs came through it
+        self.queue = []
+        self.queued = {}            # box -> its current key; heap entries with another key are stale
+        self.km = 0
+        self.last = None
+        self.cost_floor = self.mesh['cost_floor']
+        self.weights = memoryview(self.mesh['edge_costs'])
+        self.goal = nm_pathfinder.locate_box(self.destination_point, self.mesh)
+        self.start = None
+        if self.goal is not None:
+            self.rhs[self.goal] = 0
+            self.push(self.goal)
+
+    def heuristic (self, a, b):
+        rows = self.mesh['rows']
+        (ax1, ax2, ay1, ay2), (bx1, bx2, by1, by2) = rows[a], rows[b]
+        return self.cost_floor * nm_pathfinder.heuristic(((ax1 + ax2) / 2, (ay1 + ay2) / 2),
+                                                         ((bx1 + bx2) / 2, (by1 + by2) / 2))
+
+    def key (self, box):
+        best = min(self.g.get(box, inf), self.rhs.get(box, inf))
+        start = self.start if self.start is not None else self.goal
+        return (best + self.heuristic(start, box) + self.km, best)
+
+    def push (self, box):
+        key = self.key(box)
+        self.queued[box] = key
+        heappush(self.queue, (key, box))
+
+    def set_parent (self, box, parent):
+        old = self.parents.pop(box, None)
+        if old in self.children:
+            self.children[old].discard(box)
+        if parent is not None:
+            self.parents[box] = parent
+            self.children.setdefault(parent, set()).add(box)
+
+    def update_box (self, box):
+        if box != self.goal:
+            best, parent = inf, None
+            offsets, neighbors, weights = self.mesh['adj_offsets'], self.mesh['adj_neighbors'], self.weights
+            g = self.g
+            for edge in range(offsets[box], offsets[box + 1]):
+                neighbor = neighbors[edge]
+                cost = g.get(neighbor, inf) + weights[edge]
+                if cost < best:
+                    best, parent = cost, neighbor
+            self.rhs[box] = best
+            self.set_parent(box, parent)
+        if self.g.get(box, inf) != self.rhs.get(box, inf):
+            self.push(box)
+        else:
+            self.queued.pop(box, None)
+
+    def compute (self):
+        offsets, neighbors = self.mesh['adj_offsets'], self.mesh['adj_neighbors']
+        g, rhs = self.g, self.rhs
+        start = self.start
+        while self.queue:
+            key, box = self.queue[0]
+            if self.queued.get(box) != key:
+                heappop(self.queue)
+                continue
+            if not (key < self.key(start) or rhs.get(start, inf) != g.get(start, inf)):
+                break
+
+            heappop(self.queue)
+            self.expansions += 1
+            new_key = self.key(box)
+            if key < new_key:
+                self.queued[box] = new_key
+                heappush(self.queue, (new_key, box))
+            elif g.get(box, inf) > rhs.get(box, inf):
+                g[box] = rhs[box]
+                del self.queued[box]
+                for edge in range(offsets[box], offsets[box + 1]):
+                    self.update_box(neighbors[edge])
+            else:
+                g[box] = inf
+                self.update_box(box)
+                for edge in range(offsets[box], offsets[box + 1]):
+                    self.update_box(neighbors[edge])
+
+    def mesh_changed (self, removed, added):
+        # takes the two box lists nm_meshupdate.update_mesh returns, after it has
+        # patched the compiled mesh this planner searches
+        retired = self.mesh.get('retired', {})
+        removed = [retired[box] for box in removed]
+        if self.goal is None or self.goal in removed or self.mesh['cost_floor'] < self.cost_floor:
+            self.restart()
+            return
+
+        self.weights = memoryview(self.mesh['edge_costs'])
+        offsets, neighbors = self.mesh['adj_offsets'], self.mesh['adj_neighbors']
+        affected = set()
+        for box in removed:
+            self.g.pop(box, None)
+            self.rhs.pop(box, None)
+            self.queued.pop(box, None)
+            self.set_parent(box, None)
+            affected.update(self.children.pop(box, ()))
+        for box in added:
+            box = find_box_id(self.mesh, box)
+            affected.add(box)
+            affected.update(neighbors[edge] for edge in range(offsets[box], offsets[box + 1]))
+        for box in affected.difference(removed):
+            self.update_box(box)
+
+    def find_path (self, source_point):
+        # same return shape as nm_pathfinder.find_path: the path and the corridor boxes
+        if self.goal is None:
+            return [], []
+        start = nm_pathfinder.locate_box(source_point, self.mesh)
+        if start is None:
+            return [], []
+
+        # the agent moved: keys already in the queue are too low by at most this much
+        if self.last is not None and start != self.last:
+            self.km += self.heuristic(self.last, start)
+        self.start = self.last = start
+        self.compute()
+
+        if self.g.get(start, inf) == inf:
+            return [], []
+
+        # follow the cheapest neighbor downhill to the destination box
+        offsets, neighbors, weights = self.mesh['adj_offsets'], self.mesh['adj_neighbors'], self.weights
+        corridor = [start]
+        box = start
+        while box != self.goal and len(corridor) <= len(self.g):
+            edge = min(range(offsets[box], offsets[box + 1]),
+                       key=lambda edge: self.g.get(neighbors[edge], inf) + weights[edge])
+            box = neighbors[edge]
+            corridor.append(box)
+        if box != self.goal:
+            return [], []
+
+        rows = self.mesh['rows']
+        path = [source_point]
+        for box in corridor[1:]:
+            nm_pathfinder.append_path(path[-1], rows[box], path)
+        path.append(self.destination_point)
+        return path, [rows[box] for box in corridor]
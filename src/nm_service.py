@@ -0,0 +1,313 @@
+import asyncio
+import json
+import pickle
+import sys
+import threading
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from math import inf
+
+import nm_meshfile
+import nm_parallel
+import nm_pathfinder
+from nm_meshcompiler import as_compiled
+from nm_pathfinder import FAILED, FOUND
+
+
+EXPIRED, OVERLOADED = 'expired', 'overloaded'
+
+# upper bucket edges, in seconds; anything slower lands in a last open bucket
+LATENCY_BOUNDS = [0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0]
+
+
+class LatencyHistogram:
+
+    def __init__ (self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record (self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile (self, fraction):
+        # upper edge of the bucket holding the nearest-rank sample, max for the open bucket
+        rank = max(1, int(fraction * self.count + 0.999999))
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary (self):
+        return {'count': self.count,
+                'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+                'p50_ms': self.percentile(0.5) * 1000, 'p90_ms': self.percentile(0.9) * 1000,
+                'p99_ms': self.percentile(0.99) * 1000, 'max_ms': self.max * 1000,
+                'buckets': [[bound * 1000, count] for bound, count in zip(self.bounds + [inf], self.counts)]}
+
+
+class PathService:
+
+    """
+    Asyncio front end that serves path queries against one mesh
+
+    Queries wait in a bounded queue; when it is full a query is answered
+    OVERLOADED at once instead of piling up. A query for the same (source box,
+    destination box) pair as one already queued or running joins it, so the
+    pair is searched once and every caller gets waypoints clamped from its
+    own points. A job whose callers have all given up by the time it leaves
+    the queue is dropped without being searched. Searches run on a thread
+    pool, or with processes=True on a process pool over the shared-memory
+    mesh of nm_parallel, so the event loop stays free to accept queries.
+
+    Args:
+        mesh: compiled or legacy mesh, loaded once
+        workers: searches running at the same time
+        queue_size: jobs that may wait for a worker
+        algorithm: one of nm_pathfinder.ALGORITHMS
+        smooth: string-pull every path, as find_path(smooth=True)
+        processes: search in worker processes instead of threads
+    """
+
+    def __init__ (self, mesh, workers=1, queue_size=64, algorithm='bidirectional', smooth=False, processes=False):
+        if algorithm not in nm_pathfinder.ALGORITHMS:
+            raise ValueError("unknown algorithm %r, expected one of %s" % (algorithm, nm_pathfinder.ALGORITHMS))
+        self.mesh = as_compiled(mesh)
+        self.workers = workers
+        self.queue_size = queue_size
+        self.algorithm = algorithm
+        self.smooth = smooth
+        self.processes = processes
+        self.local = threading.local()      # one PathSearch per worker thread, their buffers are not shared
+        self.blocks = []
+        self.executor = None
+        self.queue = None
+        self.tasks = []
+        self.jobs = {}                      # (source box, destination box) -> job queued or running
+        self.counts = dict.fromkeys(['queries', FOUND, FAILED, EXPIRED, OVERLOADED,
+                                     'coalesced', 'searched', 'dropped'], 0)
+        self.latency = LatencyHistogram()   # whole query, as the caller sees it
+        self.search_latency = LatencyHistogram()  # one search on the pool, queueing excluded
+
+    async def start (self):
+        if self.processes:
+            self.blocks, descriptor = nm_parallel.share_mesh(self.mesh)
+            self.executor = ProcessPoolExecutor(self.workers, initializer=nm_parallel.attach_mesh,
+                                                initargs=(descriptor,))
+        else:
+            self.executor = ThreadPoolExecutor(self.workers)
+        self.queue = asyncio.Queue(self.queue_size)
+        self.tasks = [asyncio.create_task(self.dispatch()) for _ in range(self.workers)]
+
+    async def close (self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # jobs still queued never reached a dispatcher
+        for job in self.jobs.values():
+            if not job['result'].done():
+                job['result'].set_result(None)
+        self.jobs.clear()
+        self.executor.shutdown()
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    async def __aenter__ (self):
+        await self.start()
+        return self
+
+    async def __aexit__ (self, *exc_info):
+        await self.close()
+
+    def search_corridor (self, source_point, destination_point):
+        # runs on a pool thread
+        search = getattr(self.local, 'search', None)
+        if search is None:
+            search = nm_pathfinder.PathSearch(self.mesh, self.algorithm)
+            self.local.search = search
+        search.search(source_point, destination_point, [], {})
+        return search.corridor
+
+    async def dispatch (self):
+        loop = asyncio.get_running_loop()
+        if self.processes:
+            search, options = nm_parallel.solve_corridor, (self.algorithm,)
+        else:
+            search, options = self.search_corridor, ()
+
+        while True:
+            job = await self.queue.get()
+            try:
+                if loop.time() >= job['deadline']:
+                    # every caller of this job has timed out already; None tells them it expired
+                    self.counts['dropped'] += 1
+                    job['result'].set_result(None)
+                    continue
+                started = loop.time()
+                try:
+                    corridor = await loop.run_in_executor(self.executor, search, job['source_point'],
+                                                          job['destination_point'], *options)
+                except Exception as e:
+                    job['result'].set_exception(e)
+                    continue
+                self.search_latency.record(loop.time() - started)
+                self.counts['searched'] += 1
+                job['result'].set_result(corridor)
+            finally:
+                # cancelled by close() mid-search: answer EXPIRED rather than leave callers waiting forever
+                if not job['result'].done():
+                    job['result'].set_result(None)
+                del self.jobs[job['key']]
+                self.queue.task_done()
+
+    async def find_path (self, source_point, destination_point, timeout=None):
+        """
+        Answers one query
+
+        Args:
+            source_point, destination_point: as in nm_pathfinder.find_path
+            timeout: seconds the caller is willing to wait, None to wait for the answer
+
+        Returns:
+
+            A dict with 'status' (FOUND, FAILED, EXPIRED or OVERLOADED), 'path'
+            (empty unless FOUND), 'latency' in seconds and 'coalesced', true when
+            the query joined a search another query had already asked for
+        """
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + timeout if timeout is not None else inf
+        self.counts['queries'] += 1
+
+        status, path, coalesced = FAILED, [], False
+        source_box = nm_pathfinder.locate_box(source_point, self.mesh)
+        destination_box = nm_pathfinder.locate_box(destination_point, self.mesh)
+        if (source_box is not None) and (destination_box is not None):
+            key = (source_box, destination_box)
+            job = self.jobs.get(key)
+            if job is not None:
+                coalesced = True
+                self.counts['coalesced'] += 1
+                job['deadline'] = max(job['deadline'], deadline)
+            elif self.queue.full():
+                status = OVERLOADED
+            else:
+                job = {'key': key, 'source_point': source_point, 'destination_point': destination_point,
+                       'deadline': deadline, 'result': loop.create_future()}
+                self.jobs[key] = job
+                self.queue.put_nowait(job)
+
+            if job is not None:
+                try:
+                    # shielded: one caller giving up must not cancel the search for the others
+                    corridor = await asyncio.wait_for(asyncio.shield(job['result']),
+                                                      None if timeout is None else max(0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    corridor = None
+                if corridor is None:
+                    status = EXPIRED
+                elif corridor:
+                    status, path = FOUND, self.corridor_path(source_point, destination_point, corridor)
+
+        latency = loop.time() - started
+        self.counts[status] += 1
+        self.latency.record(latency)
+        return {'status': status, 'path': path, 'latency': latency, 'coalesced': coalesced}
+
+    def corridor_path (self, source_point, destination_point, corridor):
+        if self.smooth:
+            return nm_pathfinder.string_pull(source_point, destination_point, corridor, self.mesh)
+        return nm_pathfinder.clamp_corridor(source_point, destination_point, corridor, self.mesh['rows'])
+
+    def stats (self):
+        return dict(self.counts, queued=self.queue.qsize() if self.queue is not None else 0,
+                    latency=self.latency.summary(), search_latency=self.search_latency.summary())
+
+
+# =============================================================================
+# LOCAL SOCKET ================================================================
+# =============================================================================
+#
+# one JSON object per line each way:
+#     {"id": 1, "source": [x, y], "destination": [x, y], "timeout": 0.05}
+#  -> {"id": 1, "status": "found", "path": [[x, y], ...], "latency_ms": 1.2}
+#     {"id": 2, "stats": true}
+#  -> {"id": 2, "stats": {...}}
+# replies come back in the order queries finish, matched up by id
+
+async def handle_client (service, reader, writer):
+    pending = set()
+
+    async def answer (request):
+        try:
+            if request.get('stats'):
+                reply = {'stats': service.stats()}
+            else:
+                result = await service.find_path(tuple(request['source']), tuple(request['destination']),
+                                                 request.get('timeout'))
+                reply = {'status': result['status'], 'path': [list(point) for point in result['path']],
+                         'latency_ms': result['latency'] * 1000}
+        except (KeyError, TypeError, ValueError) as e:
+            reply = {'status': 'error', 'error': str(e)}
+        reply['id'] = request.get('id')
+        writer.write((json.dumps(reply) + '\n').encode())
+
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                writer.write((json.dumps({'status': 'error', 'error': str(e)}) + '\n').encode())
+                continue
+            task = asyncio.create_task(answer(request))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            await writer.drain()
+        await asyncio.gather(*pending)
+        await writer.drain()
+    finally:
+        writer.close()
+
+async def serve (service, path):
+    # unix domain socket at path, nothing is exposed on the network
+    return await asyncio.start_unix_server(lambda reader, writer: handle_client(service, reader, writer), path)
+
+
+async def main (mesh_filename, socket_path, workers):
+    if mesh_filename.endswith('.bin'):
+        mesh = nm_meshfile.load_mesh(mesh_filename)
+    else:
+        with open(mesh_filename, 'rb') as f:
+            mesh = pickle.load(f)
+
+    async with PathService(mesh, workers=workers, processes=workers > 1) as service:
+        server = await serve(service, socket_path)
+        print("Serving %s on %s with %d workers." % (mesh_filename, socket_path, workers))
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (3, 4):
+        print("usage: %s map.mesh.pickle|map.mesh.bin socket_path [workers]" % sys.argv[0])
+        sys.exit(-1)
+
+    try:
+        asyncio.run(main(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) == 4 else 1))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,150 @@
+import sys
+
+import numpy
+
+from nm_meshbuilder import scan_region
+from nm_meshcompiler import from_arrays
+
+
+def open_bitmap(filename, shape=None):
+    # maps the thresholded map without reading it: .npy files carry their own
+    # shape, raw files are uint8 rows of the given (height, width)
+    if filename.endswith('.npy'):
+        return numpy.load(filename, mmap_mode='r')
+    return numpy.memmap(filename, dtype=numpy.uint8, mode='r', shape=shape)
+
+
+def seam_edges(first_side, second_side, lo, hi):
+    # boxes facing each other across a tile seam are adjacent when their ranges
+    # along the seam overlap or touch, the same rule stitch uses inside a tile.
+    # both sides are sorted along the seam, so one sweep finds every pair
+    edges = []
+    i, j = 0, 0
+    while i < len(first_side) and j < len(second_side):
+        f, s = first_side[i], second_side[j]
+        if f[lo] <= s[hi] and s[lo] <= f[hi]:
+            edges.append((f, s))
+        if f[hi] < s[hi]:
+            i += 1
+        elif f[hi] > s[hi]:
+            j += 1
+        else:
+            i += 1
+            j += 1
+    return edges
+
+
+def corner_edges(first_side, second_side, y):
+    # diagonal tiles only meet at one point of the x seam, at column y. The box
+    # ending the first side and the one starting the second meet there when both
+    # reach y, and touching corners are adjacent inside a tile too
+    if first_side and second_side:
+        f, s = first_side[-1], second_side[0]
+        if f[2] <= y <= f[3] and s[2] <= y <= s[3]:
+            return [(f, s)]
+    return []
+
+
+def build_mesh_tiled(image, min_feature_size, tile_size, out_prefix):
+    """
+    Builds a mesh one tile at a time and streams it to disk
+
+    Only one tile of pixels is read at a time, and only the boxes along the
+    previous row of tiles are kept for stitching. Boxes never merge across a
+    seam; boxes facing each other across one get an edge instead, as do boxes
+    meeting only at the corner where four tiles meet.
+
+    Args:
+        image: 2d uint8 array, usually a memmap from open_bitmap
+        min_feature_size: as in build_mesh
+        tile_size: side of the square tiles, in pixels
+        out_prefix: writes out_prefix.boxes (n x 4) and out_prefix.edges (m x 2 box ids),
+            both flat little-endian int32
+
+    Returns:
+
+        The number of boxes and edges written
+    """
+
+    height, width = image.shape
+    box_count, edge_count = 0, 0
+    above = {}  # tile column -> x2 side of the tile above, and the ids of its boxes
+
+    with open(out_prefix + '.boxes', 'wb') as boxes_file, open(out_prefix + '.edges', 'wb') as edges_file:
+        for tx in range(0, height, tile_size):
+            left = above_left = None
+            for column, ty in enumerate(range(0, width, tile_size)):
+
+                tile = numpy.asarray(image[tx:tx + tile_size, ty:ty + tile_size])
+                sides, edges = scan_region(tile, min_feature_size, (tx, ty))
+
+                ids = {}
+                for a, b in edges:
+                    ids.setdefault(a, box_count + len(ids))
+                    ids.setdefault(b, box_count + len(ids))
+                for side in sides:
+                    for box in side:
+                        ids.setdefault(box, box_count + len(ids))
+                box_count += len(ids)
+
+                pairs = [(ids[a], ids[b]) for a, b in edges]
+                if column in above:
+                    side, side_ids = above[column]
+                    pairs.extend((side_ids[a], ids[b]) for a, b in seam_edges(side, sides[0], 2, 3))
+                if left is not None:
+                    side, side_ids = left
+                    pairs.extend((side_ids[a], ids[b]) for a, b in seam_edges(side, sides[2], 0, 1))
+                # the tiles above-left and above-right touch this one at its top corners
+                if above_left is not None:
+                    side, side_ids = above_left
+                    pairs.extend((side_ids[a], ids[b]) for a, b in corner_edges(side, sides[0], ty))
+                if column + 1 in above:
+                    side, side_ids = above[column + 1]
+                    corner = min(ty + tile_size, width)
+                    # read right to left, so the boxes at that corner come last and first
+                    pairs.extend((side_ids[a], ids[b]) for a, b in corner_edges(side[::-1], sides[0][::-1], corner))
+                edge_count += len(pairs)
+
+                boxes_file.write(numpy.array(list(ids), dtype='<i4').reshape(-1, 4).tobytes())
+                edges_file.write(numpy.array(pairs, dtype='<i4').reshape(-1, 2).tobytes())
+
+                above_left = above.get(column)
+                above[column] = sides[1], {box: ids[box] for box in sides[1]}
+                left = sides[3], {box: ids[box] for box in sides[3]}
+
+    return box_count, edge_count
+
+
+def load_tiled_mesh(out_prefix):
+    # compiles the streamed boxes and edges, building the CSR adjacency with numpy
+    boxes = numpy.fromfile(out_prefix + '.boxes', dtype='<i4').reshape(-1, 4).astype(numpy.int32)
+    edges = numpy.fromfile(out_prefix + '.edges', dtype='<i4').reshape(-1, 2)
+
+    sources = numpy.concatenate((edges[:, 0], edges[:, 1]))
+    targets = numpy.concatenate((edges[:, 1], edges[:, 0]))
+    order = numpy.argsort(sources, kind='stable')
+    offsets = numpy.zeros(len(boxes) + 1, dtype=numpy.int32)
+    numpy.cumsum(numpy.bincount(sources, minlength=len(boxes)), out=offsets[1:])
+    neighbors = targets[order].astype(numpy.int32)
+
+    return from_arrays(boxes, offsets, neighbors)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 5:
+        filename, min_feature_size, tile_size, out_prefix = sys.argv[1:]
+        shape = None
+    elif len(sys.argv) == 7:
+        filename, min_feature_size, tile_size, out_prefix = sys.argv[1:5]
+        shape = (int(sys.argv[5]), int(sys.argv[6]))
+    else:
+        print("usage: %s bitmap.npy min_feature_size tile_size out_prefix" % sys.argv[0])
+        print("       %s bitmap.raw min_feature_size tile_size out_prefix height width" % sys.argv[0])
+        sys.exit(-1)
+
+    image = open_bitmap(filename, shape)
+    box_count, edge_count = build_mesh_tiled(image, int(min_feature_size), int(tile_size), out_prefix)
+
+    print("Built a tiled mesh with %d boxes and %d edges in %s.boxes / %s.edges."
+          % (box_count, edge_count, out_prefix, out_prefix))
@@ -0,0 +1,43 @@
+import os
+import pickle
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUT = os.path.join(ROOT, 'input')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import nm_pathfinder  # after the path insert above
+
+
+def load_pickle(name):
+    with open(os.path.join(INPUT, name), 'rb') as f:
+        return pickle.load(f)
+
+
+@pytest.fixture
+def homer_mesh():
+    return load_pickle('homer.png.mesh.pickle')
+
+
+@pytest.fixture
+def slug_mesh():
+    return load_pickle('ucsc_banana_slug.png.mesh.pickle')
+
+
+def box_center(box):
+    return ((box[0] + box[1]) / 2, (box[2] + box[3]) / 2)
+
+
+def connected_pairs(mesh, count, seed=0):
+    # (source_point, destination_point) at box centers that find_path can join
+    rng = random.Random(seed)
+    boxes = mesh['boxes']
+    pairs = []
+    while len(pairs) < count:
+        pair = box_center(rng.choice(boxes)), box_center(rng.choice(boxes))
+        if nm_pathfinder.find_path(pair[0], pair[1], mesh)[0]:
+            pairs.append(pair)
+    return pairs
@@ -0,0 +1,55 @@
+import numpy
+import pytest
+
+from nm_meshbuilder import build_mesh, build_mesh_parallel, scan_levels, scan_recursive, split_box
+
+
+def random_bitmaps(count, seed=0):
+    rng = numpy.random.default_rng(seed)
+    for _ in range(count):
+        shape = rng.integers(1, 24, size=2)
+        yield (rng.random(shape) < 0.6).astype(numpy.uint8) * 255
+
+
+@pytest.mark.parametrize('box', [(0, 2, 0, 1), (0, 2, 0, 2), (3, 5, 7, 8), (0, 1, 4, 6), (0, 3, 0, 3)])
+def test_split_box_never_returns_itself(box):
+    first, second, _ = split_box(box)
+    for part in (first, second):
+        assert part != box
+        assert part[0] < part[1] and part[2] < part[3]
+
+
+@pytest.mark.parametrize('min_feature_size', [0, 1, 2, 4])
+def test_small_feature_sizes_terminate_with_walkable_boxes(min_feature_size):
+    for image in random_bitmaps(30):
+        mesh = build_mesh(image, min_feature_size)
+        for x1, x2, y1, y2 in mesh['boxes']:
+            assert (image[x1:x2, y1:y2] == 255).all()
+
+
+@pytest.mark.parametrize('min_feature_size', [1, 4, 16])
+def test_parallel_build_matches_build_mesh(min_feature_size):
+    for image in random_bitmaps(10, seed=1):
+        assert build_mesh_parallel(image, min_feature_size, depth=2, workers=1) == build_mesh(image, min_feature_size)
+
+
+@pytest.mark.parametrize('with_terrain', [False, True])
+def test_level_scan_matches_recursive_scan(with_terrain):
+    rng = numpy.random.default_rng(2)
+    for _ in range(20):
+        # coarse blocks, so that halves line up and merge, plus some grey pixels
+        shape = rng.integers(1, 64, size=2)
+        image = numpy.kron(rng.choice([0, 128, 255, 255, 255], size=shape // 4 + 1), numpy.ones((4, 4), numpy.uint8))
+        image = image[:shape[0], :shape[1]].astype(numpy.uint8)
+        terrain = class_costs = None
+        if with_terrain:
+            terrain = numpy.kron(rng.integers(0, 3, size=shape // 8 + 1), numpy.ones((8, 8), numpy.uint8))
+            terrain = terrain[:shape[0], :shape[1]].astype(numpy.uint8)
+            class_costs = [1.0, 2.0, 5.0]
+        origin = tuple(rng.integers(0, 50, size=2).tolist())
+        results = []
+        for scan in (scan_recursive, scan_levels):
+            boxes, costs = set(), {} if with_terrain else None
+            sides, edges = scan(image, 4, origin, boxes, terrain, class_costs, costs)
+            results.append((sides, edges, boxes, costs))
+        assert results[0] == results[1]
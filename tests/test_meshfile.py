@@ -0,0 +1,73 @@
+import numpy
+import pytest
+
+import nm_meshfile
+import nm_pathfinder
+from conftest import connected_pairs
+from nm_hierarchy import get_hierarchy
+from nm_landmarks import get_landmarks
+from nm_meshcompiler import PRECOMPUTED, as_compiled
+from nm_nexthop import build_next_hop
+
+ARRAYS = ['boxes', 'offsets', 'neighbors', 'cell_offsets', 'cell_boxes', 'box_costs', 'portals', 'edge_costs']
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_round_trip_keeps_every_array(homer_mesh, tmp_path, mmap):
+    filename = str(tmp_path / 'homer.mesh.bin')
+    nm_meshfile.save_mesh(homer_mesh, filename)
+    loaded = nm_meshfile.load_mesh(filename, mmap=mmap)
+    compiled = as_compiled(homer_mesh)
+
+    for name in ARRAYS:
+        assert loaded[name].dtype == compiled[name].dtype, name
+        assert numpy.array_equal(loaded[name], compiled[name]), name
+    assert loaded['cell_size'] == compiled['cell_size']
+    assert loaded['grid_shape'] == compiled['grid_shape']
+    assert [loaded['rows'][i] for i in range(len(loaded['rows']))] == sorted(homer_mesh['boxes'])
+
+
+def test_loaded_mesh_finds_the_same_paths(homer_mesh, tmp_path):
+    filename = str(tmp_path / 'homer.mesh.bin')
+    nm_meshfile.save_mesh(homer_mesh, filename)
+    loaded = nm_meshfile.load_mesh(filename)
+    for source, destination in connected_pairs(homer_mesh, 20):
+        for smooth in (False, True):
+            assert (nm_pathfinder.find_path(source, destination, loaded, smooth=smooth)[0]
+                    == nm_pathfinder.find_path(source, destination, homer_mesh, smooth=smooth)[0])
+
+
+def test_round_trip_keeps_precomputed_tables(slug_mesh, tmp_path):
+    compiled = as_compiled(slug_mesh)
+    compiled['next_hop'] = build_next_hop(compiled)
+    hierarchy, landmarks = get_hierarchy(compiled), get_landmarks(compiled)
+    filename = str(tmp_path / 'slug.mesh.bin')
+    nm_meshfile.save_mesh(compiled, filename)
+    loaded = nm_meshfile.load_mesh(filename)
+
+    assert loaded['next_hop'].dtype == compiled['next_hop'].dtype
+    assert numpy.array_equal(loaded['next_hop'], compiled['next_hop'])
+    for key, value in hierarchy.items():
+        if isinstance(value, numpy.ndarray):
+            assert numpy.array_equal(loaded['hierarchy'][key], value), key
+        else:
+            assert loaded['hierarchy'][key] == value, key
+    assert list(loaded['hierarchy']['abstract']) == list(hierarchy['abstract'])
+    assert loaded['landmarks']['landmarks'] == landmarks['landmarks']
+    for key in ('distances', 'low', 'high'):
+        assert numpy.array_equal(loaded['landmarks'][key], landmarks[key]), key
+
+
+def test_mesh_without_tables_loads_none(homer_mesh, tmp_path):
+    filename = str(tmp_path / 'homer.mesh.bin')
+    nm_meshfile.save_mesh(homer_mesh, filename)
+    loaded = nm_meshfile.load_mesh(filename)
+    for key in PRECOMPUTED:
+        assert key not in loaded
+
+
+def test_rejects_other_files(tmp_path):
+    filename = tmp_path / 'not.mesh.bin'
+    filename.write_bytes(b'\0' * 128)
+    with pytest.raises(ValueError):
+        nm_meshfile.load_mesh(str(filename))
@@ -0,0 +1,128 @@
+import os
+import random
+
+import numpy
+import pytest
+from matplotlib.pyplot import imread
+
+import nm_pathfinder
+from conftest import INPUT, box_center
+from nm_meshbuilder import build_mesh
+from nm_meshcompiler import as_compiled, compile_mesh
+from nm_meshupdate import box_at, touching, update_mesh
+
+MIN_FEATURE_SIZE = 16
+
+
+@pytest.fixture
+def slug_image():
+    image = (imread(os.path.join(INPUT, 'ucsc_banana_slug.png')) * 255).astype(numpy.uint8)
+    return image[:, :, 0] if len(image.shape) > 2 else image
+
+
+def random_edits(mesh, image, count, seed=0):
+    # alternately blocks and clears small squares, like agents' obstacles coming and going
+    rng = random.Random(seed)
+    for number in range(count):
+        x, y = rng.randrange(image.shape[0] - 8), rng.randrange(image.shape[1] - 8)
+        size = rng.randrange(2, 8)
+        image[x:x + size, y:y + size] = 0 if number % 2 == 0 else 255
+        yield update_mesh(mesh, image, (x, x + size, y, y + size), MIN_FEATURE_SIZE)
+
+
+def edges_by_box(compiled, box_ids):
+    # {(box, neighbor box): (portal, edge cost)} over the given ids
+    rows, offsets, neighbors = compiled['rows'], compiled['offsets'], compiled['neighbors']
+    edges = {}
+    for box_id in box_ids:
+        for edge in range(offsets[box_id], offsets[box_id + 1]):
+            edges[rows[box_id], rows[neighbors[edge]]] = (tuple(compiled['portals'][edge].tolist()),
+                                                          round(float(compiled['edge_costs'][edge]), 9))
+    return edges
+
+
+def test_adjacency_stays_symmetric_and_walkable(slug_image):
+    mesh = build_mesh(slug_image, MIN_FEATURE_SIZE)
+    for removed, added in random_edits(mesh, slug_image, 100):
+        boxes = set(mesh['boxes'])
+        assert len(boxes) == len(mesh['boxes'])
+        assert set(mesh['adj']) == boxes
+        assert not boxes.intersection(set(removed) - set(added))
+        for box in added:
+            assert (slug_image[box[0]:box[1], box[2]:box[3]] == 255).all()
+            for neighbor in mesh['adj'][box]:
+                assert neighbor in boxes and touching(box, neighbor)
+        for box, neighbors in mesh['adj'].items():
+            for neighbor in neighbors:
+                assert box in mesh['adj'][neighbor]
+
+
+def test_patched_compiled_mesh_matches_a_fresh_compile(slug_image):
+    mesh = build_mesh(slug_image, MIN_FEATURE_SIZE)
+    compiled = as_compiled(mesh)
+    for _ in random_edits(mesh, slug_image, 40, seed=1):
+        assert mesh['compiled'] is compiled
+
+    live = sorted(set(compiled['cell_boxes'].tolist()))
+    assert sorted(compiled['rows'][box_id] for box_id in live) == sorted(mesh['boxes'])
+    fresh = compile_mesh({'boxes': mesh['boxes'], 'adj': mesh['adj']})
+    assert edges_by_box(compiled, live) == edges_by_box(fresh, range(len(fresh['rows'])))
+    for box_id in set(range(len(compiled['rows']))) - set(live):
+        assert compiled['offsets'][box_id] == compiled['offsets'][box_id + 1]
+    # the python copies the searches read follow the arrays
+    assert compiled['rows'] == [tuple(row) for row in compiled['boxes'].tolist()]
+    assert compiled['portal_rows'] == [tuple(row) for row in compiled['portals'].tolist()]
+    assert compiled['cost_view'] == compiled['box_costs'].tolist()
+
+
+def test_edits_reach_the_same_places_as_a_rebuild(slug_image):
+    mesh = build_mesh(slug_image, MIN_FEATURE_SIZE)
+    for _ in random_edits(mesh, slug_image, 100, seed=2):
+        pass
+    rebuilt = build_mesh(slug_image, MIN_FEATURE_SIZE)
+    # joins keep the mesh from fragmenting over many edits
+    assert len(mesh['boxes']) <= 1.1 * len(rebuilt['boxes'])
+
+    rng = random.Random(0)
+    xs, ys = numpy.nonzero(slug_image == 255)
+    for _ in range(100):
+        source, destination = rng.randrange(len(xs)), rng.randrange(len(xs))
+        source = (xs[source] + 0.5, ys[source] + 0.5)
+        destination = (xs[destination] + 0.5, ys[destination] + 0.5)
+        assert (bool(nm_pathfinder.find_path(source, destination, mesh)[0])
+                == bool(nm_pathfinder.find_path(source, destination, rebuilt)[0]))
+
+
+def test_kept_search_follows_patched_mesh(slug_image):
+    mesh = build_mesh(slug_image, MIN_FEATURE_SIZE)
+    compiled = as_compiled(mesh)
+    search = nm_pathfinder.get_search(mesh)
+    rng = random.Random(4)
+    for removed, added in random_edits(mesh, slug_image, 40, seed=3):
+        if not added:
+            continue
+        # a query into a box the edit added, which only the grown buffers can hold
+        source, destination = box_center(mesh['boxes'][0]), box_center(rng.choice(added))
+        for algorithm in nm_pathfinder.ALGORITHMS:
+            path, boxes = nm_pathfinder.find_path(source, destination, mesh, algorithm=algorithm)
+            fresh = nm_pathfinder.PathSearch(compiled, algorithm)
+            fresh_path, fresh_boxes = [], {}
+            fresh.search(source, destination, fresh_path, fresh_boxes)
+            assert path == fresh_path and list(boxes) == list(fresh_boxes)
+    assert nm_pathfinder.get_search(mesh) is search
+    assert len(search.costs) == len(compiled['rows'])
+
+
+def test_box_at_uses_the_patched_grid(slug_image):
+    mesh = build_mesh(slug_image, MIN_FEATURE_SIZE)
+    for _ in random_edits(mesh, slug_image, 40, seed=5):
+        pass
+    # the legacy dict keeps no index of its own beside the compiled grid
+    assert set(mesh) == {'boxes', 'adj', 'version', 'compiled'}
+    rng = random.Random(5)
+    for _ in range(500):
+        point = (rng.uniform(0, slug_image.shape[0]), rng.uniform(0, slug_image.shape[1]))
+        box = box_at(mesh, point)
+        holding = [other for other in mesh['boxes']
+                   if other[0] <= point[0] <= other[1] and other[2] <= point[1] <= other[3]]
+        assert box in holding if holding else box is None
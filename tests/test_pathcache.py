@@ -0,0 +1,40 @@
+import pytest
+
+import nm_pathfinder
+from conftest import connected_pairs
+from nm_flowfield import FlowFieldCache
+from nm_pathcache import PathCache
+
+
+def test_cached_paths_are_dijkstra_paths(homer_mesh):
+    cache = PathCache()
+    for source, destination in connected_pairs(homer_mesh, 20) * 2:
+        path, boxes = [], {}
+        nm_pathfinder.dijkstra(source, destination, homer_mesh, path, boxes)
+        del path[0]     # dijkstra lists the source point twice
+        assert nm_pathfinder.find_path(source, destination, homer_mesh, cache=cache)[0] == path
+    assert cache.hits == 20 and cache.misses == 20
+
+
+@pytest.mark.parametrize('cache_type', [PathCache, FlowFieldCache])
+def test_explored_boxes_and_stats(homer_mesh, cache_type):
+    (source, destination), = connected_pairs(homer_mesh, 1)
+    cache, stats = cache_type(), nm_pathfinder.SearchStats()
+
+    path, explored = nm_pathfinder.find_path(source, destination, homer_mesh, cache=cache, stats=stats)
+    uncached_path, uncached_explored = nm_pathfinder.find_path(source, destination, homer_mesh)
+    assert type(explored) is type(uncached_explored)
+    assert path[0] == source and path[-1] == destination
+    assert len(explored) > 0 and stats.expanded == len(explored) and stats.found == 1
+
+    # a hit searches nothing
+    path_again, explored = nm_pathfinder.find_path(source, destination, homer_mesh, cache=cache, stats=stats)
+    assert path_again == path and len(explored) == 0 and stats.expanded == 0 and stats.calls == 2
+
+
+@pytest.mark.parametrize('option', [{'algorithm': 'aStar'}, {'weight': 1.5}, {'tie_break': 'deep'},
+                                    {'landmarks': {}}])
+def test_cache_rejects_search_options(homer_mesh, option):
+    (source, destination), = connected_pairs(homer_mesh, 1)
+    with pytest.raises(ValueError):
+        nm_pathfinder.find_path(source, destination, homer_mesh, cache=PathCache(), **option)
@@ -0,0 +1,84 @@
+import random
+import sys
+import threading
+
+import pytest
+
+import nm_pathfinder
+from conftest import connected_pairs
+from nm_meshcompiler import as_compiled
+
+
+def inside_corridor(point, corridor):
+    return any(x1 - 1e-9 <= point[0] <= x2 + 1e-9 and y1 - 1e-9 <= point[1] <= y2 + 1e-9
+               for x1, x2, y1, y2 in corridor)
+
+
+@pytest.mark.parametrize('mesh_name', ['homer_mesh', 'slug_mesh'])
+@pytest.mark.parametrize('algorithm', ['breadth_first_search', 'aStar', 'bidirectional'])
+def test_string_pull_stays_inside_the_corridor(request, mesh_name, algorithm):
+    mesh = as_compiled(request.getfixturevalue(mesh_name))
+    search = nm_pathfinder.PathSearch(mesh, algorithm)
+    for source, destination in connected_pairs(mesh, 30):
+        search.search(source, destination, [], {})
+        corridor = [mesh['rows'][box_id] for box_id in search.corridor]
+        path = nm_pathfinder.string_pull(source, destination, search.corridor, mesh)
+        assert path[0] == source and path[-1] == destination
+        # sample every segment, corners of the corridor included
+        for start, end in zip(path, path[1:]):
+            for step in range(51):
+                t = step / 50
+                point = (start[0] + (end[0] - start[0]) * t, start[1] + (end[1] - start[1]) * t)
+                assert inside_corridor(point, corridor), (source, destination, point)
+
+
+def test_find_path_from_several_threads(homer_mesh):
+    pairs = connected_pairs(homer_mesh, 100)
+    expected = [nm_pathfinder.find_path(source, destination, homer_mesh)[0] for source, destination in pairs]
+    results = [None] * len(pairs)
+
+    def work(first):
+        for number in range(first, len(pairs), 4):
+            results[number] = nm_pathfinder.find_path(*pairs[number], homer_mesh)[0]
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    try:
+        threads = [threading.Thread(target=work, args=(first,)) for first in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert results == expected
+
+
+def test_locate_box_finds_the_box_the_linear_scan_finds(homer_mesh):
+    mesh = as_compiled(homer_mesh)
+    rng = random.Random(0)
+    x2, y2 = max(box[1] for box in homer_mesh['boxes']), max(box[3] for box in homer_mesh['boxes'])
+    # integer points land on shared borders, where the first box in list order wins
+    points = [(rng.randrange(x2 + 2), rng.randrange(y2 + 2)) for _ in range(2000)]
+    for point in points:
+        expected = nm_pathfinder.find_containing_box(point, homer_mesh['boxes'])
+        box_id = nm_pathfinder.locate_box(point, mesh)
+        assert (mesh['rows'][box_id] if box_id is not None else None) == expected
+        assert nm_pathfinder.locate_box(point, {'boxes': homer_mesh['boxes']}) == expected
+
+
+def test_find_paths_gives_each_source_box_one_corridor(homer_mesh):
+    mesh = as_compiled(homer_mesh)
+    pairs = connected_pairs(mesh, 40)
+    # a second source point in each source box, at its corner
+    corners = []
+    for source, destination in pairs:
+        x1, _, y1, _ = mesh['rows'][nm_pathfinder.locate_box(source, mesh)]
+        corners.append(((x1, y1), destination))
+    batched = nm_pathfinder.find_paths(pairs + corners, mesh)
+    alone = [nm_pathfinder.find_paths([pair], mesh)[0] for pair in corners]
+    assert batched[len(pairs):] == alone
+    for (source, destination), path in zip(pairs + corners, batched):
+        # the shape find_path's dijkstra gives
+        expected = nm_pathfinder.find_path(source, destination, mesh, algorithm='dijkstra')[0]
+        assert path[:2] == expected[:2] == [source, source] and path[-1] == expected[-1] == destination
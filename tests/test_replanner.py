@@ -0,0 +1,74 @@
+import os
+import random
+
+import numpy
+import pytest
+from matplotlib.pyplot import imread
+
+from conftest import INPUT
+from nm_flowfield import build_flow_field
+from nm_meshbuilder import build_mesh
+from nm_meshcompiler import as_compiled
+from nm_meshupdate import update_mesh
+from nm_replanner import DStarLite
+
+MIN_FEATURE_SIZE = 16
+
+
+@pytest.fixture
+def slug_image():
+    image = (imread(os.path.join(INPUT, 'ucsc_banana_slug.png')) * 255).astype(numpy.uint8)
+    return image[:, :, 0] if len(image.shape) > 2 else image
+
+
+def corridor_cost(mesh, corridor):
+    # sum of the edge costs along a corridor of box tuples
+    rows, offsets, neighbors = mesh['rows'], mesh['offsets'], mesh['neighbors']
+    ids = {rows[box_id]: box_id for box_id in set(mesh['cell_boxes'].tolist())}
+    cost = 0.0
+    for box, next_box in zip(corridor, corridor[1:]):
+        box_id = ids[box]
+        edges = range(offsets[box_id], offsets[box_id + 1])
+        cost += min(mesh['edge_costs'][edge] for edge in edges if neighbors[edge] == ids[next_box])
+    return cost
+
+
+def test_replanned_paths_cost_the_same_as_fresh_searches(slug_image):
+    mesh = build_mesh(slug_image, MIN_FEATURE_SIZE)
+    compiled = as_compiled(mesh)
+    rng = random.Random(3)
+    xs, ys = numpy.nonzero(slug_image == 255)
+
+    def walkable_point():
+        pixel = rng.randrange(len(xs))
+        return (xs[pixel] + 0.5, ys[pixel] + 0.5)
+
+    replanned = 0
+    for _ in range(20):
+        source, destination = walkable_point(), walkable_point()
+        planner = DStarLite(mesh, destination)
+        path, corridor = planner.find_path(source)
+        if len(path) < 3:
+            continue
+
+        # block a square on the path, then let the agent step along it
+        x, y = (int(v) for v in path[len(path) // 2])
+        rect = (x - 2, x + 2, y - 2, y + 2)
+        slug_image[rect[0]:rect[1], rect[2]:rect[3]] = 0
+        planner.mesh_changed(*update_mesh(mesh, slug_image, rect, MIN_FEATURE_SIZE))
+        source = path[1]
+
+        path, corridor = planner.find_path(source)
+        fresh_path, fresh_corridor = DStarLite(mesh, destination).find_path(source)
+        assert bool(path) == bool(fresh_path)
+        if not path:
+            continue
+        replanned += 1
+        assert path[0] == source and path[-1] == destination
+        cost = corridor_cost(compiled, corridor)
+        assert cost == pytest.approx(corridor_cost(compiled, fresh_corridor))
+
+        # and both are optimal over the same edge costs
+        field = build_flow_field(compiled, planner.goal)
+        assert cost == pytest.approx(field['costs'][planner.start])
+    assert replanned >= 10
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import nm_service
+from conftest import connected_pairs
+from nm_pathfinder import FOUND
+
+
+def slow_service(mesh, delay, **options):
+    # every search sleeps first, so queries are still in flight when the test acts
+    service = nm_service.PathService(mesh, **options)
+    search_corridor = service.search_corridor
+
+    def search(source_point, destination_point):
+        time.sleep(delay)
+        return search_corridor(source_point, destination_point)
+
+    service.search_corridor = search
+    return service
+
+
+def test_close_resolves_running_and_queued_queries(homer_mesh):
+    pairs = connected_pairs(homer_mesh, 6)
+
+    async def run():
+        service = slow_service(homer_mesh, 0.2, queue_size=16)
+        await service.start()
+        queries = [asyncio.create_task(service.find_path(source, destination)) for source, destination in pairs]
+        await asyncio.sleep(0.05)   # first query is running, the rest are queued
+        await service.close()
+        return await asyncio.wait_for(asyncio.gather(*queries), 5)
+
+    results = asyncio.run(run())
+    assert [result['status'] for result in results] == [nm_service.EXPIRED] * len(pairs)
+
+
+def test_deadline_expires_without_cancelling_shared_search(homer_mesh):
+    (source, destination), = connected_pairs(homer_mesh, 1)
+
+    async def run():
+        async with slow_service(homer_mesh, 0.1) as service:
+            impatient = asyncio.create_task(service.find_path(source, destination, timeout=0.01))
+            patient = asyncio.create_task(service.find_path(source, destination))
+            return await impatient, await patient, service.stats()
+
+    impatient, patient, stats = asyncio.run(run())
+    assert impatient['status'] == nm_service.EXPIRED
+    assert patient['status'] == FOUND and patient['coalesced']
+    assert patient['path'][0] == source and patient['path'][-1] == destination
+    assert stats['searched'] == 1
+
+
+def test_expired_job_is_dropped_unsearched(homer_mesh):
+    first, second = connected_pairs(homer_mesh, 2)
+
+    async def run():
+        async with slow_service(homer_mesh, 0.1) as service:
+            running = asyncio.create_task(service.find_path(*first))
+            await asyncio.sleep(0.01)
+            queued = await service.find_path(*second, timeout=0.01)
+            await running
+            await asyncio.sleep(0.01)
+            return queued, service.stats()
+
+    queued, stats = asyncio.run(run())
+    assert queued['status'] == nm_service.EXPIRED
+    assert stats['dropped'] == 1 and stats['searched'] == 1
@@ -0,0 +1,16 @@
+import numpy
+
+from nm_meshupdate import touching
+from nm_tiledbuilder import build_mesh_tiled, load_tiled_mesh
+
+
+def test_boxes_meeting_at_tile_corners_are_linked(tmp_path):
+    # one box per tile: each tile's box meets its diagonal tiles' boxes at one point
+    image = numpy.full((24, 20), 255, dtype=numpy.uint8)
+    build_mesh_tiled(image, 1, 8, str(tmp_path / 'mesh'))
+    mesh = load_tiled_mesh(str(tmp_path / 'mesh'))
+    rows, offsets, neighbors = mesh['rows'], mesh['offsets'], mesh['neighbors']
+    assert len(rows) == 9
+    for a in range(len(rows)):
+        linked = {rows[b] for b in neighbors[offsets[a]:offsets[a + 1]].tolist()}
+        assert linked == {rows[b] for b in range(len(rows)) if b != a and touching(rows[a], rows[b])}